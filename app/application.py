@@ -17,12 +17,13 @@ import sys
 import time
 import json
 import datetime
+import threading
 
 # Logging
 import logging
 
 # Flask
-from flask import Flask
+from flask import Flask, jsonify, abort, request, Response, stream_with_context
 
 #
 # project's related imports
@@ -31,6 +32,21 @@ from logger.logger import log, setLogLevel, getLogLevel
 # Settings
 import settings
 
+# decoder's state snapshots
+from lora.snapshot import SnapshotReader
+from lora.latestIndex import LatestValueReader
+from lora.uplinkArchive import ArchiveReader
+
+# decoding engine
+from lora.cayenneLPP import frame_from_text, decode_batch, DecodeError
+from lora.calibration import CalibrationTable
+
+# live stream of decoded measurements
+from comm.streamHub import StreamHub
+
+# runtime configuration (shared with the decoder)
+from config.runtimeConfig import RuntimeConfig
+
 
 
 # #############################################################################
@@ -39,24 +55,42 @@ import settings
 # (scope: this file)
 #
 
+# runtime configuration (MQTT settings not required here)
+config = RuntimeConfig.from_env( mqtt=False )
+
 # defined debug mode ?
-if( os.getenv("DEBUG")=='1' or os.getenv("DEBUG") is True ):
+if( config.debug ):
     log.info("DEBUG mode activation ...")
-    setLogLevel( logging.DEBUG )
-    # print all environment variables
-    print(os.environ)
+setLogLevel( config.log_level )
 
 # SIMULATION mode ?
 # note: read-only mode that does not modify any database nor file
-if( os.getenv("SIM")=='1' or os.getenv("SIM") is True ):
+SIM = config.sim
+if( SIM ):
     log.info("SIMULATION mode activated: read-only database ...")
-    SIM = True
-    time.sleep(1)
 
 
 # Flask app. declaration
 app = Flask(__name__)
 
+# frame counters written by the decoder
+frameCounters = SnapshotReader( config.frame_counter_snapshot )
+
+# latest values written by the decoder
+latestValues = LatestValueReader( config.latest_index_file ) if config.latest_index_file else None
+
+# raw uplinks archived by the decoder
+archive = ArchiveReader( config.archive_dir ) if config.archive_dir else None
+
+# per-device calibration (same file as the decoder)
+calibration = CalibrationTable( config.calibration_file )
+
+# live stream fan-out, fed by a single MQTT subscription per worker (started
+# along with the first stream client)
+streamHub = StreamHub( max_clients=settings.STREAM_MAX_CLIENTS, max_buffer=settings.STREAM_BUFFER )
+_streamSource = None
+_streamLock = threading.Lock()
+
 
 
 # #############################################################################
@@ -73,6 +107,212 @@ def hello_world():
     return "Hello World"
 
 
+#
+# Frame counters and losses of all devices
+@app.route('/devices/frames')
+def devices_frames():
+    _counters = frameCounters.read()
+    if( _counters is None ):
+        abort(503, description="frame counters not yet available")
+    return jsonify(_counters)
+
+
+#
+# Frame counters and losses of a device
+@app.route('/devices/<device>/frames')
+def device_frames(device):
+    _counters = frameCounters.read()
+    if( _counters is None ):
+        abort(503, description="frame counters not yet available")
+    if( device not in _counters ):
+        abort(404, description="unknown device '%s'" % device)
+    return jsonify(_counters[device])
+
+
+#
+# Latest values of a device
+@app.route('/devices/<device>/latest')
+def device_latest(device):
+    if( latestValues is None ):
+        abort(503, description="latest values disabled")
+    try:
+        _values = latestValues.device(device)
+    except OSError as ex:
+        abort(503, description="latest values not yet available")
+    if( _values is None ):
+        abort(404, description="unknown device '%s'" % device)
+    return jsonify(_values)
+
+
+#
+# Archived raw uplinks of a device: from / to (epoch) optional, streamed as JSON lines
+@app.route('/devices/<device>/uplinks')
+def device_uplinks(device):
+    if( archive is None ):
+        abort(503, description="uplinks archive disabled")
+    try:
+        _start = float(request.args['from']) if 'from' in request.args else None
+        _end = float(request.args['to']) if 'to' in request.args else None
+        _limit = min( int(request.args.get('limit', settings.ARCHIVE_API_MAX_FRAMES)), settings.ARCHIVE_API_MAX_FRAMES )
+    except ValueError:
+        abort(400, description="from / to: epoch expected, limit: integer expected")
+
+    def _frames():
+        for _count, _frame in enumerate( archive.frames(device, _start, _end) ):
+            if( _count >= _limit ):
+                break
+            yield json.dumps(_frame) + '\n'
+
+    return Response( stream_with_context(_frames()), mimetype='application/x-ndjson' )
+
+
+#
+# Latest values of all devices (optional device prefix)
+@app.route('/latest')
+def latest():
+    if( latestValues is None ):
+        abort(503, description="latest values disabled")
+    try:
+        _values = latestValues.prefix( request.args.get('prefix', '') )
+    except OSError as ex:
+        abort(503, description="latest values not yet available")
+    return jsonify(_values)
+
+
+
+#
+# Batch decoding of frames (hex or base64): JSON array or JSON lines body,
+# results streamed back as JSON lines (one per frame, same order)
+@app.route('/decode', methods=['POST'])
+def decode():
+    _encoding = request.args.get('encoding')
+    if( _encoding not in (None, 'hex', 'base64') ):
+        abort(400, description="unknown encoding '%s'" % _encoding)
+
+    if( request.mimetype in _JSONL_MIMETYPES ):
+        _items = _jsonl_items( request.stream )
+    else:
+        if( request.content_length is not None and request.content_length > settings.DECODE_API_MAX_BODY ):
+            abort(413, description="body larger than %d bytes, use a JSON lines body" % settings.DECODE_API_MAX_BODY)
+        _items = request.get_json(silent=True)
+        if( not isinstance(_items, list) ):
+            abort(400, description="expected a JSON array of frames")
+
+    # calibration file changed ?
+    try:
+        calibration.reload()
+    except ValueError as ex:
+        log.error(str(ex) + " ... current calibration kept")
+
+    return Response( stream_with_context(_decode_stream(_items, _encoding)), mimetype='application/x-ndjson' )
+
+
+_JSONL_MIMETYPES = ( 'application/x-ndjson', 'application/jsonl', 'application/x-jsonlines' )
+
+#
+# JSON lines body: one frame (string or object) per line
+def _jsonl_items(stream):
+    for _line in stream:
+        _line = _line.strip()
+        if( not _line ):
+            continue
+        try:
+            yield json.loads(_line)
+        except ValueError:
+            yield None
+
+#
+# decode by batches (compiled layouts shared by the whole request)
+def _decode_stream(items, encoding):
+    _plans = dict()
+    _batch = list()
+    for _index, _item in enumerate(items):
+        _batch.append( (_index, _item) )
+        if( len(_batch) >= settings.DECODE_API_BATCH_SIZE ):
+            yield from _decode_batch(_batch, encoding, _plans)
+            _batch = list()
+    if( _batch ):
+        yield from _decode_batch(_batch, encoding, _plans)
+
+def _decode_batch(batch, encoding, plans):
+    # item: "<frame>" or { "data": "<frame>", "id": <anything>, "device": <unitID> }
+    _frames = list()
+    for _index, _item in batch:
+        _data = _item.get('data') if isinstance(_item, dict) else _item
+        _frames.append( frame_from_text(_data, encoding) )
+
+    for (_index, _item), _frame, (_measurements, _error) in zip(batch, _frames, decode_batch(_frames, plans)):
+        _res = { 'index': _index }
+        if( isinstance(_item, dict) and 'id' in _item ):
+            _res['id'] = _item['id']
+        if( isinstance(_item, dict) and _item.get('device') is not None ):
+            _measurements = calibration.apply( _item['device'], _measurements )
+        _res['measurements'] = [ { 'value': m.value, 'unit': m.unit, 'channel': m.channel, 'type': m.type_id }
+                                    for m in _measurements ]
+        if( _frame is None ):
+            _error = DecodeError( DecodeError.BAD_ENCODING, offset=0 )
+        _res['error'] = None if _error is None else _error.as_dict()
+        yield json.dumps(_res) + '\n'
+
+
+
+#
+# Live stream (Server-Sent Events) of decoded measurements, optional filters
+# (comma separated lists): device=<unitID>, type=<unit>, topic=<topic prefix>
+@app.route('/stream')
+def stream():
+    _filters = { _dim: [ v for v in request.args.get(_dim, '').split(',') if v ]
+                    for _dim in StreamHub.DIMENSIONS }
+    try:
+        _stream_source()
+        _client = streamHub.subscribe( _filters )
+    except Exception as ex:
+        abort(503, description="live stream not available: " + str(ex))
+
+    def _events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    _message = _client.get( settings.STREAM_KEEPALIVE )
+                except EOFError as ex:
+                    yield "event: evicted\ndata: %s\n\n" % str(ex)
+                    return
+                if( _message is None ):
+                    yield ": keepalive\n\n"
+                    continue
+                yield "data: %s\n\n" % _message
+        finally:
+            streamHub.unsubscribe( _client )
+
+    return Response( stream_with_context(_events()), mimetype='text/event-stream',
+                     headers={ 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no' } )
+
+
+#
+# MQTT subscription to decoded measurements feeding the stream hub
+def _stream_source():
+    global _streamSource
+    with _streamLock:
+        if( _streamSource is None or not _streamSource.is_alive() ):
+            # MQTT facility only needed by live streams
+            from comm.mqttConnect import CommModule
+            if( not config.mqtt_user or not config.mqtt_passwd ):
+                raise RuntimeError("unspecified MQTT credentials")
+            _params = config.comm_params()
+            # decoded measurements feature no 'dest': all of them are streamed
+            # (binary encoded ones decoded along with the decoder's encodings)
+            _params.update( mqtt_topics=settings.STREAM_TOPICS, control_topic=None, ready_file=None,
+                            sim=True, dest_filter=False, payload_encodings=settings.MQTT_OUTPUT_ENCODINGS,
+                            _shutdownEvent=threading.Event() )
+            _client = CommModule( **_params )
+            _client.handle_message = streamHub.publish
+            _client.daemon = True
+            _client.start()
+            _streamSource = _client
+    return _streamSource
+
+
 
 # #############################################################################
 #
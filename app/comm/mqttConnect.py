@@ -21,7 +21,8 @@ import os
 import sys
 import time
 import json
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+from collections import deque
 import paho.mqtt.client as mqtt_client
 from random import randint
 
@@ -29,6 +30,8 @@ from random import randint
 # --- project related imports
 import settings
 from logger.logger import log, getLogLevel
+from comm.spool import Spool
+from comm.payloadSerializer import payload_decoders
 
 
 
@@ -48,7 +51,19 @@ class CommModule(Thread):
     _mqtt_passwd    = None
     _mqtt_topics    = None      # list of topics to subscribe to
     _unitID         = None
+    _destFilter     = True      # only messages whose 'dest' is us (or all) get handled
+    _decoders       = None      # [ ( topic prefix, decode function ) ] binary encoded topics, JSON otherwise
     _addons         = None      # additional parameters
+    _statusHandlers = None      # { name: function returning status of an app. component }
+    _pending        = None      # messages handed to paho, maybe not yet published
+    _startTime      = None      # module start time (i.e startup duration)
+    _closing        = None      # event: nothing more to publish, ok to disconnect
+    _ready          = None      # event: connected and subscribed to all topics
+    _handling       = True      # messages handed to handle_message() (see stop_handling())
+    _awaiting       = None      # subscriptions not yet acknowledged
+    _controlTopic   = None      # subscriptions' control (see _handle_control())
+    _spool          = None      # disk spool of messages not published (None means disabled)
+    _replaying      = None      # spooled messages handed to paho: ( message info, spool position )
 
 
     #
@@ -59,8 +74,23 @@ class CommModule(Thread):
         log.debug("initializing comm module")
         self._mqtt_user     = mqtt_user
         self._mqtt_passwd   = mqtt_passwd
-        self._mqtt_topics   = mqtt_topics
+        self._mqtt_topics   = list(mqtt_topics)
+        self._topicsLock    = Lock()
         self._addons        = kwargs
+        self._statusHandlers = dict()
+        self._pending       = deque()
+        self._pendingLock   = Lock()
+        self._closing       = Event()
+        self._ready         = Event()
+        self._awaiting      = set()
+        self._handlerLock   = Lock()
+
+        # control topic (i.e subscriptions changes)
+        self._controlTopic  = self._addons.get('control_topic')
+
+        # readiness file (e.g container's health check), stale one removed
+        self._readyFile     = self._addons.get('ready_file')
+        self._set_ready(False)
 
         # check for _shutdown event
         self._shutdownEvent = self._addons.get('_shutdownEvent')
@@ -73,10 +103,31 @@ class CommModule(Thread):
         if( self.sim is True ):
             log.info("[SIM] read-only mode ACTIVATED ... means NO PUBLISH AT ALL!")
 
+        # disk spool of outgoing messages (e.g broker outage)
+        self._replaying     = deque()
+        self._replayBudget  = 0.0
+        self._replayTime    = time.time()
+        if( self._addons.get('spool_dir') and self.sim is not True ):
+            self._spool = Spool( self._addons['spool_dir'],
+                                 segment_size=settings.SPOOL_SEGMENT_SIZE,
+                                 max_size=settings.SPOOL_MAX_SIZE,
+                                 fsync_count=settings.SPOOL_FSYNC_COUNT )
+            self.register_status( 'spool', self._spool.stats )
+
+        # port may come as a string (e.g env. var)
+        self._addons['mqtt_port'] = int(self._addons.get('mqtt_port', 1883))
+
         # check for unitID
         if( "unitID" in self._addons and self._addons.get('unitID') is not None ):
             self._unitID = self._addons.get('unitID')
 
+        # 'dest' filtering (along with unitID): disabled for subscriptions to
+        # messages that never feature any 'dest' (e.g decoded measurements)
+        self._destFilter = self._addons.get('dest_filter', True) is not False
+
+        # binary encoded topics (e.g decoded measurements, see settings.MQTT_OUTPUT_ENCODINGS)
+        self._decoders = payload_decoders( self._addons.get('payload_encodings') )
+
         # setup MQTT connection
         self._connection = mqtt_client.Client()
         self._connection.on_connect = self._on_connect
@@ -97,6 +148,8 @@ class CommModule(Thread):
     #
     # called by Threading.start()
     def run( self ):
+        self._startTime = time.time()
+
         # load module
         log.info("module loading")
         self.load()
@@ -109,12 +162,24 @@ class CommModule(Thread):
         try:
             while not self._shutdownEvent.is_set():
 
-                if self._connection.loop(timeout=2.0) != mqtt_client.MQTT_ERR_SUCCESS:
+                # spooled messages to replay ?
+                _timeout = 2.0
+                if( self._spool is not None and self._connected and self._spool.backlog() ):
+                    self._replay()
+                    _timeout = 0.05
+
+                if self._connection.loop(timeout=_timeout) != mqtt_client.MQTT_ERR_SUCCESS:
                     log.debug("loop failed, sleeping a bit before retrying")
                     time.sleep(2)
 
             log.debug("shutdown activated ...")
 
+            # in-flight messages get a chance to be published ...
+            self._drain()
+
+            # ... remaining ones are kept on disk
+            self._spill()
+
         except Exception as ex:
             if getLogLevel().lower() == "debug":
                 log.error("module crashed (high details): " + str(ex), exc_info=True)
@@ -126,7 +191,10 @@ class CommModule(Thread):
         self.quit()
 
         # disconnect ...
+        self._set_ready(False)
         self._connection.disconnect()
+        if( self._spool is not None ):
+            self._spool.close()
 
         # end of thread
         log.info("Thread end ...")
@@ -137,34 +205,113 @@ class CommModule(Thread):
         return self._connected
 
 
-    ''' prepares and sends a payload in a MQTT message '''
-    def send_message(self,topic, payload):
+    ''' are we connected and subscribed to all topics ? '''
+    def is_ready( self ):
+        return self._ready.is_set()
 
-        # uID = payload["appargs"]
-        # #TODO demander a Senso campus quelles est le site, le batiment et la salle de cet uID
-        # topic ="TestTopic/lora/"+uID+"/command" #donner par senso campus
-        # publish_payl = json.dumps({'unitID': uID, 'value': data[0], 'value_units': data[1]}, sort_keys=True)
-        # # client.publish(topic,publish_payl)#publish
-        # res, mid = self._connection.publish(topic,publish_payl)
-        # if not self.is_connected():
-        #     log.warn("tried to publish a message while not connected ...")
-        #     return
 
-        # if 'unitID' not in payload:
-        #     payload['unitID'] = self._unitID
+    ''' wait till module is ready, returns readiness '''
+    def wait_ready( self, timeout=None ):
+        return self._ready.wait(timeout)
 
-        # if( payload['unitID'] is None ):
-        #     log.warn("tried to publish a message while not having a unitID ... aborting")
-        #     return
 
-        # if( self.sim is True ):
-        #     return
+    ''' prepares and sends a payload in a MQTT message '''
+    def send_message(self, topic, payload):
+        if not self.is_connected() and self._spool is None:
+            log.warn("tried to publish a message while not connected ...")
+            return False
 
-        # res, mid = self._connection.publish(topic, json.dumps(payload))
+        # already serialized payload (str or bytes) are sent as is
+        if isinstance(payload, dict):
+            if 'unitID' not in payload:
+                payload['unitID'] = self._unitID
 
-        # if res != mqtt_client.MQTT_ERR_SUCCESS:
-        #     log.error("on message published to topic " + topic)
-        pass
+            if( payload['unitID'] is None ):
+                log.warn("tried to publish a message while not having a unitID ... aborting")
+                return False
+            payload = json.dumps(payload)
+
+        if( self.sim is True ):
+            return True
+
+        # not connected, too many in-flight messages or spool being replayed
+        # (i.e keep order): to disk
+        if( self._spool is not None and
+            ( not self._connected or self._spool.backlog() or self.pending() >= settings.MQTT_MAX_PENDING ) ):
+            return self._spool.append(topic, payload)
+
+        _info = self._connection.publish(topic, payload)
+        res, mid = _info
+
+        if res != mqtt_client.MQTT_ERR_SUCCESS:
+            log.error("on message published to topic " + topic)
+            if( self._spool is not None ):
+                return self._spool.append(topic, payload)
+            return False
+        with self._pendingLock:
+            self._prune()
+            self._pending.append( ( _info, topic, payload ) )
+        return True
+
+
+    ''' number of messages not published yet '''
+    def pending(self):
+        with self._pendingLock:
+            self._prune()
+            return len(self._pending)
+
+
+    ''' fsync spooled messages (main loop's periodic task, see SPOOL_FSYNC_DELAY) '''
+    def sync_spool(self):
+        if( self._spool is not None ):
+            self._spool.sync()
+
+
+    ''' no more messages handed to handle_message() (e.g shutdown: app.
+        components get closed meanwhile, publishing still works): returns
+        once the message being handled, if any, is over '''
+    def stop_handling(self):
+        with self._handlerLock:
+            self._handling = False
+
+
+    ''' nothing more to publish: module will disconnect as soon as in-flight
+        messages are published (shutdown) '''
+    def close(self):
+        self._closing.set()
+
+
+    ''' subscribe to additional topics on the live connection, kept across
+        reconnects: returns topics actually added '''
+    def add_topics(self, topics):
+        topics = _check_topics(topics)
+        with self._topicsLock:
+            _added = [ t for t in topics if t not in self._mqtt_topics ]
+            self._mqtt_topics.extend(_added)
+            if( self._connected ):
+                for topic in _added:
+                    log.info("subscribing to " + str(topic))
+                    self._connection.subscribe( topic )
+        return _added
+
+
+    ''' unsubscribe from topics on the live connection: returns topics
+        actually removed '''
+    def remove_topics(self, topics):
+        topics = _check_topics(topics)
+        with self._topicsLock:
+            _removed = [ t for t in topics if t in self._mqtt_topics ]
+            self._mqtt_topics = [ t for t in self._mqtt_topics if t not in _removed ]
+            if( self._connected ):
+                for topic in _removed:
+                    log.info("unsubscribing from " + str(topic))
+                    self._connection.unsubscribe( topic )
+        return _removed
+
+
+    ''' add an application component to the status report (see _status()) '''
+    def register_status(self, name, handler):
+        self._statusHandlers[name] = handler
 
 
     ''' handles pre-validated MQTT messages, to be implemented by subclasses '''
@@ -192,6 +339,13 @@ class CommModule(Thread):
     # - _on_message()
     # - _on_log()
     # - _status()
+    # - _drain()
+    # - _set_ready()
+    # - _prune()
+    # - _replay()
+    # - _spill()
+    # - _handle_control()
+    # - _decode()
     #
 
 
@@ -207,19 +361,33 @@ class CommModule(Thread):
 
         # subscribe to topics list
         try:
-            for topic in self._mqtt_topics:
+            self._awaiting.clear()
+            with self._topicsLock:
+                _topics = list(self._mqtt_topics)
+            if( self._controlTopic is not None ):
+                _topics.append(self._controlTopic)
+            for topic in _topics:
                 log.debug("subscribing to " + str(topic))
-                self._connection.subscribe( topic )   # QoS=0 default
+                res, mid = self._connection.subscribe( topic )   # QoS=0 default
+                if( res == mqtt_client.MQTT_ERR_SUCCESS ):
+                    self._awaiting.add(mid)
 
         except Exception as ex:
             log.warn("exception while subscribing to topic '%s' :" % str(topic) + str(ex))
 
+        if( not self._awaiting ):
+            self._set_ready(True)
+
 
     ''' paho callback for disconnection '''
     def _on_disconnect(self, client, userdata, rc):
 
         log.info("disconnected from MQTT broker with rc: " + mqtt_client.error_string(rc))
         self._connected = False
+        self._set_ready(False)
+
+        # messages not published yet are lost by paho (QoS 0)
+        self._spill()
         if rc == mqtt_client.MQTT_ERR_SUCCESS:
             # means that disconnect has been requested (i.e not an unexpected event)
             return
@@ -251,24 +419,41 @@ class CommModule(Thread):
         #log.debug("receiving a msg on topic '%s' ..." % str(msg.topic) )
         try:
             # loading and verifying payload
-            payload = json.loads(msg.payload.decode('utf-8'))
+            payload = self._decode(msg.topic, msg.payload)
             #validictory.validate(payload, self.COMMAND_SCHEMA)
         except Exception as ex:
-            log.error("exception handling json payload from topic '%s': " % str(msg.topic) + str(ex))
+            log.error("exception handling payload from topic '%s': " % str(msg.topic) + str(ex))
+            return
+        if( not isinstance(payload, dict) ):
+            log.error("payload from topic '%s' is not an object ... dropped" % str(msg.topic))
             return
 
         # is it a message for us ??
-        if( self._unitID is not None and payload['dest'] != "all" and payload['dest'] != str(self.unitID) ):
-            log.debug("msg received on topic '%s' features destID='%s' != self._unitID='%s'" % (str(msg.topic),payload['dest'],self.unitID) )
+        if( self._destFilter and self._unitID is not None and payload.get('dest') != "all" and payload.get('dest') != str(self._unitID) ):
+            log.debug("msg received on topic '%s' features destID='%s' != self._unitID='%s'" % (str(msg.topic),payload.get('dest'),self._unitID) )
             return
 
-        self.handle_message( msg.topic, payload )
+        with self._handlerLock:
+            if( not self._handling ):
+                log.debug("msg received on topic '%s' while shutting down ... ignored" % str(msg.topic))
+                return
+            # a faulty message must not kill the mqtt_loop's thread
+            try:
+                if( self._controlTopic is not None and msg.topic == self._controlTopic ):
+                    self._handle_control( payload )
+                    return
+                self.handle_message( msg.topic, payload )
+            except Exception as ex:
+                log.error("exception while handling msg from topic '%s': " % str(msg.topic) + str(ex), exc_info=(getLogLevel().lower()=="debug") )
 
 
     ''' paho callback for topic subscriptions '''
     def _on_subscribe(self, client, userdata, mid, granted_qos):
         log.debug("Subscribed: " + str(mid) + " " + str(granted_qos))
         self._connected = True
+        self._awaiting.discard(mid)
+        if( not self._awaiting and not self._ready.is_set() ):
+            self._set_ready(True)
 
 
     ''' paho callback for topic unsubscriptions '''
@@ -288,5 +473,156 @@ class CommModule(Thread):
     ''' Low -level module'status reporting, to be implemented by subclasses '''
     def _status(self):
         ''' Raw status used both by module's reporting and higher-level device reporting '''
-        return None
+        status = dict()
+        status['connected'] = self._connected
+        with self._topicsLock:
+            status['topics'] = list(self._mqtt_topics)
+        for name, handler in self._statusHandlers.items():
+            try:
+                status[name] = handler()
+            except Exception as ex:
+                log.warning("unable to get '%s' status: " % name + str(ex))
+        return status
+
+
+    ''' keep looping at shutdown till module is closed and in-flight messages
+        are published ... or deadline '''
+    def _drain(self):
+        _deadline = time.time() + self._addons.get('drain_timeout', settings.SHUTDOWN_TIMEOUT)
+        while( self._connected and time.time() < _deadline ):
+            if( self._closing.is_set() and not self.pending() ):
+                return
+            self._connection.loop(timeout=0.05)
+        _count = self.pending()
+        if( _count ):
+            log.warning("%d message(s) not published at shutdown" % _count)
+
+
+    ''' forget about published messages (published in order) '''
+    def _prune(self):
+        while( self._pending and self._pending[0][0].is_published() ):
+            self._pending.popleft()
+
+
+    ''' publish spooled messages (rate limited), commit those published '''
+    def _replay(self):
+        self._commit_replayed()
+
+        # token bucket: SPOOL_REPLAY_RATE messages per second
+        _now = time.time()
+        _rate = settings.SPOOL_REPLAY_RATE
+        self._replayBudget = min( _rate, self._replayBudget + (_now - self._replayTime) * _rate )
+        self._replayTime = _now
+        _count = min( int(self._replayBudget), settings.MQTT_MAX_PENDING - len(self._replaying) )
+        if( _count <= 0 or not self._spool.readable() ):
+            return
+
+        for _position, _topic, _payload in self._spool.read(_count):
+            _info = self._connection.publish(_topic, _payload)
+            if( _info.rc != mqtt_client.MQTT_ERR_SUCCESS ):
+                log.warning("unable to replay spooled message to topic '%s': " % _topic + mqtt_client.error_string(_info.rc))
+                self._replaying.clear()
+                self._spool.rewind()
+                return
+            self._replaying.append( ( _info, _position ) )
+            self._replayBudget -= 1
+
+    def _commit_replayed(self):
+        _position = None
+        while( self._replaying and self._replaying[0][0].is_published() ):
+            _position = self._replaying.popleft()[1]
+        if( _position is not None ):
+            self._spool.commit(_position)
+
+
+    ''' messages not published (connection lost, shutdown) to disk, spooled
+        ones not published will be replayed again '''
+    def _spill(self):
+        if( self._spool is None ):
+            return
+        self._commit_replayed()
+        self._replaying.clear()
+        self._spool.rewind()
+        with self._pendingLock:
+            self._prune()
+            _count = len(self._pending)
+            while( self._pending ):
+                _info, _topic, _payload = self._pending.popleft()
+                self._spool.append(_topic, _payload)
+        if( _count ):
+            log.info("%d message(s) not published yet spooled" % _count)
+
+
+    ''' readiness event and file '''
+    def _set_ready(self, ready):
+        if( ready is True ):
+            self._ready.set()
+            log.info("ready: connected and subscribed (%.2fs after start)" % (time.time() - self._startTime))
+        else:
+            self._ready.clear()
+        if( self._readyFile is None ):
+            return
+        try:
+            if( ready is True ):
+                os.makedirs( os.path.dirname(self._readyFile) or '.', exist_ok=True )
+                open(self._readyFile, 'w').close()
+            elif( os.path.exists(self._readyFile) ):
+                os.remove(self._readyFile)
+        except OSError as ex:
+            log.warning("unable to update readiness file '%s': " % str(self._readyFile) + str(ex))
+
+
+    ''' control message: { "dest": <unitID|all>, "order": "subscribe" | "unsubscribe" | "topics",
+                           "topics": [ ... ] }, answer sent to <control topic>/ack '''
+    def _handle_control(self, payload):
+        _order = payload.get('order')
+        _changed = None
+        try:
+            if( _order == 'subscribe' ):
+                _changed = self.add_topics( payload.get('topics') )
+            elif( _order == 'unsubscribe' ):
+                _changed = self.remove_topics( payload.get('topics') )
+            elif( _order != 'topics' ):
+                raise ValueError("unknown order '%s'" % str(_order))
+            _status = 'ok'
+        except ValueError as ex:
+            log.warning("invalid control message: " + str(ex))
+            _status = "error: " + str(ex)
+
+        with self._topicsLock:
+            _ack = { 'unitID': self._unitID, 'order': _order, 'status': _status,
+                     'changed': _changed, 'topics': list(self._mqtt_topics) }
+        self.send_message( self._controlTopic + "/ack", json.dumps(_ack) )
+
+
+    ''' payload of a message: binary encoded topics (longest prefix) or JSON '''
+    def _decode(self, topic, payload):
+        for prefix, decode in self._decoders:
+            if( topic.startswith(prefix) ):
+                return decode(payload)
+        return json.loads(payload.decode('utf-8'))
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#
+# Function to validate a list of topics (subscription filters)
+def _check_topics(topics):
+    if( isinstance(topics, str) ):
+        topics = [ topics ]
+    if( not isinstance(topics, (list, tuple)) or not topics ):
+        raise ValueError("expected a list of topics")
+    for topic in topics:
+        if( not isinstance(topic, str) or not topic ):
+            raise ValueError("invalid topic '%s'" % str(topic))
+        _levels = topic.split('/')
+        for _index, _level in enumerate(_levels):
+            if( ('#' in _level and (_level != '#' or _index != len(_levels) - 1)) or
+                ('+' in _level and _level != '+') ):
+                raise ValueError("invalid wildcard in topic '%s'" % topic)
+    return list(dict.fromkeys(topics))
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Fast serialization of decoded measurements
+#
+# Output topic and JSON payload of a measurement only depend on the device
+# unitID and on the unit of the value: both are pre-rendered once per device
+# (topic) and per (device, unit) (payload template), hence only the value (and
+# its timestamp) is to get rendered for each measurement.
+#
+# Binary encodings (CBOR, MessagePack) may get selected per output topic prefix,
+# JSON remains the default.
+#
+# Notes:
+#   JSON payloads are byte-identical to json.dumps(..., sort_keys=True)
+#   values are rounded to <precision> digits (i.e settings.MQTT_DATA_PRECISION)
+#   timestamps are UTC epoch rounded to the millisecond
+#   cbor2 and msgpack are optional, they're imported only if configured.
+#   subscribers to binary encoded topics (e.g the decoder itself, live streams)
+#   decode them with payload_decoders() of the same encodings.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import sys
+import json
+import importlib
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_MAX_ENTRIES    = 65536     # caches get flushed beyond this number of entries
+
+# supported encodings: name --> ( module, function to encode, function to decode )
+ENCODINGS = { 'json': None, 'cbor': ('cbor2', 'dumps', 'loads'), 'msgpack': ('msgpack', 'packb', 'unpackb') }
+
+
+
+# #############################################################################
+#
+# Class
+#
+class PayloadSerializer(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _topic_format   = None      # e.g "TestTopic/lora/%s/command"
+    _precision      = None      # floating point digits (None means no rounding)
+    _encodings      = None      # [ ( topic prefix, encode function ) ] longest prefix first
+
+
+    #
+    # object initialization
+    def __init__(self, topic_format, precision=None, encodings=None, *args, **kwargs ):
+        self._topic_format  = topic_format
+        self._precision     = precision
+        self._topics        = dict()    # { uID: ( topic, encode function or None for JSON ) }
+        self._templates     = dict()    # { (uID, unit): ( prefix, suffix ) }
+
+        # binary encodings per topic prefix
+        self._encodings = list()
+        for prefix, name in (encodings or dict()).items():
+            self._encodings.append( ( prefix, self._encoder(name) ) )
+            log.info("'%s' encoding for topics '%s*'" % (name,prefix))
+        self._encodings.sort( key=lambda item: len(item[0]), reverse=True )
+
+
+    ''' output topic of a device '''
+    def topic(self, uID):
+        return self._topic(uID)[0]
+
+
+    ''' payload of a measurement: JSON str or binary encoded bytes '''
+    def serialize(self, uID, measurement, timestamp=None):
+        _encode = self._topic(uID)[1]
+        if( _encode is not None ):
+            _payload = { 'unitID': uID, 'value': self.round(measurement.value),
+                         'value_units': measurement.unit }
+            if( timestamp is not None ):
+                _payload['timestamp'] = round(timestamp, 3)
+            return _encode( _payload )
+
+        _key = ( uID, measurement.unit )
+        _template = self._templates.get(_key)
+        if( _template is None ):
+            if( len(self._templates) >= _MAX_ENTRIES ):
+                log.debug("templates cache full ... flushed")
+                self._templates.clear()
+            # keys order is the one of sort_keys=True
+            _template = ( '"unitID": ' + json.dumps(uID) + ', "value": ',
+                          ', "value_units": ' + json.dumps(measurement.unit) + '}' )
+            self._templates[_key] = _template
+        if( timestamp is None ):
+            return '{' + _template[0] + self.render(measurement.value) + _template[1]
+        return '{"timestamp": ' + float.__repr__(round(timestamp, 3)) + ', ' + \
+                    _template[0] + self.render(measurement.value) + _template[1]
+
+
+    ''' value rendered as json.dumps would do '''
+    def render(self, value):
+        if( type(value) is int ):
+            return str(value)
+        value = self.round(value)
+        if( value - value == 0 ):
+            return float.__repr__(value)
+        # NaN and infinity
+        return json.dumps(value)
+
+
+    def round(self, value):
+        if( self._precision is None or type(value) is int ):
+            return value
+        return round(value, self._precision)
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    ''' ( topic, encode function ) of a device '''
+    def _topic(self, uID):
+        _entry = self._topics.get(uID)
+        if( _entry is None ):
+            if( len(self._topics) >= _MAX_ENTRIES ):
+                log.debug("topics cache full ... flushed")
+                self._topics.clear()
+            _topic = sys.intern( self._topic_format % uID )
+            _encode = None
+            for prefix, encode in self._encodings:
+                if( _topic.startswith(prefix) ):
+                    _encode = encode
+                    break
+            _entry = ( _topic, _encode )
+            self._topics[uID] = _entry
+        return _entry
+
+
+    ''' encode function of an encoding (None means JSON) '''
+    @staticmethod
+    def _encoder(name):
+        return _codec(name, 1)
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+''' [ ( topic prefix, decode function ) ] of binary encoded topics, longest
+    prefix first (i.e messages received on other topics are JSON) '''
+def payload_decoders(encodings):
+    _decoders = list()
+    for prefix, name in (encodings or dict()).items():
+        _decode = _codec(name, 2)
+        if( _decode is not None ):
+            _decoders.append( ( prefix, _decode ) )
+    _decoders.sort( key=lambda item: len(item[0]), reverse=True )
+    return _decoders
+
+
+''' encode (index 1) or decode (index 2) function of an encoding (None means JSON) '''
+def _codec(name, index):
+    if( name not in ENCODINGS ):
+        raise ValueError("unknown output encoding '%s' (expected one of %s)" % (str(name),str(list(ENCODINGS))))
+    if( ENCODINGS[name] is None ):
+        return None
+    _module = ENCODINGS[name][0]
+    try:
+        return getattr( importlib.import_module(_module), ENCODINGS[name][index] )
+    except ImportError as ex:
+        raise ValueError("'%s' encoding requires python module '%s': " % (name,_module) + str(ex))
+
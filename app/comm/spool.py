@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Disk-backed write-ahead spool of outgoing MQTT messages
+#
+# Messages that can't be published (broker unreachable, in-flight queue full)
+# are appended to numbered segment files of a local directory; once connected
+# again, they're read back in order and the read cursor is committed (i.e
+# persisted) only after they have been published.
+#
+# Notes:
+#   record: <body length><crc32 of body><topic length> header, then body
+#   (utf-8 topic + payload bytes). A torn record (crash while writing) ends
+#   the segment: it's truncated at startup.
+#   a crash while replaying means records after the last committed cursor
+#   are published again (at-least-once, never lost).
+#   every record is flushed to the OS when appended (i.e survives a process
+#   crash), fsync'ed by batches of <fsync_count> records, by sync() (periodic
+#   task of the main loop, i.e quiet periods) and on close (power loss).
+#   when the spool exceeds its size limit, oldest segments get dropped.
+#   appended from any thread, read by the mqtt_loop's thread, hence the lock.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import json
+import zlib
+import struct
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_RECORD         = struct.Struct('<IIH')     # body length, crc32, topic length
+_SUFFIX         = '.spool'
+_CURSOR_FILE    = 'cursor'
+
+
+
+# #############################################################################
+#
+# Class
+#
+class Spool(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _segment_size   = 4*1024*1024   # bytes per segment file
+    _max_size       = 256*1024*1024 # bytes, oldest segments dropped beyond
+    _fsync_count    = 100           # records appended between two fsync
+
+
+    #
+    # object initialization
+    def __init__(self, directory, segment_size=4*1024*1024, max_size=256*1024*1024, fsync_count=100, *args, **kwargs ):
+        self._dir           = directory
+        self._segment_size  = int(segment_size)
+        self._max_size      = int(max_size)
+        self._fsync_count   = int(fsync_count)
+        self._lock          = Lock()
+        self._segments      = dict()    # { seq: size }
+        self._writer        = None      # current segment (last one)
+        self._unsynced      = 0
+        self._reader        = None      # ( seq, file )
+        self._appended      = 0
+        self._replayed      = 0
+        self._dropped       = 0         # records refused
+        self._droppedSegments = 0       # oldest segments removed (spool full)
+
+        os.makedirs( self._dir, exist_ok=True )
+        self._recover()
+
+
+    ''' append a message, False if dropped (spool full) '''
+    def append(self, topic, payload):
+        _topic = topic.encode('utf-8')
+        _body = _topic + ( payload.encode('utf-8') if isinstance(payload, str) else bytes(payload) )
+        _record = _RECORD.pack( len(_body), zlib.crc32(_body), len(_topic) ) + _body
+
+        with self._lock:
+            _seq = self._end[0]
+            if( self._end[1] and self._end[1] + len(_record) > self._segment_size ):
+                _seq = self._rotate()
+            if( not self._make_room(len(_record)) ):
+                self._dropped += 1
+                return False
+            self._writer.write(_record)
+            self._writer.flush()
+            self._segments[_seq] += len(_record)
+            self._end = ( _seq, self._end[1] + len(_record) )
+            self._appended += 1
+            self._unsynced += 1
+            if( self._unsynced >= self._fsync_count ):
+                self._sync()
+        return True
+
+
+    ''' fsync records appended since last one (periodic task) '''
+    def sync(self):
+        with self._lock:
+            if( not self._writer.closed ):
+                self._sync()
+
+
+    ''' next records from read position: [ ( position, topic, payload ) ],
+        position being the one to commit once the record is published '''
+    def read(self, count):
+        _res = list()
+        with self._lock:
+            if( self._read == self._end ):
+                return _res
+            while( len(_res) < count and self._read < self._end ):
+                _seq, _offset = self._read
+                if( self._reader is None or self._reader[0] != _seq ):
+                    self._open_reader(_seq)
+                _file = self._reader[1]
+                _file.seek(_offset)
+                _record = self._read_record(_file)
+                if( _record is None ):
+                    # end of segment (or torn record): next one
+                    _next = [ s for s in self._segments if s > _seq ]
+                    if( not _next ):
+                        break
+                    self._read = ( min(_next), 0 )
+                    continue
+                self._read = ( _seq, _file.tell() )
+                _res.append( ( self._read, _record[0], _record[1] ) )
+            self._replayed += len(_res)
+        return _res
+
+
+    ''' records up to position (included) are published: persist cursor,
+        remove segments fully consumed '''
+    def commit(self, position):
+        with self._lock:
+            if( position <= self._committed ):
+                return
+            self._committed = position
+            for _seq in [ s for s in self._segments if s < position[0] ]:
+                self._remove_segment(_seq)
+            _tmp = os.path.join( self._dir, _CURSOR_FILE + '.tmp' )
+            try:
+                with open(_tmp, 'w') as f:
+                    json.dump( { 'segment': position[0], 'offset': position[1] }, f )
+                os.replace( _tmp, os.path.join(self._dir, _CURSOR_FILE) )
+            except OSError as ex:
+                log.warning("unable to save spool cursor: " + str(ex))
+
+
+    ''' records read but not committed will be read again (e.g disconnection) '''
+    def rewind(self):
+        with self._lock:
+            self._read = self._committed
+
+
+    ''' records not committed yet ? '''
+    def backlog(self):
+        return self._committed < self._end
+
+
+    ''' records not read yet ? '''
+    def readable(self):
+        return self._read < self._end
+
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._writer.close()
+            if( self._reader is not None ):
+                self._reader[1].close()
+                self._reader = None
+
+
+    def stats(self):
+        with self._lock:
+            return { 'bytes': sum(self._segments.values()), 'segments': len(self._segments),
+                     'appended': self._appended, 'replayed': self._replayed, 'dropped': self._dropped,
+                     'dropped_segments': self._droppedSegments }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _path(self, seq):
+        return os.path.join( self._dir, "%012d%s" % (seq, _SUFFIX) )
+
+    def _recover(self):
+        for _name in os.listdir(self._dir):
+            if( _name.endswith(_SUFFIX) and _name[:-len(_SUFFIX)].isdigit() ):
+                self._segments[ int(_name[:-len(_SUFFIX)]) ] = os.path.getsize( os.path.join(self._dir, _name) )
+
+        # last segment: valid records only (torn tail truncated)
+        _last = max(self._segments) if self._segments else 0
+        _size = 0
+        if( self._segments ):
+            with open(self._path(_last), 'rb') as f:
+                while( self._read_record(f) is not None ):
+                    _size = f.tell()
+            if( _size != self._segments[_last] ):
+                log.warning("spool segment %d: %d bytes of torn record(s) truncated" % (_last,self._segments[_last] - _size))
+                os.truncate( self._path(_last), _size )
+        self._segments[_last] = _size
+        self._writer = open( self._path(_last), 'ab' )
+        self._end = ( _last, _size )
+
+        # committed cursor (first segment if unknown or dropped)
+        _first = min(self._segments)
+        self._committed = ( _first, 0 )
+        try:
+            with open( os.path.join(self._dir, _CURSOR_FILE) ) as f:
+                _cursor = json.load(f)
+            _cursor = ( int(_cursor['segment']), int(_cursor['offset']) )
+            if( _cursor[0] in self._segments and _cursor <= self._end ):
+                self._committed = _cursor
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self._read = self._committed
+        if( self.backlog() ):
+            _bytes = sum( _size for _seq, _size in self._segments.items() if _seq >= self._committed[0] ) - self._committed[1]
+            log.info("spool '%s': %d bytes to replay" % (self._dir,_bytes))
+
+    def _read_record(self, f):
+        _header = f.read(_RECORD.size)
+        if( len(_header) < _RECORD.size ):
+            return None
+        _length, _crc, _topicLength = _RECORD.unpack(_header)
+        _body = f.read(_length)
+        if( len(_body) < _length or zlib.crc32(_body) != _crc or _topicLength > _length ):
+            return None
+        return ( _body[:_topicLength].decode('utf-8', 'replace'), _body[_topicLength:] )
+
+    def _open_reader(self, seq):
+        if( self._reader is not None ):
+            self._reader[1].close()
+        self._reader = ( seq, open(self._path(seq), 'rb') )
+
+    def _sync(self):
+        if( self._unsynced ):
+            os.fsync( self._writer.fileno() )
+        self._unsynced = 0
+
+    def _rotate(self):
+        self._sync()
+        self._writer.close()
+        _seq = self._end[0] + 1
+        self._writer = open( self._path(_seq), 'ab' )
+        self._segments[_seq] = 0
+        self._end = ( _seq, 0 )
+        return _seq
+
+    def _make_room(self, size):
+        while( sum(self._segments.values()) + size > self._max_size ):
+            _oldest = min(self._segments)
+            if( _oldest == self._end[0] ):
+                return False
+            log.warning("spool full (%d bytes): segment %d dropped" % (self._max_size,_oldest))
+            self._remove_segment(_oldest)
+            self._droppedSegments += 1
+            _first = ( min(self._segments), 0 )
+            self._committed = max( self._committed, _first )
+            self._read = max( self._read, _first )
+        return True
+
+    def _remove_segment(self, seq):
+        if( self._reader is not None and self._reader[0] == seq ):
+            self._reader[1].close()
+            self._reader = None
+        del self._segments[seq]
+        try:
+            os.remove( self._path(seq) )
+        except OSError as ex:
+            log.warning("unable to remove spool segment %d: " % seq + str(ex))
+
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Live stream of decoded measurements: server-side filtering and fan-out
+#
+# Each stream client registers filters on devices (unitID), types (i.e units
+# of values) and topic prefixes. Filters are indexed per dimension, a message
+# is thus matched with a few dict lookups whatever the number of clients.
+# Every client gets its own bounded buffer: a client that does not keep up
+# (i.e buffer full) is evicted instead of slowing down everybody.
+#
+# Notes:
+#   publish() is called from the mqtt_loop's thread while clients consume
+#   their buffer from web requests threads.
+#   an empty filter on a dimension means 'any'.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import json
+from collections import deque
+from threading import Lock, Condition
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class StreamClient(object):
+
+    #
+    # object initialization
+    def __init__(self, filters, max_buffer, *args, **kwargs ):
+        self.filters        = filters       # { dimension: set of values }
+        self.evicted        = None          # reason of eviction
+        self._max_buffer    = max_buffer
+        self._buffer        = deque()
+        self._condition     = Condition()
+
+
+    ''' next message or None after timeout, raises EOFError once evicted '''
+    def get(self, timeout=None):
+        with self._condition:
+            if( not self._buffer and self.evicted is None ):
+                self._condition.wait(timeout)
+            if( self._buffer ):
+                return self._buffer.popleft()
+            if( self.evicted is not None ):
+                raise EOFError(self.evicted)
+            return None
+
+
+    ''' called by hub: False if buffer is full '''
+    def put(self, message):
+        with self._condition:
+            if( len(self._buffer) >= self._max_buffer ):
+                return False
+            self._buffer.append(message)
+            self._condition.notify()
+        return True
+
+
+    def evict(self, reason):
+        with self._condition:
+            self.evicted = reason
+            self._condition.notify()
+
+
+class StreamHub(object):
+
+    # class attributes ( __class__.<attr_name> )
+    DIMENSIONS      = ( 'device', 'type', 'topic' )
+
+    # objects attributes
+    _max_clients    = 100
+    _max_buffer     = 1000      # messages per client
+
+
+    #
+    # object initialization
+    def __init__(self, max_clients=100, max_buffer=1000, *args, **kwargs ):
+        self._max_clients   = int(max_clients)
+        self._max_buffer    = int(max_buffer)
+        self._lock          = Lock()
+        self._clients       = set()
+        # per dimension: { value: set of clients }, clients without filter on it
+        self._index         = { _dim: dict() for _dim in self.DIMENSIONS }
+        self._any           = { _dim: set() for _dim in self.DIMENSIONS }
+        self._published     = 0
+        self._evicted       = 0
+
+
+    ''' new client: filters = { 'device': [...], 'type': [...], 'topic': [...] },
+        raises OverflowError if too many clients '''
+    def subscribe(self, filters):
+        _filters = { _dim: set( v.rstrip('/') if _dim == 'topic' else v for v in (filters.get(_dim) or ()) )
+                        for _dim in self.DIMENSIONS }
+        _client = StreamClient( _filters, self._max_buffer )
+        with self._lock:
+            if( len(self._clients) >= self._max_clients ):
+                raise OverflowError("too many stream clients (%d)" % self._max_clients)
+            self._clients.add(_client)
+            for _dim, _values in _filters.items():
+                if( not _values ):
+                    self._any[_dim].add(_client)
+                for _value in _values:
+                    self._index[_dim].setdefault(_value, set()).add(_client)
+        log.debug("stream client added with filters %s" % str(_filters))
+        return _client
+
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._remove(client)
+
+
+    ''' fan-out a decoded measurement (payload as published) '''
+    def publish(self, topic, payload):
+        _device = payload.get('unitID')
+        _type = payload.get('value_units')
+        with self._lock:
+            _matches = self._match( 'device', (_device,) )
+            if( _matches ):
+                _matches &= self._match( 'type', (_type,) )
+            if( _matches ):
+                # topic filters are prefixes (whole levels)
+                _levels = topic.split('/')
+                _matches &= self._match( 'topic', [ '/'.join(_levels[:n]) for n in range(1, len(_levels) + 1) ] )
+            if( not _matches ):
+                return 0
+
+            _message = json.dumps( dict(payload, topic=topic) )
+            for _client in _matches:
+                if( not _client.put(_message) ):
+                    # slow consumer
+                    self._remove(_client)
+                    self._evicted += 1
+                    _client.evict("buffer full (%d messages)" % self._max_buffer)
+                    log.info("slow stream client evicted")
+            self._published += 1
+        return len(_matches)
+
+
+    def stats(self):
+        with self._lock:
+            return { 'clients': len(self._clients), 'published': self._published,
+                     'evicted': self._evicted }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _match(self, dim, values):
+        _res = set(self._any[dim])
+        for _value in values:
+            _res |= self._index[dim].get(_value, set())
+        return _res
+
+    def _remove(self, client):
+        if( client not in self._clients ):
+            return
+        self._clients.discard(client)
+        for _dim, _values in client.filters.items():
+            self._any[_dim].discard(client)
+            for _value in _values:
+                _clients = self._index[_dim].get(_value)
+                if( _clients is not None ):
+                    _clients.discard(client)
+                    if( not _clients ):
+                        del self._index[_dim][_value]
+
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Runtime configuration: typed, validated and immutable
+#
+# Built once from settings.py (defaults), overridden by environment variables
+# and then by an optional JSON file (CONFIG_FILE, same keys as env. vars e.g
+# { "MQTT_TOPICS": [...], "LOG_LEVEL": "debug", "DECODE_CACHE_SIZE": 0 }).
+# The JSON file is the only source that may change at runtime: on reload
+# (SIGHUP) a new config object is built and compared to the current one.
+#
+# Notes:
+#   invalid values raise ConfigError (i.e ValueError) at build time, never
+#   later on.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import json
+import logging
+from dataclasses import dataclass, field, fields, replace
+
+# --- project related imports
+import settings
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+# changes applied on the fly (others require a restart)
+LIVE_FIELDS = ( 'mqtt_topics', 'log_level', 'decode_cache_size', 'calibration_file' )
+
+
+
+# #############################################################################
+#
+# Class
+#
+class ConfigError(ValueError):
+    ''' invalid runtime configuration '''
+    pass
+
+
+@dataclass(frozen=True)
+class RuntimeConfig(object):
+
+    debug:                  bool
+    sim:                    bool        # read-only mode (i.e no publish)
+    log_level:              int
+    mqtt_server:            str
+    mqtt_port:              int
+    mqtt_user:              str
+    mqtt_passwd:            str = field(repr=False)
+    mqtt_topics:            tuple = ()
+    control_topic:          str = None  # subscriptions changes at runtime
+    unitID:                 str = None
+    ready_file:             str = None
+    decode_cache_size:      int = 0     # bytes, 0 means disabled
+    frame_counter_snapshot: str = None
+    latest_index_file:      str = None
+    calibration_file:       str = None  # per-device gain / offset
+    spool_dir:              str = None  # disk spool of outgoing messages
+    archive_dir:            str = None  # raw uplinks archive
+    config_file:            str = None
+
+
+    ''' build config from settings < environment < JSON file,
+        mqtt=True means MQTT credentials and topics are mandatory '''
+    @classmethod
+    def from_env(cls, environ=None, mqtt=True):
+        _env = dict(os.environ if environ is None else environ)
+
+        # JSON file overrides environment
+        _file = _env.get('CONFIG_FILE', settings.CONFIG_FILE)
+        if( _file and os.path.exists(_file) ):
+            try:
+                with open(_file) as f:
+                    _overrides = json.load(f)
+            except Exception as ex:
+                raise ConfigError("unable to read config file '%s': " % _file + str(ex))
+            if( not isinstance(_overrides, dict) ):
+                raise ConfigError("config file '%s' is not a JSON object" % _file)
+            _env.update(_overrides)
+
+        _debug = _bool(_env.get('DEBUG', False))
+        _level = _env.get('LOG_LEVEL', logging.DEBUG if _debug else settings.LOG_LEVEL)
+        _config = cls(
+            debug                   = _debug,
+            sim                     = _bool(_env.get('SIM', settings.SIM)),
+            log_level               = _log_level(_level),
+            mqtt_server             = str(_env.get('MQTT_SERVER', settings.MQTT_SERVER)),
+            mqtt_port               = _int('MQTT_PORT', _env.get('MQTT_PORT', settings.MQTT_PORT), 1, 65535),
+            mqtt_user               = _env.get('MQTT_USER', settings.MQTT_USER) or '',
+            mqtt_passwd             = _env.get('MQTT_PASSWD', settings.MQTT_PASSWD) or '',
+            mqtt_topics             = _topics(_env.get('MQTT_TOPICS', settings.MQTT_TOPICS)),
+            control_topic           = _env.get('MQTT_CONTROL_TOPIC', settings.MQTT_CONTROL_TOPIC) or None,
+            unitID                  = _env.get('MQTT_UNITID', settings.MQTT_UNITID),
+            ready_file              = _env.get('READY_FILE', settings.READY_FILE),
+            decode_cache_size       = _int('DECODE_CACHE_SIZE', _env.get('DECODE_CACHE_SIZE', settings.DECODE_CACHE_SIZE), 0),
+            frame_counter_snapshot  = _env.get('FRAME_COUNTER_SNAPSHOT', settings.FRAME_COUNTER_SNAPSHOT),
+            latest_index_file       = _env.get('LATEST_INDEX_FILE', settings.LATEST_INDEX_FILE) or None,
+            calibration_file        = _env.get('CALIBRATION_FILE', settings.CALIBRATION_FILE) or None,
+            spool_dir               = _env.get('MQTT_SPOOL_DIR', settings.MQTT_SPOOL_DIR) or None,
+            archive_dir             = _env.get('ARCHIVE_DIR', settings.ARCHIVE_DIR) or None,
+            config_file             = _file or None )
+
+        if( mqtt is True ):
+            for _name in ( 'mqtt_server', 'mqtt_user', 'mqtt_passwd', 'mqtt_topics' ):
+                if( not getattr(_config, _name) ):
+                    raise ConfigError("unspecified or empty %s" % _name.upper())
+        return _config
+
+
+    ''' names of fields that differ from other config '''
+    def diff(self, other):
+        return [ f.name for f in fields(self) if getattr(self, f.name) != getattr(other, f.name) ]
+
+
+    ''' this config with live fields (see LIVE_FIELDS) taken from other config '''
+    def merge_live(self, other):
+        return replace( self, **{ _name: getattr(other, _name) for _name in LIVE_FIELDS } )
+
+
+    ''' CommModule parameters '''
+    def comm_params(self):
+        return { 'mqtt_user': self.mqtt_user, 'mqtt_passwd': self.mqtt_passwd,
+                 'mqtt_topics': list(self.mqtt_topics), 'mqtt_server': self.mqtt_server,
+                 'mqtt_port': self.mqtt_port, 'unitID': self.unitID, 'sim': self.sim,
+                 'control_topic': self.control_topic, 'ready_file': self.ready_file,
+                 'spool_dir': self.spool_dir }
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+def _bool(value):
+    if( isinstance(value, str) ):
+        return value.strip().lower() in ( '1', 'true', 'yes', 'on' )
+    return bool(value)
+
+
+def _int(name, value, minimum=None, maximum=None):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ConfigError("%s: '%s' is not an integer" % (name,str(value)))
+    if( (minimum is not None and value < minimum) or (maximum is not None and value > maximum) ):
+        raise ConfigError("%s: %d out of range [%s, %s]" % (name,value,str(minimum),str(maximum)))
+    return value
+
+
+def _log_level(value):
+    if( isinstance(value, str) and not value.strip().isdigit() ):
+        _level = logging.getLevelName( value.strip().upper() )
+        if( not isinstance(_level, int) ):
+            raise ConfigError("LOG_LEVEL: unknown level '%s'" % value)
+        return _level
+    return _int('LOG_LEVEL', value, 0)
+
+
+def _topics(value):
+    # env. var holds a JSON list
+    if( isinstance(value, str) ):
+        try:
+            value = json.loads(value)
+        except ValueError as ex:
+            raise ConfigError("MQTT_TOPICS: invalid JSON list: " + str(ex))
+    if( isinstance(value, str) or not isinstance(value, (list, tuple)) or
+        not all( isinstance(t, str) and t for t in value ) ):
+        raise ConfigError("MQTT_TOPICS: expected a list of topics")
+    return tuple(value)
+
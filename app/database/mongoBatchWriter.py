@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Buffered MongoDB writer
+#
+# Documents are buffered and written by batches (insert_many, unordered) as
+# soon as a batch is full or on a time basis; a batch that fails is written
+# again later (exponential backoff) and sent to the failed documents'
+# collection after max_retries attempts (shape given by to_failed()).
+# Sequential ids (e.g legacy 'idMesure') come from a range reserved in a
+# counters collection: one atomic $inc per <id_block> documents instead of a
+# count() (i.e collection scan) per document.
+#
+# Notes:
+#   db is anything indexable by collection names whose collections feature
+#   insert_many(), update_one() and find_one_and_update() (e.g pymongo
+#   Database, mongomock or any in-memory stand-in): pymongo isn't imported.
+#   insert_many() sets the documents' _id: a batch written again after a
+#   partial failure gets duplicate key errors (code 11000) for documents
+#   already written, they're considered as written.
+#   insert() is called from the mqtt_loop's thread while flush() is called
+#   from the main loop, hence the lock. Database accesses (ids reservation
+#   included) are done by flush() only: ids are assigned to documents, in
+#   insertion order, right before their first write.
+#   close() (i.e shutdown) doesn't wait for retries: batches still failing
+#   get sent to the failed documents' collection, lost ones are logged.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+from collections import deque
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_DUPLICATE_KEY  = 11000
+_MAX_DELAY      = 60        # max. seconds between two attempts of a batch
+
+
+
+# #############################################################################
+#
+# Class
+#
+class MongoBatchWriter(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _batch_size     = 500       # documents per insert_many
+    _flush_interval = 5.0       # seconds between two flushes
+    _id_block       = 1000      # ids reserved at once
+    _max_buffer     = 100000    # documents waiting, oldest dropped beyond
+    _max_retries    = 5         # attempts before giving up a batch
+    _retry_delay    = 1.0       # seconds, doubled after each failure
+
+
+    #
+    # object initialization
+    def __init__(self, db, collection='measure', failed_collection='failedData', id_field='idMesure',
+                 counters='counters', batch_size=500, flush_interval=5.0, id_block=1000, max_buffer=100000,
+                 max_retries=5, retry_delay=1.0, notify=None, to_failed=None, *args, **kwargs ):
+        self._db            = db
+        self._collection    = collection
+        self._failed        = failed_collection
+        self._id_field      = id_field
+        self._counters      = counters
+        self._batch_size    = int(batch_size)
+        self._flush_interval = float(flush_interval)
+        self._id_block      = int(id_block)
+        self._max_buffer    = int(max_buffer)
+        self._max_retries   = int(max_retries)
+        self._retry_delay   = float(retry_delay)
+        self._notify        = notify        # called (any thread) when a batch is full
+        self._to_failed     = to_failed or _failed_document     # ( collection, document ) --> failed document
+        self._lock          = Lock()
+        self._flushLock     = Lock()
+        self._buffers       = { collection: deque(), failed_collection: deque() }
+        self._retries       = deque()       # [ collection, documents, attempts, due ]
+        self._ids           = iter(())      # reserved range
+        self._stats         = { 'inserted': 0, 'batches': 0, 'duplicates': 0, 'errors': 0,
+                                'retried': 0, 'failed': 0, 'dropped': 0 }
+
+
+    ''' buffer a document (id_field set from reserved range once flushed) '''
+    def insert(self, document):
+        self._buffer( self._collection, document )
+
+
+    ''' buffer a document for the failed documents' collection '''
+    def insert_failed(self, document):
+        self._buffer( self._failed, document )
+
+
+    ''' write buffered documents and batches due for retry: returns time of
+        next flush (sooner than flush_interval if a retry is due before) '''
+    def flush(self, now=None):
+        if( now is None ):
+            now = time.time()
+        with self._flushLock:
+            # new documents
+            for _collection in self._buffers:
+                while( True ):
+                    with self._lock:
+                        _buffer = self._buffers[_collection]
+                        _documents = [ _buffer.popleft() for _ in range(min(len(_buffer), self._batch_size)) ]
+                    if( not _documents ):
+                        break
+                    if( _collection == self._collection and not self._assign_ids(_documents) ):
+                        # counters unavailable: documents kept for next flush
+                        with self._lock:
+                            self._buffers[_collection].extendleft( reversed(_documents) )
+                        break
+                    self._write( _collection, _documents, 0, now )
+
+            # batches to write again
+            for _ in range(len(self._retries)):
+                _collection, _documents, _attempts, _due = self._retries.popleft()
+                if( _due > now ):
+                    self._retries.append( [ _collection, _documents, _attempts, _due ] )
+                    continue
+                self._stats['retried'] += 1
+                self._write( _collection, _documents, _attempts, now )
+
+            return min( [ _r[3] for _r in self._retries ] + [ time.time() + self._flush_interval ] )
+
+
+    ''' last flush (e.g shutdown): batches waiting for a retry are written
+        right away, those failing again are sent to the failed documents'
+        collection; returns number of documents not written (logged) '''
+    def close(self):
+        self.flush( now=float('inf') )
+        with self._flushLock:
+            _retries, self._retries = self._retries, deque()
+        for _collection, _documents, _attempts, _due in _retries:
+            if( _collection != self._failed ):
+                log.error("'%s' batch of %d documents still failing at close ... sent to '%s'" % (_collection,len(_documents),self._failed))
+                for _document in _documents:
+                    self.insert_failed( self._to_failed(_collection, _document) )
+            else:
+                self._retries.append( [ _collection, _documents, _attempts, _due ] )
+        self.flush( now=float('inf') )
+
+        _lost = self.pending()
+        if( _lost ):
+            log.error("%d document(s) not written at close ... lost" % _lost)
+            self._stats['dropped'] += _lost
+        return _lost
+
+
+    def pending(self):
+        with self._lock:
+            _buffered = sum( len(_b) for _b in self._buffers.values() )
+        # retries are handled by flush() only: snapshot
+        return _buffered + sum( len(_r[1]) for _r in tuple(self._retries) )
+
+
+    def stats(self):
+        _stats = dict(self._stats)
+        _stats['pending'] = self.pending()
+        return _stats
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _buffer(self, collection, document):
+        with self._lock:
+            _buffer = self._buffers[collection]
+            _buffer.append(document)
+            if( len(_buffer) > self._max_buffer ):
+                _buffer.popleft()
+                self._stats['dropped'] += 1
+                if( self._stats['dropped'] == 1 or not self._stats['dropped'] % 1000 ):
+                    log.warning("'%s' buffer full: %d document(s) dropped so far" % (collection,self._stats['dropped']))
+            _full = len(_buffer) == self._batch_size
+        if( _full and self._notify is not None ):
+            self._notify()
+
+    def _assign_ids(self, documents):
+        try:
+            for _document in documents:
+                if( self._id_field not in _document ):
+                    _document[self._id_field] = self._next_id()
+        except Exception as ex:
+            self._stats['errors'] += 1
+            log.warning("unable to reserve '%s' ids: " % self._id_field + str(ex))
+            return False
+        return True
+
+    def _next_id(self):
+        _id = next(self._ids, None)
+        if( _id is None ):
+            _end = self._reserve()
+            self._ids = iter( range(_end - self._id_block, _end) )
+            _id = next(self._ids)
+        return _id
+
+    def _reserve(self):
+        # atomic $inc: [ seq - id_block, seq ) is ours
+        _counters = self._db[self._counters]
+        _key = { '_id': self._collection + '.' + self._id_field }
+        _doc = _counters.find_one_and_update( _key, { '$inc': { 'seq': self._id_block } } )
+        if( _doc is None ):
+            # first reservation ever: ids start after existing documents
+            _counters.update_one( _key, { '$max': { 'seq': self._first_id() } }, upsert=True )
+            _doc = _counters.find_one_and_update( _key, { '$inc': { 'seq': self._id_block } } )
+        return _doc['seq'] + self._id_block
+
+    def _first_id(self):
+        _last = self._db[self._collection].find_one( sort=[ (self._id_field, -1) ] )
+        return int(_last[self._id_field]) + 1 if _last and _last.get(self._id_field) is not None else 0
+
+    def _write(self, collection, documents, attempts, now):
+        try:
+            self._db[collection].insert_many( documents, ordered=False )
+            _written, _failed = len(documents), []
+        except Exception as ex:
+            _written, _failed = self._partial(documents, ex)
+            self._stats['errors'] += 1
+            log.warning("'%s' batch of %d documents: %d failed: " % (collection,len(documents),len(_failed)) + str(ex))
+
+        self._stats['batches'] += 1
+        self._stats['inserted' if collection == self._collection else 'failed'] += _written
+        if( not _failed ):
+            return
+
+        attempts += 1
+        if( attempts < self._max_retries ):
+            _delay = min( self._retry_delay * 2 ** (attempts - 1), _MAX_DELAY )
+            self._retries.append( [ collection, _failed, attempts, now + _delay ] )
+        elif( collection != self._failed ):
+            log.error("'%s' batch of %d documents given up after %d attempts ... sent to '%s'" % (collection,len(_failed),attempts,self._failed))
+            for _document in _failed:
+                self.insert_failed( self._to_failed(collection, _document) )
+        else:
+            log.error("'%s' batch of %d documents given up after %d attempts ... dropped" % (collection,len(_failed),attempts))
+            self._stats['dropped'] += len(_failed)
+
+    def _partial(self, documents, ex):
+        # BulkWriteError (unordered): documents not listed in writeErrors are written,
+        # duplicates were written by a previous attempt
+        _errors = ( getattr(ex, 'details', None) or {} ).get('writeErrors')
+        if( _errors is None ):
+            return 0, documents
+        _failed = list()
+        _written = len(documents)
+        for _error in _errors:
+            if( _error.get('code') == _DUPLICATE_KEY ):
+                self._stats['duplicates'] += 1
+                continue
+            _written -= 1
+            _failed.append( documents[_error['index']] )
+        return _written, _failed
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+''' default failed document: the document along with its collection '''
+def _failed_document(collection, document):
+    return { 'collection': collection, 'date': document.get('datemesure'), 'document': document }
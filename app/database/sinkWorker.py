@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-sink bounded queue and batching worker
+#
+# Each database sink (e.g mongoDB, influxDB module) gets its own thread fed by
+# a bounded queue: the mqtt_loop's thread only enqueues messages, hence a slow
+# or failing sink neither blocks the MQTT loop nor the other sinks.
+# The worker writes messages by batches (up to <batch_size> messages or
+# whatever is queued after <batch_delay> seconds); a failed write is attempted
+# again after a growing delay, then dropped after <max_retries> attempts.
+#
+# Notes:
+#   sinks featuring msgBatchHandler( [ (topic, payload, kwargs) ] ) get whole
+#   batches (retried, dropped as a whole), others get their msgHandler(topic,
+#   payload, **kwargs) called per message: only a failing message is retried
+#   (then dropped), the following ones are written anyway.
+#   messages are enqueued with their kwargs (e.g 'timestamp') computed once
+#   by the caller: all sinks get the very same timestamp.
+#   queue full: oldest message dropped (counted).
+#   stats: queue length, lag (age of oldest queued message), batch sizes,
+#   errors and dropped messages.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+import threading
+from collections import deque
+
+# --- project related imports
+from logger.logger import log, getLogLevel
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_MAX_RETRY_DELAY    = 30        # max. seconds between two attempts of a batch
+
+
+
+# #############################################################################
+#
+# Class
+#
+class SinkWorker(threading.Thread):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _max_queue      = 10000     # messages, oldest dropped beyond
+    _batch_size     = 100       # messages per batch
+    _batch_delay    = 1.0       # seconds to wait for a batch to fill
+    _max_retries    = 3         # attempts before dropping a batch
+    _retry_delay    = 1.0       # seconds, doubled after each failure
+
+
+    #
+    # object initialization
+    def __init__(self, name, sink, shutdownEvent, max_queue=10000, batch_size=100, batch_delay=1.0,
+                 max_retries=3, retry_delay=1.0, *args, **kwargs ):
+        super().__init__( name=name, daemon=True )
+        self._sink          = sink
+        self._shutdownEvent = shutdownEvent
+        self._max_queue     = int(max_queue)
+        self._batch_size    = int(batch_size)
+        self._batch_delay   = float(batch_delay)
+        self._max_retries   = int(max_retries)
+        self._retry_delay   = float(retry_delay)
+        self._condition     = threading.Condition()
+        self._queue         = deque()   # ( enqueue time, topic, payload, kwargs )
+        self._closing       = False
+        self._stats         = { 'written': 0, 'batches': 0, 'batch_size': 0, 'max_batch_size': 0,
+                                'errors': 0, 'dropped': 0, 'last_error': None }
+
+
+    ''' enqueue a message (mqtt_loop's thread): never blocks '''
+    def put(self, topic, payload, kwargs):
+        with self._condition:
+            self._queue.append( ( time.time(), topic, payload, kwargs ) )
+            if( len(self._queue) > self._max_queue ):
+                self._queue.popleft()
+                self._stats['dropped'] += 1
+                if( self._stats['dropped'] == 1 or not self._stats['dropped'] % 1000 ):
+                    log.warning("[%s] sink queue full: %d message(s) dropped so far" % (self.name,self._stats['dropped']))
+            if( len(self._queue) >= self._batch_size ):
+                self._condition.notify()
+
+
+    ''' write queued messages then stop (waits at most timeout seconds) '''
+    def close(self, timeout=None):
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self.join( timeout )
+        if( self.is_alive() ):
+            log.warning("[%s] sink worker still busy, %d message(s) left" % (self.name,len(self._queue)))
+
+
+    def stats(self):
+        with self._condition:
+            _stats = dict(self._stats)
+            _stats['queued'] = len(self._queue)
+            _stats['lag'] = round(time.time() - self._queue[0][0], 3) if self._queue else 0.0
+        return _stats
+
+
+    def run(self):
+        log.info("[%s] sink worker started" % self.name)
+        while( True ):
+            with self._condition:
+                # wait for a full batch, batch_delay or stop
+                _deadline = time.time() + self._batch_delay
+                while( not self._closing and len(self._queue) < self._batch_size ):
+                    _timeout = _deadline - time.time()
+                    if( _timeout <= 0 ):
+                        break
+                    self._condition.wait( _timeout )
+                if( self._closing and not self._queue ):
+                    break
+                _batch = [ self._queue.popleft() for _ in range(min(len(self._queue), self._batch_size)) ]
+            if( _batch ):
+                self._write( _batch )
+        log.info("[%s] sink worker stopped: " % self.name + str(self.stats()))
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _write(self, batch):
+        _messages = [ ( _topic, _payload, _kwargs ) for _t, _topic, _payload, _kwargs in batch ]
+        _batchHandler = getattr( self._sink, 'msgBatchHandler', None )
+        if( _batchHandler is not None ):
+            _written = self._attempt( _batchHandler, ( _messages, ), {}, len(_messages) )
+        else:
+            _written = 0
+            for _topic, _payload, _kwargs in _messages:
+                _written += self._attempt( self._sink.msgHandler, ( _topic, _payload ), _kwargs, 1 )
+
+        with self._condition:
+            self._stats['written'] += _written
+            self._stats['dropped'] += len(batch) - _written
+            self._stats['batches'] += 1
+            self._stats['batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max( self._stats['max_batch_size'], len(batch) )
+
+    def _attempt(self, func, args, kwargs, count):
+        # returns count of messages written: count or 0 (dropped)
+        _attempt = 0
+        while( True ):
+            _attempt += 1
+            try:
+                func( *args, **kwargs )
+                return count
+            except Exception as ex:
+                with self._condition:
+                    self._stats['errors'] += 1
+                    self._stats['last_error'] = str(ex)
+                log.error("[%s] sink write failed (attempt %d/%d): " % (self.name,_attempt,self._max_retries) + str(ex),
+                            exc_info=(getLogLevel().lower()=="debug") )
+            if( _attempt >= self._max_retries ):
+                log.error("[%s] %d message(s) dropped after %d attempts" % (self.name,count,_attempt))
+                return 0
+            # shutdown: no more delay
+            self._shutdownEvent.wait( min(self._retry_delay * 2 ** (_attempt - 1), _MAX_RETRY_DELAY) )
+
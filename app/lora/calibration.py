@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-device linear calibration of decoded values
+#
+# A JSON file holds gain / offset of calibrated (device, channel):
+#   { "<unitID>": { "<channel>": { "gain": 1.02, "offset": -0.3 }, ... }, ... }
+# value --> value * gain + offset, applied right after decoding so that
+# calibrated values reach the collectors.
+#
+# Notes:
+#   the table is rebuilt aside then swapped with a single assignment: readers
+#   (mqtt_loop's thread, web requests) never see a partially loaded table.
+#   an invalid file is rejected as a whole, the current table is kept.
+#   devices without calibration cost a single dict lookup.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import json
+
+# --- project related imports
+from logger.logger import log
+from lora.cayenneLPP import Measurement
+
+
+
+# #############################################################################
+#
+# Class
+#
+class CalibrationTable(object):
+
+    #
+    # object initialization
+    def __init__(self, path=None, *args, **kwargs ):
+        self._path      = path
+        self._mtime     = None
+        self._table     = dict()    # { device: { channel: ( gain, offset ) } }
+
+
+    ''' (re)load file if it changed (or if force): True if table changed,
+        raises ValueError if file is invalid '''
+    def reload(self, path=None, force=False):
+        if( path is not None and path != self._path ):
+            self._path, force = path, True
+        if( not self._path ):
+            _changed = bool(self._table)
+            self._table, self._mtime = dict(), None
+            return _changed
+        try:
+            _mtime = os.stat(self._path).st_mtime_ns
+        except OSError as ex:
+            raise ValueError("calibration file '%s' not available: " % self._path + str(ex))
+        if( not force and _mtime == self._mtime ):
+            return False
+
+        try:
+            with open(self._path) as f:
+                _table = self.parse( json.load(f) )
+        except ValueError as ex:
+            raise ValueError("invalid calibration file '%s': " % self._path + str(ex))
+        self._table, self._mtime = _table, _mtime
+        log.info("calibration of %d channel(s) from %d device(s) loaded" % (
+                    sum( len(_channels) for _channels in _table.values() ), len(_table)))
+        return True
+
+
+    ''' measurements of a device, calibrated '''
+    def apply(self, device, measurements):
+        _channels = self._table.get(device)
+        if( _channels is None ):
+            return measurements
+        _res = list()
+        for _m in measurements:
+            _coefs = _channels.get(_m.channel)
+            if( _coefs is not None ):
+                _m = Measurement( _m.value * _coefs[0] + _coefs[1], _m.key )
+            _res.append(_m)
+        return tuple(_res)
+
+
+    ''' ( gain, offset ) of a (device, channel) or None '''
+    def get(self, device, channel):
+        return self._table.get(device, {}).get(channel)
+
+
+    def __len__(self):
+        return len(self._table)
+
+
+    ''' JSON content --> table, raises ValueError '''
+    @staticmethod
+    def parse(content):
+        if( not isinstance(content, dict) ):
+            raise ValueError("expected a JSON object of devices")
+        _table = dict()
+        for _device, _channels in content.items():
+            if( not isinstance(_channels, dict) ):
+                raise ValueError("[%s] expected an object of channels" % _device)
+            _table[_device] = dict()
+            for _channel, _coefs in _channels.items():
+                try:
+                    _gain = float( _coefs.get('gain', 1.0) )
+                    _offset = float( _coefs.get('offset', 0.0) )
+                    _table[_device][int(_channel)] = ( _gain, _offset )
+                except (AttributeError, TypeError, ValueError):
+                    raise ValueError("[%s] channel '%s': expected { \"gain\": <float>, \"offset\": <float> }" % (_device,str(_channel)))
+        return _table
+
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# neOCayenneLPP decoding facility
+#
+# Frames sent by our end-devices follow an extended Cayenne LPP format:
+#   [ version, length, type, channel, data ..., type, channel, data ... ]
+#
+# Notes:
+#   decoding is bounds-checked: a malformed frame never raises, we return
+#   all the measurements decoded so far along with a DecodeError.
+#   measurements are Measurement records of two slots: the value and a key
+#   ( unit, channel, type_id ) shared by all measurements of the same channel
+#   and type; units strings are interned and shared with the TYPE table.
+#   batches (decode_batch) compile the layout of a frame (types, channels and
+#   offsets) once: following frames with the same layout skip parsing and type
+#   lookups, only their values get converted.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import sys
+import base64
+import binascii
+from array import array
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+FRAME_VERSION       = 0x01  # only supported frame format
+FRAME_HEADER_SIZE   = 2     # les 2 premiers octets de la payload ne sont pas des datas
+
+
+#Dictionnaire des types de data
+# 'min' / 'max': physically possible range of values (see lora/outlierFilter.py)
+TYPE =[
+    {'nom':'analog_input',          'unit':'...',       'ID':1,  'size':1, 'mult':1},
+    {'nom':'analog_output',         'unit':'...',       'ID':2,  'size':1, 'mult':1},
+    {'nom':'digital_input',         'unit':'bool',      'ID':3,  'size':1, 'mult':1},
+    {'nom':'digital_output',        'unit':'bool',      'ID':4,  'size':1, 'mult':1},
+    {'nom':'luminosity',            'unit':'lux',       'ID':5,  'size':2, 'mult':1, 'min':0, 'max':65534},
+    {'nom':'presence',              'unit':'bool',      'ID':6,  'size':1, 'mult':1},
+    {'nom':'frequency',             'unit':'pers/j',    'ID':7,  'size':2, 'mult':1},
+    {'nom':'temperature',           'unit':'celcuis',   'ID':8,  'size':1, 'mult':100, 'ref':20, 'pas':0.25, 'min':-40, 'max':85},
+    {'nom':'humidity',              'unit':'%r.H',      'ID':9,  'size':1, 'mult':100, 'ref':0, 'pas':0.5, 'min':0, 'max':100},
+    {'nom':'CO2',                   'unit':'ppm',       'ID':10, 'size':2, 'mult':1, 'min':0, 'max':10000},
+    {'nom':'air_quality',           'unit':'ppm',       'ID':11, 'size':1, 'mult':1},
+    {'nom':'GPS',                   'unit':'...',       'ID':12, 'size':9, 'mult':1},
+    {'nom':'energy',                'unit':'W/m2',      'ID':13, 'size':3, 'mult':1},
+    {'nom':'UV',                    'unit':'W/m2',      'ID':14, 'size':3, 'mult':1},
+    {'nom':'weight',                'unit':'g',         'ID':15, 'size':3, 'mult':1},
+    {'nom':'pressure',              'unit':'mBar',      'ID':16, 'size':1, 'mult':1, 'ref':990, 'pas':1, 'min':870, 'max':1085},
+    {'nom':'generic_sensor_unsi',   'unit':'...',       'ID':17, 'size':4, 'mult':1},
+    {'nom':'generic_sensor_sign',   'unit':'...',       'ID':18, 'size':4, 'mult':1},
+]
+
+# versions of the TYPE table: history may be decoded again (reprocessing)
+# with any of them, bump TYPE_VERSION whenever TYPE changes
+TYPE_VERSION    = 1
+TYPE_VERSIONS   = { TYPE_VERSION: TYPE }
+
+# shared measurement keys: { ( unit, channel, type_id ): itself }
+# (bounded by units x 256 channels x 256 types)
+_KEYS       = dict()
+
+# compiled layouts: max. per (length, first type, first channel) and overall
+_MAX_PLANS_PER_KEY  = 8
+_MAX_PLANS          = 1024
+
+
+
+# #############################################################################
+#
+# Class
+#
+
+class Measurement(object):
+    ''' decoded measurement: value + shared ( unit, channel, type_id ) key
+        (see measurement_key()), i.e two slots per record. Records are
+        shared (e.g decode cache), hence immutable: build new ones. '''
+
+    __slots__ = ( 'value', 'key' )
+
+    def __init__(self, value, key):
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'key', key)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Measurement records are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Measurement records are immutable")
+
+    @property
+    def unit(self):
+        return self.key[0]
+
+    @property
+    def channel(self):
+        return self.key[1]
+
+    @property
+    def type_id(self):
+        return self.key[2]
+
+    def __eq__(self, other):
+        return isinstance(other, Measurement) and self.value == other.value and self.key == other.key
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Measurement(value=%r, unit=%r, channel=%r, type_id=%r)" % (self.value, self.key[0], self.key[1], self.key[2])
+
+
+class MeasurementBatch(object):
+    ''' array-backed container for many measurements (e.g batch decoding):
+        one value, channel, type and frame index per measurement instead of
+        one record object. Values are stored as double. '''
+
+    __slots__ = ( 'values', 'channels', 'type_ids', 'frames' )
+
+    def __init__(self):
+        self.values     = array('d')
+        self.channels   = array('B')
+        self.type_ids   = array('B')
+        self.frames     = array('I')    # index of the frame a measurement belongs to
+
+    def append(self, measurement, frame=0):
+        self.values.append(measurement.value)
+        self.channels.append(measurement.channel)
+        self.type_ids.append(measurement.type_id)
+        self.frames.append(frame)
+
+    def extend(self, measurements, frame=0):
+        for _m in measurements:
+            self.append(_m, frame)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        _type_id = self.type_ids[index]
+        return Measurement( self.values[index], measurement_key(_INFO[_type_id][1], self.channels[index], _type_id) )
+
+    def __iter__(self):
+        for index in range(len(self.values)):
+            yield self[index]
+
+
+class LayoutPlan(object):
+    ''' compiled layout of a valid frame: match() and decode() are generated
+        once with offsets, types, channels and conversions inlined '''
+
+    __slots__ = ( 'length', 'match', 'decode' )
+
+    def __init__(self, length, match, decode):
+        self.length     = length
+        self.match      = match         # frame --> bool
+        self.decode     = decode        # frame --> tuple of Measurement
+
+
+class DecodeError(Exception):
+    ''' structured decoding error: what went wrong and where in the frame '''
+
+    # reasons
+    BAD_HEX         = 'bad_hex'         # raw data is not an even-length hex string
+    BAD_ENCODING    = 'bad_encoding'    # raw data neither hex nor base64 (see frame_from_text())
+    TOO_SHORT       = 'too_short'       # not even a frame header
+    BAD_VERSION     = 'bad_version'     # unsupported frame version
+    UNKNOWN_TYPE    = 'unknown_type'    # data type not in TYPE
+    TRUNCATED       = 'truncated'       # frame ends in the middle of a measurement
+    UNSUPPORTED     = 'unsupported'     # known type we're unable to convert (e.g GPS)
+
+    def __init__(self, reason, offset=None, type_id=None, detail=None):
+        super().__init__(reason)
+        self.reason     = reason
+        self.offset     = offset        # cursor in frame where decoding stopped
+        self.type_id    = type_id
+        self.detail     = detail
+
+    def as_dict(self):
+        return { 'reason': self.reason, 'offset': self.offset,
+                 'type': self.type_id, 'detail': self.detail }
+
+    def __str__(self):
+        _msg = "%s @ offset %s" % (self.reason, str(self.offset))
+        if( self.type_id is not None ):
+            _msg += " (type %d)" % self.type_id
+        if( self.detail ):
+            _msg += ": " + str(self.detail)
+        return _msg
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#transforme une chaine hexa en liste de valeurs utilisable par le decoder
+def str_to_int(payload):
+    ''' returns the frame as bytes (i.e indexing yields int) or None
+        if payload is not a valid hex string '''
+    try:
+        return bytes.fromhex(payload)
+    except (TypeError, ValueError):
+        return None
+
+
+#*** Shared key of measurements of a channel
+def measurement_key(unit, channel, type_id):
+    _key = ( unit, channel, type_id )
+    return _KEYS.setdefault( _key, _key )
+
+
+#*** Table des infodata() d'une table de types
+def info_table (types):
+    ''' { ID: ( nom, unit, size, mult [, ref, pas] ) } of a TYPE-like table
+        (types left untouched) '''
+    info = dict()
+    for _ind in types:
+        _unit = sys.intern(_ind['unit'])
+        if 'ref' in _ind :
+            info[_ind['ID']] = (_ind['nom'],_unit,_ind['size'],_ind['mult'],_ind['ref'],_ind['pas'])
+        else:
+            info[_ind['ID']] = (_ind['nom'],_unit,_ind['size'],_ind['mult'])
+    return info
+
+# infodata() results, built once
+_INFO = info_table(TYPE)
+
+
+#*** Retourne un tuple avec nom, unit, size, mult, ref, pas d'un type de data ***
+def infodata (data_type):
+    #data_type : est un eniter qui correspond au type de la data d'apres la convention neOCayenne
+
+    info = _INFO.get(data_type)
+    if( info is None ):
+        log.debug("unknown data type %d" % data_type)
+        return False
+    return info
+
+
+#*** Transforme les datas de la convention neOCayenne en float
+def transfo_data (info,data):
+    #info : est le tuple renvoye par infodata() qui contient nom, unit, size, mult, ref, pas d'un type de data
+    #data : est la data un tableau qui represente la data sous forme cayenne
+    #DATA : est la data sous forme de float
+
+    if len(info) == 4 : #Les datas sans références
+        if info[2] == 1: #La data est un binaire sur 1 octet
+            DATA = data[0]
+
+        elif info[2] == 2: #La data est un entier mis sur 2 octet
+            DATA = float(data[0]+(data[1]<<8)) #LSB + MSB*256
+
+        elif info[2] == 3: #La data est un float mis sur 3 octet avec la partie entiere sur 2 octet et la partie float sur 1 octet
+            DATA = data[0]+(data[1]<<8) #LSB + MSB*256 ici partie entiere
+            DATA += data[2]/256
+            DATA = round(DATA,2) #Pour tronquer a 10^-2
+
+        elif info[2] == 4: #La data est un float mis sur 4 octet
+            DATA = data[0]+(data[1]<<8)+(data[2]<<16)+(data[3]<<24)
+
+        else: #ex. GPS sur 9 octets
+            raise DecodeError( DecodeError.UNSUPPORTED, detail="%s on %d bytes" % (info[0],info[2]) )
+
+    else :
+        if info[0] == "temperature":
+            pf = data[0]>>7
+
+            if pf == 1 : #cas eniter negatif
+                data=data[0] - (data[0]>>7)
+                DATA = ((-data) * info[5]*info[3])/info[3] + info[4]
+
+            else : #cas entier possitif
+                DATA = (data[0] * info[5]*info[3])/info[3] + info[4]
+
+        else :
+            DATA = (data[0] * info[5]) + info[4]
+
+    return DATA
+
+
+#*** Retourne les mesures valides de la trame + une eventuelle erreur
+def decode_frame (frame, info_types=None):
+    ''' bounds-checked decoding of a whole frame.
+        frame: bytes (or list of int) as returned by str_to_int()
+        info_types: info_table() of another TYPE version, current one otherwise
+        returns ( measurements, error ) with measurements a tuple of
+            Measurement and error either None or a DecodeError
+        Decoding stops at first error, previous measurements are kept.
+    '''
+    measurements = []
+
+    if( frame is None ):
+        return tuple(measurements), DecodeError( DecodeError.BAD_HEX, offset=0 )
+
+    _len = len(frame)
+    if( _len < FRAME_HEADER_SIZE ):
+        return tuple(measurements), DecodeError( DecodeError.TOO_SHORT, offset=0, detail="%d bytes" % _len )
+
+    if( frame[0] != FRAME_VERSION ):
+        return tuple(measurements), DecodeError( DecodeError.BAD_VERSION, offset=0, detail="0x%02X" % frame[0] )
+
+    cursor = FRAME_HEADER_SIZE
+    while( cursor < _len ):
+        # type, channel
+        if( cursor + 2 > _len ):
+            return tuple(measurements), DecodeError( DecodeError.TRUNCATED, offset=cursor )
+        type_id = frame[cursor]
+        channel = frame[cursor+1]
+
+        info = infodata(type_id) if info_types is None else info_types.get(type_id, False)
+        if( info is False ):
+            # unknown size hence nothing more to decode
+            return tuple(measurements), DecodeError( DecodeError.UNKNOWN_TYPE, offset=cursor, type_id=type_id )
+
+        # data
+        _end = cursor + 2 + info[2]
+        if( _end > _len ):
+            return tuple(measurements), DecodeError( DecodeError.TRUNCATED, offset=cursor, type_id=type_id,
+                                                      detail="%d bytes expected, %d available" % (info[2],_len-cursor-2) )
+        try:
+            value = transfo_data( info, frame[cursor+2:_end] )
+        except DecodeError as ex:
+            ex.offset = cursor
+            ex.type_id = type_id
+            return tuple(measurements), ex
+
+        measurements.append( Measurement(value, measurement_key(info[1], channel, type_id)) )
+        cursor = _end
+
+    return tuple(measurements), None
+
+
+#*** Frame from hex or base64 text
+def frame_from_text(text, encoding=None):
+    ''' encoding: 'hex', 'base64' or None (hex if valid hex, base64 otherwise)
+        returns bytes or None if invalid '''
+    if( not isinstance(text, str) ):
+        return None
+    if( encoding in (None, 'hex') ):
+        _frame = str_to_int(text)
+        if( _frame is not None or encoding == 'hex' ):
+            return _frame
+    try:
+        return base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+#*** Compile the layout of a valid frame (None if frame does not decode)
+def compile_layout(frame):
+    if( frame is None or decode_frame(frame)[1] is not None ):
+        return None
+    checks = [ "len(f) == %d" % len(frame), "f[0] == %d" % FRAME_VERSION ]
+    values = []
+    namespace = { 'M': Measurement, 'transfo_data': transfo_data }
+    cursor = FRAME_HEADER_SIZE
+    while( cursor < len(frame) ):
+        type_id = frame[cursor]
+        channel = frame[cursor+1]
+        info = _INFO[type_id]
+        _index = len(values)
+        namespace['i%d' % _index] = info
+        checks.append( "f[%d] == %d and f[%d] == %d" % (cursor,type_id,cursor+1,channel) )
+        namespace['k%d' % _index] = measurement_key(info[1], channel, type_id)
+        values.append( "M(%s, k%d)" % (_conversion(info, cursor+2, _index),_index) )
+        cursor += 2 + info[2]
+
+    _source = ( "def match(f):\n    return %s\n" % " and ".join(checks) +
+                "def decode(f):\n    return (%s,)\n" % ", ".join(values) )
+    exec( compile(_source, "<layout>", "exec"), namespace )
+    return LayoutPlan( len(frame), namespace['match'], namespace['decode'] )
+
+
+#*** Decode many frames: yields ( measurements, error ) per frame
+def decode_batch(frames, plans=None):
+    ''' frames: iterable of bytes (or None, see str_to_int())
+        plans: optional dict of compiled layouts kept across calls
+        same results as decode_frame(), frames sharing a layout go through
+        its compiled plan.
+    '''
+    if( plans is None ):
+        plans = dict()
+    for frame in frames:
+        if( frame is None or len(frame) < FRAME_HEADER_SIZE + 2 ):
+            yield decode_frame(frame)
+            continue
+
+        _key = ( len(frame), frame[FRAME_HEADER_SIZE], frame[FRAME_HEADER_SIZE+1] )
+        _candidates = plans.get(_key, ())
+        for _plan in _candidates:
+            if( _plan.match(frame) ):
+                yield _plan.decode(frame), None
+                break
+        else:
+            # new layout (or malformed frame)
+            _res = decode_frame(frame)
+            if( _res[1] is None and len(_candidates) < _MAX_PLANS_PER_KEY ):
+                if( len(plans) >= _MAX_PLANS ):
+                    plans.clear()
+                plans.setdefault(_key, list()).append( compile_layout(frame) )
+            yield _res
+
+
+#*** Value conversion expression of a type at offset o (same maths as transfo_data)
+def _conversion(info, o, index):
+    if len(info) == 4 :
+        if info[2] == 1:
+            return "f[%d]" % o
+        if info[2] == 2:
+            return "float(f[%d]+(f[%d]<<8))" % (o,o+1)
+        if info[2] == 3:
+            return "round(f[%d]+(f[%d]<<8) + f[%d]/256, 2)" % (o,o+1,o+2)
+        if info[2] == 4:
+            return "f[%d]+(f[%d]<<8)+(f[%d]<<16)+(f[%d]<<24)" % (o,o+1,o+2,o+3)
+        return "transfo_data(i%d, f[%d:%d])" % (index,o,o+info[2])
+
+    # i[3]: mult, i[4]: ref, i[5]: pas
+    if info[0] == "temperature":
+        return ( "((((-(f[{o}] - 1)) * i{i}[5]*i{i}[3])/i{i}[3] + i{i}[4]) if f[{o}]>>7 == 1 else "
+                 "((f[{o}] * i{i}[5]*i{i}[3])/i{i}[3] + i{i}[4]))" ).format(o=o, i=index)
+    return "((f[{o}] * i{i}[5]) + i{i}[4])".format(o=o, i=index)
+
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Deadband (i.e change-only) publishing
+#
+# A per-(device, channel) last published value index: a new sample is published
+# only if it moved away from the last published one by more than the deadband
+# of its unit, or if nothing has been published for this channel since more
+# than heartbeat seconds.
+#
+# Notes:
+#   index is array-backed (one slot per channel) to scale to ~100k channels.
+#   deadbands = { unit: { 'abs': <absolute>, 'rel': <relative to last value> } }
+#   a unit without deadband is published whenever its value changes.
+#   heartbeat is measured with a monotonic clock (wall clock steps ignored).
+#   index is bounded (max_channels): once full, channels silent for more than
+#   heartbeat seconds (their next sample is published anyway) free their slot;
+#   if none, new channels are published without being tracked.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+from array import array
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class DeadbandIndex(object):
+
+    __slots__ = ( '_slots', '_values', '_times', '_free', '_deadbands', '_heartbeat',
+                  '_max_channels', '_lastSweep', '_published', '_suppressed', '_untracked' )
+
+
+    #
+    # object initialization
+    def __init__(self, deadbands=None, heartbeat=900, max_channels=100000, *args, **kwargs ):
+        self._slots         = dict()        # { (device, channel): slot }
+        self._values        = array('d')    # last published value
+        self._times         = array('d')    # last publish time (monotonic)
+        self._free          = list()        # slots of evicted channels
+        self._heartbeat     = float(heartbeat)
+        self._max_channels  = max(1, int(max_channels))
+        self._lastSweep     = None
+        self._published     = 0
+        self._suppressed    = 0
+        self._untracked     = 0             # published while index full
+
+        # unit --> ( absolute, relative ) thresholds
+        self._deadbands = dict()
+        for unit, band in (deadbands or dict()).items():
+            self._deadbands[unit] = ( float(band.get('abs', 0)), float(band.get('rel', 0)) )
+        log.debug("deadbands: " + str(self._deadbands))
+
+
+    ''' True if sample is to get published (and thus recorded as the last one) '''
+    def should_publish(self, device, channel, unit, value, now=None):
+        if( now is None ):
+            now = time.monotonic()
+
+        _key = ( device, channel )
+        _slot = self._slots.get(_key)
+        if( _slot is None ):
+            # first sample of this channel
+            self._published += 1
+            if( len(self._slots) >= self._max_channels and not self._sweep(now) ):
+                self._untracked += 1
+                return True
+            if( self._free ):
+                _slot = self._free.pop()
+                self._values[_slot] = value
+                self._times[_slot] = now
+            else:
+                _slot = len(self._values)
+                self._values.append(value)
+                self._times.append(now)
+            self._slots[_key] = _slot
+            return True
+
+        if( now - self._times[_slot] < self._heartbeat ):
+            _delta = abs(value - self._values[_slot])
+            _band = self._deadbands.get(unit)
+            if( _delta == 0 or (_band is not None and
+                                _delta < max(_band[0], _band[1] * abs(self._values[_slot]))) ):
+                self._suppressed += 1
+                return False
+
+        self._values[_slot] = value
+        self._times[_slot] = now
+        self._published += 1
+        return True
+
+
+    def stats(self):
+        return { 'channels': len(self._slots), 'published': self._published,
+                 'suppressed': self._suppressed, 'untracked': self._untracked }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _sweep(self, now):
+        # index full: free channels silent for more than heartbeat (at most
+        # once per tenth of heartbeat), True if some slot is available
+        if( self._lastSweep is not None and now - self._lastSweep < self._heartbeat / 10 ):
+            return bool(self._free)
+        self._lastSweep = now
+        _stale = [ _key for _key, _slot in self._slots.items() if now - self._times[_slot] >= self._heartbeat ]
+        for _key in _stale:
+            self._free.append( self._slots.pop(_key) )
+        if( _stale ):
+            log.debug("deadband index full: %d silent channel(s) evicted" % len(_stale))
+        return bool(self._free)
+
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Decoded frames memoization
+#
+# Lots of our end-devices (presence, digital I/O, stable CO2 ...) send the very
+# same payload for hours: this LRU keyed by the raw (hex) payload returns the
+# already decoded measurements, hence skipping both hex conversion and decoding.
+#
+# Notes:
+#   - only successfully decoded frames get cached (i.e no DecodeError).
+#   - cached measurements are tuples, hence immutable and safe to share.
+#   - size is a memory budget (bytes), entries are evicted in LRU order.
+#   - raw payloads that aren't strings (e.g a JSON list in 'data') are never
+#     cached: get() misses, put() ignores them.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import sys
+from collections import OrderedDict
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_ENTRY_OVERHEAD     = 100   # approx. bytes of an OrderedDict entry (hash, links ...)
+
+
+
+# #############################################################################
+#
+# Class
+#
+class DecodeCache(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _budget         = 0         # memory budget in bytes
+
+
+    #
+    # object initialization
+    def __init__(self, budget, *args, **kwargs ):
+        self._lock      = Lock()
+        self._entries   = OrderedDict()     # { raw: ( measurements, cost ) }
+        self._size      = 0                 # estimated memory used by entries
+        self._hits      = 0
+        self._misses    = 0
+        self._evictions = 0
+        self._budget    = max(0, int(budget))
+        log.debug("decode cache with a %d bytes budget" % self._budget)
+
+
+    ''' returns cached measurements or None '''
+    def get(self, raw):
+        if( not isinstance(raw, str) ):
+            return None
+        with self._lock:
+            _entry = self._entries.get(raw)
+            if( _entry is None ):
+                self._misses += 1
+                return None
+            self._entries.move_to_end(raw)
+            self._hits += 1
+            return _entry[0]
+
+
+    ''' add successfully decoded measurements '''
+    def put(self, raw, measurements):
+        if( not isinstance(raw, str) ):
+            return
+        _cost = self._cost(raw, measurements)
+        if( _cost > self._budget ):
+            return
+        with self._lock:
+            _old = self._entries.pop(raw, None)
+            if( _old is not None ):
+                self._size -= _old[1]
+            self._entries[raw] = ( measurements, _cost )
+            self._size += _cost
+            self._evict()
+
+
+    ''' change memory budget (e.g config reload) '''
+    def resize(self, budget):
+        with self._lock:
+            self._budget = max(0, int(budget))
+            self._evict()
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+    ''' hit / miss / eviction statistics '''
+    def stats(self):
+        with self._lock:
+            _lookups = self._hits + self._misses
+            return { 'entries': len(self._entries), 'size': self._size, 'budget': self._budget,
+                     'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions,
+                     'hit_ratio': round(self._hits / _lookups, 3) if _lookups else 0.0 }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    ''' evict LRU entries till we fit in budget (lock held) '''
+    def _evict(self):
+        while( self._size > self._budget and len(self._entries) ):
+            _raw, _entry = self._entries.popitem(last=False)
+            self._size -= _entry[1]
+            self._evictions += 1
+
+
+    ''' approx. memory footprint of an entry '''
+    @staticmethod
+    def _cost(raw, measurements):
+        _cost = _ENTRY_OVERHEAD + sys.getsizeof(raw) + sys.getsizeof(measurements)
+        for _m in measurements:
+            # keys are shared by all measurements of a channel, not accounted for
+            _cost += sys.getsizeof(_m) + sys.getsizeof(_m.value)
+        return _cost
+
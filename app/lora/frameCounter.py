@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-device frame counters: packets loss / gaps index
+#
+# For each end-device, we keep the last uplink frame counter (fcnt), the last
+# seen time along with cumulative received / lost / duplicated frames and
+# counter resets (e.g rejoin). Updates are O(1), state is array-backed.
+#
+# Notes:
+#   LoRaWAN uplink counters may be 16 bits: 0xFFxx --> 0x00xx is a rollover,
+#   any other backward step is a reset.
+#   fcnt out of [0, _FCNT_MAX] raises ValueError, index left untouched.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+from array import array
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_FCNT16_WRAP    = 0x10000
+_FCNT16_MARGIN  = 0x100     # rollover window
+_FCNT_MAX       = 2 ** (8 * array('L').itemsize) - 1   # array('L') upper bound
+
+
+
+# #############################################################################
+#
+# Class
+#
+class FrameCounterIndex(object):
+
+    __slots__ = ( '_lock', '_slots', '_devices', '_fcnt', '_seen',
+                  '_frames', '_lost', '_duplicates', '_resets' )
+
+
+    #
+    # object initialization
+    def __init__(self, *args, **kwargs ):
+        self._lock          = Lock()
+        self._slots         = dict()        # { device: slot }
+        self._devices       = list()        # slot --> device
+        self._fcnt          = array('L')    # last frame counter
+        self._seen          = array('d')    # last seen time
+        self._frames        = array('L')    # received frames
+        self._lost          = array('L')    # frames never received
+        self._duplicates    = array('L')    # same fcnt received again
+        self._resets        = array('L')    # counter went backward
+
+
+    ''' new uplink from device: returns number of frames lost since previous one '''
+    def update(self, device, fcnt, now=None):
+        if( now is None ):
+            now = time.time()
+        fcnt = int(fcnt)
+        if( fcnt < 0 or fcnt > _FCNT_MAX ):
+            raise ValueError("frame counter out of range: %d" % fcnt)
+
+        with self._lock:
+            _slot = self._slots.get(device)
+            if( _slot is None ):
+                self._slots[device] = len(self._devices)
+                self._devices.append(device)
+                self._fcnt.append(fcnt)
+                self._seen.append(now)
+                self._frames.append(1)
+                for _counters in ( self._lost, self._duplicates, self._resets ):
+                    _counters.append(0)
+                return 0
+
+            _gap = 0
+            _delta = fcnt - self._fcnt[_slot]
+            if( _delta == 0 ):
+                self._duplicates[_slot] += 1
+            elif( _delta < 0 and self._fcnt[_slot] >= _FCNT16_WRAP - _FCNT16_MARGIN and fcnt < _FCNT16_MARGIN ):
+                # 16 bits rollover
+                _gap = _delta + _FCNT16_WRAP - 1
+            elif( _delta < 0 ):
+                self._resets[_slot] += 1
+                log.debug("[%s] frame counter reset %d --> %d" % (str(device),self._fcnt[_slot],fcnt))
+            else:
+                _gap = _delta - 1
+
+            self._lost[_slot] += _gap
+            self._frames[_slot] += 1
+            self._fcnt[_slot] = fcnt
+            self._seen[_slot] = now
+            return _gap
+
+
+    ''' counters of a device or None '''
+    def get(self, device):
+        with self._lock:
+            _slot = self._slots.get(device)
+            return None if _slot is None else self._entry(_slot)
+
+
+    ''' counters of all devices '''
+    def snapshot(self):
+        with self._lock:
+            return { self._devices[_slot]: self._entry(_slot) for _slot in range(len(self._devices)) }
+
+
+    def __len__(self):
+        return len(self._devices)
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _entry(self, slot):
+        _frames = self._frames[slot]
+        _lost = self._lost[slot]
+        return { 'fcnt': self._fcnt[slot], 'last_seen': round(self._seen[slot], 3),
+                 'frames': _frames, 'lost': _lost, 'duplicates': self._duplicates[slot],
+                 'resets': self._resets[slot],
+                 'loss_ratio': round(_lost / (_frames + _lost), 4) }
+
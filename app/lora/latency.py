@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# End-to-end latency tracking: network server's reception time --> publish
+#
+# Latencies are recorded in streaming quantile sketches (relative error bounded
+# log-buckets histograms, i.e O(1) per sample and fixed memory) per input topic
+# prefix and per device class. Sketches cover a time window: at the end of each
+# window, p99 is checked against the SLO and a new window starts.
+#
+# Notes:
+#   record() is called from the mqtt_loop's thread while rotate() and status()
+#   are called from the main loop (or anywhere else), hence the lock.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import math
+import time
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class QuantileSketch(object):
+    ''' log-buckets histogram: quantiles with <accuracy> relative error '''
+
+    __slots__ = ( '_gamma_log', '_buckets', '_zero', 'count', 'total', 'max' )
+
+    def __init__(self, accuracy=0.01):
+        self._gamma_log = math.log( (1 + accuracy) / (1 - accuracy) )
+        self._buckets   = dict()    # { index: count }
+        self._zero      = 0         # null or negative values (e.g clock skew)
+        self.count      = 0
+        self.total      = 0.0
+        self.max        = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if( value > self.max ):
+            self.max = value
+        if( value <= 0 ):
+            self._zero += 1
+            return
+        _index = math.ceil( math.log(value) / self._gamma_log )
+        self._buckets[_index] = self._buckets.get(_index, 0) + 1
+
+    def quantile(self, q):
+        if( not self.count ):
+            return None
+        _rank = q * (self.count - 1)
+        _seen = self._zero
+        if( _rank < _seen ):
+            return 0.0
+        for _index in sorted(self._buckets):
+            _seen += self._buckets[_index]
+            if( _seen > _rank ):
+                # middle of the bucket
+                return min( self.max, 2 * math.exp(_index * self._gamma_log) / (1 + math.exp(self._gamma_log)) )
+        return self.max
+
+    def summary(self):
+        if( not self.count ):
+            return { 'count': 0 }
+        return { 'count': self.count, 'mean': round(self.total / self.count, 3),
+                 'p50': round(self.quantile(0.5), 3), 'p90': round(self.quantile(0.9), 3),
+                 'p99': round(self.quantile(0.99), 3), 'max': round(self.max, 3) }
+
+
+class LatencyTracker(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _slo            = None      # p99 objective (seconds)
+    _topic_depth    = 2         # number of topic levels of a prefix
+
+
+    #
+    # object initialization
+    def __init__(self, slo, topic_depth=2, accuracy=0.01, *args, **kwargs ):
+        self._slo           = float(slo)
+        self._topic_depth   = int(topic_depth)
+        self._accuracy      = accuracy
+        self._lock          = Lock()
+        self._start         = time.time()
+        self._current       = { 'topic': dict(), 'class': dict() }
+        self._last          = None      # summaries of last complete window
+        self._violations    = 0
+
+
+    ''' record a radio --> publish latency (seconds) '''
+    def record(self, topic, device_class, latency):
+        _prefix = '/'.join( topic.split('/', self._topic_depth)[:self._topic_depth] )
+        with self._lock:
+            for _kind, _key in ( ('topic', _prefix), ('class', str(device_class)) ):
+                _sketch = self._current[_kind].get(_key)
+                if( _sketch is None ):
+                    _sketch = QuantileSketch( self._accuracy )
+                    self._current[_kind][_key] = _sketch
+                _sketch.add(latency)
+
+
+    ''' close current window, check SLO and start a new window '''
+    def rotate(self):
+        with self._lock:
+            _window = self._current
+            self._current = { 'topic': dict(), 'class': dict() }
+            _duration = time.time() - self._start
+            self._start = time.time()
+
+        _last = { 'duration': round(_duration, 1) }
+        for _kind, _sketches in _window.items():
+            _last[_kind] = { _key: _sketch.summary() for _key, _sketch in _sketches.items() }
+            for _key, _summary in _last[_kind].items():
+                if( _summary['p99'] > self._slo ):
+                    self._violations += 1
+                    log.warning("[latency] %s '%s' p99=%.3fs exceeds SLO %.3fs (%d msgs, max %.3fs)" %
+                                (_kind,_key,_summary['p99'],self._slo,_summary['count'],_summary['max']) )
+        self._last = _last
+        return _last
+
+
+    ''' current state: on going window and last complete window '''
+    def status(self):
+        with self._lock:
+            _current = { _kind: { _key: _sketch.summary() for _key, _sketch in _sketches.items() }
+                            for _kind, _sketches in self._current.items() }
+            _current['duration'] = round(time.time() - self._start, 1)
+        return { 'slo_p99': self._slo, 'violations': self._violations,
+                 'current': _current, 'last': self._last }
+
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Latest value per (device, channel) shared through a memory-mapped file
+#
+# The decoder (single writer) records the last decoded value, unit and
+# timestamp of every (device, channel) in fixed-size slots of a file mapped in
+# memory (e.g /dev/shm); the web app (uwsgi workers, other processes) maps the
+# same file read-only and serves it without any broker nor database access.
+#
+# Notes:
+#   slots are append-only: a (device, channel) keeps its slot forever, readers
+#   only need to learn new slots (header's count) to update their own index.
+#   each slot is protected by a sequence counter (seqlock): odd while being
+#   written, readers retry if it changed while they were reading.
+#   the writer creates a new file at startup: readers re-map it whenever its
+#   inode changes.
+#   device identifiers are limited to 32 bytes, units to 16 bytes.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import mmap
+import time
+import struct
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_MAGIC          = b'LDLV'
+_VERSION        = 1
+_HEADER         = struct.Struct('<4sIII')       # magic, version, capacity, count
+_HEADER_SIZE    = 64
+_COUNT_OFFSET   = 12
+_SEQ            = struct.Struct('<Q')
+_SLOT           = struct.Struct('<QddB7x32s16s') # seq, value, timestamp, channel, device, unit
+_DATA           = struct.Struct('<ddB7x32s16s')  # slot without seq
+_MAX_RETRIES    = 100
+
+
+
+# #############################################################################
+#
+# Class
+#
+class LatestValueWriter(object):
+
+    #
+    # object initialization
+    def __init__(self, path, capacity=65536, *args, **kwargs ):
+        self._path      = path
+        self._capacity  = int(capacity)
+        self._slots     = dict()    # { (device, channel): slot }
+        self._full      = False
+
+        # new file each start (readers notice the inode change)
+        os.makedirs( os.path.dirname(path) or '.', exist_ok=True )
+        _tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(_tmp, 'wb') as f:
+            f.truncate( _HEADER_SIZE + self._capacity * _SLOT.size )
+        self._file = open(_tmp, 'r+b')
+        self._map = mmap.mmap( self._file.fileno(), 0 )
+        _HEADER.pack_into( self._map, 0, _MAGIC, _VERSION, self._capacity, 0 )
+        os.replace(_tmp, path)
+        log.debug("latest values index '%s': %d slots of %d bytes" % (path,self._capacity,_SLOT.size))
+
+
+    ''' record latest value of a (device, channel) '''
+    def update(self, device, channel, value, unit, timestamp=None):
+        if( timestamp is None ):
+            timestamp = time.time()
+        _key = ( device, channel )
+        _slot = self._slots.get(_key)
+        if( _slot is None ):
+            _slot = self._allocate(_key)
+            if( _slot is None ):
+                return False
+
+        _offset = _HEADER_SIZE + _slot * _SLOT.size
+        _seq = _SEQ.unpack_from(self._map, _offset)[0]
+        _SEQ.pack_into( self._map, _offset, _seq + 1 )
+        _DATA.pack_into( self._map, _offset + _SEQ.size, float(value), timestamp, channel,
+                         str(device).encode('utf-8')[:32], str(unit).encode('utf-8')[:16] )
+        _SEQ.pack_into( self._map, _offset, _seq + 2 )
+        return True
+
+
+    def __len__(self):
+        return len(self._slots)
+
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _allocate(self, key):
+        _slot = len(self._slots)
+        if( _slot >= self._capacity ):
+            if( not self._full ):
+                log.warning("latest values index full (%d slots) ... new channels ignored" % self._capacity)
+                self._full = True
+            return None
+        self._slots[key] = _slot
+        # slot gets published (count) once its key is written
+        _offset = _HEADER_SIZE + _slot * _SLOT.size
+        _DATA.pack_into( self._map, _offset + _SEQ.size, 0.0, 0.0, key[1],
+                         str(key[0]).encode('utf-8')[:32], b'' )
+        struct.pack_into( '<I', self._map, _COUNT_OFFSET, _slot + 1 )
+        return _slot
+
+
+class LatestValueReader(object):
+
+    #
+    # object initialization
+    def __init__(self, path, *args, **kwargs ):
+        self._path      = path
+        self._lock      = Lock()
+        self._inode     = None
+        self._map       = None
+        self._known     = 0         # slots already indexed
+        self._devices   = dict()    # { device: [ slots ] }
+
+
+    ''' latest values of a device: { channel: { value, unit, timestamp } } or
+        None if unknown device, raises OSError if index not available '''
+    def device(self, device):
+        with self._lock:
+            self._refresh()
+            _slots = self._devices.get(device)
+            if( _slots is None ):
+                return None
+            return self._values(_slots)
+
+
+    ''' latest values of devices starting with prefix: { device: { channel: ... } } '''
+    def prefix(self, prefix=''):
+        with self._lock:
+            self._refresh()
+            return { _device: self._values(_slots) for _device, _slots in self._devices.items()
+                        if _device.startswith(prefix) }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _refresh(self):
+        # (re)map if file changed (e.g decoder restart)
+        _inode = os.stat(self._path).st_ino
+        if( _inode != self._inode ):
+            with open(self._path, 'rb') as f:
+                _map = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+            _magic, _version = _HEADER.unpack_from(_map, 0)[:2]
+            if( _magic != _MAGIC or _version != _VERSION ):
+                _map.close()
+                raise OSError("'%s' is not a latest values index" % self._path)
+            if( self._map is not None ):
+                self._map.close()
+            self._map, self._inode = _map, _inode
+            self._known = 0
+            self._devices = dict()
+
+        # new slots
+        _count = struct.unpack_from('<I', self._map, _COUNT_OFFSET)[0]
+        while( self._known < _count ):
+            _device = self._read(self._known)[4]
+            self._devices.setdefault(_device, list()).append(self._known)
+            self._known += 1
+
+    def _read(self, slot):
+        _offset = _HEADER_SIZE + slot * _SLOT.size
+        for _ in range(_MAX_RETRIES):
+            _seq, _value, _ts, _channel, _device, _unit = _SLOT.unpack_from(self._map, _offset)
+            if( not _seq & 1 and _SEQ.unpack_from(self._map, _offset)[0] == _seq ):
+                break
+        return ( _seq, _value, _ts, _channel,
+                 _device.rstrip(b'\0').decode('utf-8', 'replace'), _unit.rstrip(b'\0').decode('utf-8', 'replace') )
+
+    def _values(self, slots):
+        _res = dict()
+        for _slot in slots:
+            _seq, _value, _ts, _channel, _device, _unit = self._read(_slot)
+            if( not _seq ):
+                continue    # allocated, never written yet
+            _res[str(_channel)] = { 'value': _value, 'unit': _unit, 'timestamp': round(_ts, 3) }
+        return _res
+
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Silent devices detection
+#
+# Each end-device gets an expiry scheduled according to its own observed
+# reporting interval (EWMA x factor, bounded). Expiries are held in a
+# hierarchical timer wheel: schedule / cancel are O(1) whatever the number of
+# devices, advancing time only visits due slots.
+#
+# Notes:
+#   update() is called from the mqtt_loop's thread while expired() is called
+#   from the main loop, hence the lock.
+#   next_check() is the next non-empty slot's time (expiry or cascade): the
+#   main loop doesn't wake up every tick. Devices registered meanwhile can't
+#   expire sooner than min(min_timeout, first_timeout).
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class TimerWheel(object):
+    ''' hierarchical timer wheel: <levels> wheels of <slots> slots, the first
+        one ticking every <resolution> seconds '''
+
+    #
+    # object initialization
+    def __init__(self, resolution=1.0, slots=64, levels=4, now=None, *args, **kwargs ):
+        self._resolution    = float(resolution)
+        self._slots         = int(slots)
+        self._levels        = int(levels)
+        self._spans         = [ self._slots ** level for level in range(self._levels + 1) ]
+        self._wheels        = [ [ set() for _ in range(self._slots) ] for _ in range(self._levels) ]
+        self._where         = dict()    # { key: ( slot, tick ) }
+        self._tick          = int( (time.time() if now is None else now) / self._resolution )
+
+
+    ''' (re)schedule key to expire at deadline (epoch) '''
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        self._place( key, max(int(deadline / self._resolution), self._tick + 1) )
+
+
+    def cancel(self, key):
+        _entry = self._where.pop(key, None)
+        if( _entry is not None ):
+            _entry[0].discard(key)
+
+
+    ''' advance wheel up to now: returns list of expired keys '''
+    def advance(self, now):
+        _expired = list()
+        _target = int(now / self._resolution)
+        while( self._tick < _target ):
+            self._tick += 1
+
+            # cascade upper wheels' slots whose time has come
+            for _level in range(1, self._levels):
+                if( self._tick % self._spans[_level] ):
+                    break
+                self._cascade( _level, (self._tick // self._spans[_level]) % self._slots )
+
+            # first wheel
+            _index = self._tick % self._slots
+            _slot = self._wheels[0][_index]
+            if( not _slot ):
+                continue
+            self._wheels[0][_index] = set()
+            for _key in _slot:
+                _tick = self._where[_key][1]
+                if( _tick <= self._tick ):
+                    del self._where[_key]
+                    _expired.append(_key)
+                else:
+                    # beyond wheels' range
+                    self._place(_key, _tick)
+        return _expired
+
+
+    ''' time of next tick '''
+    def next_tick(self):
+        return (self._tick + 1) * self._resolution
+
+
+    ''' time advance() has something to do at (expiry or cascade), None if empty '''
+    def next_deadline(self):
+        if( not self._where ):
+            return None
+        _next = None
+        for _level in range(self._levels):
+            # first non-empty slot of this wheel, in visiting order
+            _span = self._spans[_level]
+            _group = self._tick // _span
+            for _offset in range(1, self._slots + 1):
+                if( self._wheels[_level][ (_group + _offset) % self._slots ] ):
+                    _tick = (_group + _offset) * _span
+                    _next = _tick if _next is None else min(_next, _tick)
+                    break
+        return None if _next is None else _next * self._resolution
+
+
+    def __len__(self):
+        return len(self._where)
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _place(self, key, tick):
+        _delta = tick - self._tick
+        _level = 0
+        while( _level < self._levels - 1 and _delta >= self._spans[_level + 1] ):
+            _level += 1
+        _slot = self._wheels[_level][ (tick // self._spans[_level]) % self._slots ]
+        _slot.add(key)
+        self._where[key] = ( _slot, tick )
+
+    def _cascade(self, level, index):
+        _slot = self._wheels[level][index]
+        if( not _slot ):
+            return
+        self._wheels[level][index] = set()
+        for _key in _slot:
+            self._place( _key, self._where[_key][1] )
+
+
+class LivenessTracker(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _factor         = 3.0       # silent after <factor> x usual interval
+    _min_timeout    = 300       # seconds
+    _max_timeout    = 86400     # seconds
+    _first_timeout  = 3600      # until an interval has been observed
+
+
+    #
+    # object initialization
+    def __init__(self, factor=3.0, min_timeout=300, max_timeout=86400, first_timeout=3600, resolution=1.0, *args, **kwargs ):
+        self._factor        = float(factor)
+        self._min_timeout   = float(min_timeout)
+        self._max_timeout   = float(max_timeout)
+        self._first_timeout = float(first_timeout)
+        self._lock          = Lock()
+        self._wheel         = TimerWheel( resolution=resolution )
+        self._devices       = dict()    # { device: [ last seen, EWMA interval or None ] }
+        self._silent        = set()
+
+
+    ''' device just reported: returns True if it was silent till now '''
+    def update(self, device, now=None):
+        if( now is None ):
+            now = time.time()
+        with self._lock:
+            _state = self._devices.get(device)
+            if( _state is None ):
+                _state = [ now, None ]
+                self._devices[device] = _state
+            elif( now > _state[0] ):
+                _interval = now - _state[0]
+                _state[1] = _interval if _state[1] is None else 0.8 * _state[1] + 0.2 * _interval
+                _state[0] = now
+
+            if( _state[1] is None ):
+                _timeout = self._first_timeout
+            else:
+                _timeout = min( self._max_timeout, max(self._min_timeout, self._factor * _state[1]) )
+            self._wheel.schedule( device, now + _timeout )
+
+            if( device in self._silent ):
+                self._silent.discard(device)
+                return True
+        return False
+
+
+    ''' devices that just went silent: [ ( device, last seen, usual interval ) ] '''
+    def expired(self, now=None):
+        if( now is None ):
+            now = time.time()
+        with self._lock:
+            _expired = list()
+            for device in self._wheel.advance(now):
+                self._silent.add(device)
+                _state = self._devices[device]
+                _expired.append( ( device, _state[0], _state[1] ) )
+        return _expired
+
+
+    ''' time of next check: next expiry, not later than the shortest timeout a
+        device may get from now on (None if no device) '''
+    def next_check(self, now=None):
+        if( now is None ):
+            now = time.time()
+        with self._lock:
+            _deadline = self._wheel.next_deadline()
+        if( _deadline is None ):
+            return None
+        return min( _deadline, now + min(self._min_timeout, self._first_timeout) )
+
+
+    def stats(self):
+        with self._lock:
+            return { 'devices': len(self._devices), 'silent': len(self._silent),
+                     'scheduled': len(self._wheel) }
+
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Physically impossible readings filter
+#
+# Decoded values are checked against the range limits of their type ('min' /
+# 'max' of TYPE entries). Optionally (statistical=True), they're also checked
+# against rolling statistics of their (device, channel): EWMA mean and
+# variance, a sample further than <threshold> standard deviations is an
+# outlier. Both tests are O(1) per sample.
+#
+# Notes:
+#   only types with range limits are checked (i.e physical quantities).
+#   the standard deviation is floored to <min_spread> x type's range (and to
+#   its resolution 'pas'): sensors report quantized, steady values, a real
+#   step (e.g heating turned on) must not be taken for an outlier.
+#   after <max_rejects> consecutive outliers, the signal is considered to have
+#   moved (e.g sensor relocated): statistics restart from this sample.
+#   check() is only called from the mqtt_loop's thread (single writer), stats()
+#   only reads counters.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class OutlierFilter(object):
+
+    # class attributes ( __class__.<attr_name> )
+    OUT_OF_RANGE    = 'out_of_range'
+    OUTLIER         = 'outlier'
+
+    # objects attributes
+    _statistical    = False     # range check only
+    _threshold      = 6.0       # standard deviations
+    _min_spread     = 0.01      # standard deviation floor, fraction of type's range
+    _alpha          = 0.05      # EWMA smoothing factor
+    _warmup         = 10        # samples before the statistical test applies
+    _max_rejects    = 5         # consecutive outliers before statistics restart
+    _max_channels   = 65536
+
+
+    #
+    # object initialization
+    def __init__(self, types, statistical=False, threshold=6.0, min_spread=0.01, alpha=0.05, warmup=10,
+                 max_rejects=5, max_channels=65536, *args, **kwargs ):
+        self._statistical   = statistical is True
+        self._threshold2    = float(threshold) ** 2
+        self._min_spread    = float(min_spread)
+        self._alpha         = float(alpha)
+        self._warmup        = int(warmup)
+        self._max_rejects   = int(max_rejects)
+        self._max_channels  = int(max_channels)
+        # { type ID: ( min, max, squared standard deviation floor ) }
+        self._limits        = { _type['ID']: ( _type.get('min', float('-inf')), _type.get('max', float('inf')),
+                                               self._floor(_type) ** 2 )
+                                    for _type in types if 'min' in _type or 'max' in _type }
+        self._channels      = dict()    # { (device, channel): [ samples, mean, variance, rejects ] }
+        self._checked       = 0
+        self._rejected      = { self.OUT_OF_RANGE: 0, self.OUTLIER: 0 }
+        log.debug("outlier filter limits: " + str(self._limits))
+
+
+    ''' None if sample is valid, reason of rejection otherwise '''
+    def check(self, device, channel, type_id, value):
+        _limits = self._limits.get(type_id)
+        if( _limits is None ):
+            return None
+        self._checked += 1
+
+        if( value < _limits[0] or value > _limits[1] ):
+            self._rejected[self.OUT_OF_RANGE] += 1
+            return self.OUT_OF_RANGE
+        if( not self._statistical ):
+            return None
+
+        _key = ( device, channel )
+        _state = self._channels.get(_key)
+        if( _state is None ):
+            if( len(self._channels) < self._max_channels ):
+                self._channels[_key] = [ 1, value, 0.0, 0 ]
+            return None
+
+        _samples, _mean, _variance, _rejects = _state
+        _delta = value - _mean
+        if( _samples >= self._warmup and
+            _delta * _delta > self._threshold2 * max(_variance, _limits[2]) ):
+            if( _rejects < self._max_rejects ):
+                _state[3] = _rejects + 1
+                self._rejected[self.OUTLIER] += 1
+                return self.OUTLIER
+            # level shift
+            log.debug("[%s] channel %s: %d consecutive outliers ... statistics restarted" % (str(device),str(channel),_rejects))
+            _state[:] = [ 1, value, 0.0, 0 ]
+            return None
+
+        # running mean / variance while warming up, EWMA afterwards
+        _alpha = self._alpha if _samples >= self._warmup else 1.0 / (_samples + 1)
+        _state[0] = _samples + 1
+        _state[1] = _mean + _alpha * _delta
+        _state[2] = (1.0 - _alpha) * (_variance + _alpha * _delta * _delta)
+        _state[3] = 0
+        return None
+
+
+    ''' rejected samples count of a reason '''
+    def rejected(self, reason):
+        return self._rejected[reason]
+
+
+    def stats(self):
+        return dict( self._rejected, checked=self._checked, channels=len(self._channels) )
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _floor(self, type_):
+        _floor = float(type_.get('pas', 1))
+        _range = type_.get('max', float('inf')) - type_.get('min', float('-inf'))
+        if( _range != float('inf') ):
+            _floor = max( _floor, self._min_spread * _range )
+        return _floor
+
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Malformed frames quarantine
+#
+# Frames we're unable to fully decode are kept aside, along with the decoding
+# error, then flushed in batches either to a MQTT topic or to a JSON-lines file
+# (or both) for further analysis. Per-device error counters are maintained.
+#
+# Notes:
+#   add() is called from the mqtt_loop's thread while flush() is called from
+#   the main loop, hence the lock. A full batch is not written by add(): the
+#   main loop gets notified (e.g scheduler.trigger()) and flushes it.
+#   per-device counters are bounded: least recently failing devices get
+#   evicted beyond max_devices.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+import json
+from threading import Lock
+from collections import OrderedDict
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class QuarantineModule(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _publish        = None      # callable( topic, payload ) to send a batch
+    _topic          = None      # quarantine topic
+    _path           = None      # quarantine JSON-lines file
+    _batch_size     = 50        # flush whenever this number of frames is reached
+    _max_pending    = 1000      # drop oldest frames beyond this number
+    _max_devices    = 10000     # devices with error counters
+
+
+    #
+    # object initialization
+    def __init__(self, publish=None, topic=None, path=None, batch_size=50, max_pending=1000,
+                 max_devices=10000, notify=None, *args, **kwargs ):
+        self._publish       = publish
+        self._topic         = topic
+        self._path          = path
+        self._batch_size    = max(1, int(batch_size))
+        self._max_pending   = max(self._batch_size, int(max_pending))
+        self._max_devices   = max(1, int(max_devices))
+        self._notify        = notify    # called (mqtt_loop's thread) when a batch is full
+
+        self._lock          = Lock()
+        self._pending       = list()
+        self._errors        = OrderedDict()     # { device: { reason: count } }, LRU order
+        self._dropped       = 0
+        self._evicted       = 0         # devices whose counters got evicted
+
+        if( self._topic is None and self._path is None ):
+            log.warning("no quarantine topic nor file ... malformed frames will only get counted")
+
+
+    ''' record a malformed frame '''
+    def add(self, device, topic, raw, error):
+        _entry = { 'time': time.time(), 'device': device, 'topic': topic,
+                   'raw': raw, 'error': error.as_dict() }
+        with self._lock:
+            _counters = self._errors.get(device)
+            if( _counters is None ):
+                _counters = self._errors[device] = dict()
+                if( len(self._errors) > self._max_devices ):
+                    self._errors.popitem(last=False)
+                    self._evicted += 1
+            else:
+                self._errors.move_to_end(device)
+            _counters[error.reason] = _counters.get(error.reason, 0) + 1
+
+            self._pending.append( _entry )
+            if( len(self._pending) > self._max_pending ):
+                self._dropped += len(self._pending) - self._max_pending
+                del self._pending[:len(self._pending) - self._max_pending]
+            _full = len(self._pending) == self._batch_size
+
+        log.debug("[%s] frame quarantined: %s" % (str(device),str(error)) )
+        if( _full and self._notify is not None ):
+            self._notify()
+
+
+    ''' send all pending frames as a single batch '''
+    def flush(self):
+        with self._lock:
+            if( not len(self._pending) ):
+                return 0
+            _batch = self._pending
+            self._pending = list()
+
+        if( self._path is not None ):
+            try:
+                with open(self._path, 'a') as f:
+                    for _entry in _batch:
+                        f.write( json.dumps(_entry) + '\n' )
+            except Exception as ex:
+                log.error("unable to write quarantine file '%s': " % str(self._path) + str(ex))
+
+        if( self._topic is not None and self._publish is not None ):
+            try:
+                self._publish( self._topic, json.dumps(_batch) )
+            except Exception as ex:
+                log.error("unable to publish quarantine batch: " + str(ex))
+
+        log.info("%d malformed frame(s) flushed to quarantine" % len(_batch))
+        return len(_batch)
+
+
+    ''' per-device error counters '''
+    def counters(self):
+        with self._lock:
+            return { device: dict(reasons) for device, reasons in self._errors.items() }
+
+
+    ''' number of frames dropped because of a too slow flush '''
+    def dropped(self):
+        return self._dropped
+
+
+    ''' number of devices whose counters got evicted (max_devices) '''
+    def evicted(self):
+        return self._evicted
+
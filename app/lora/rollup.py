@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Streaming rollups: min / max / mean / count per (device, channel) and window
+#
+# Decoded measurements feed tumbling windows (e.g 1 minute) aligned on epoch,
+# according to their acquisition time. Accumulators are updated in O(1) per
+# sample; windows get closed (i.e returned for publishing) once the late
+# arrival tolerance has elapsed after their end.
+#
+# Notes:
+#   open windows are grouped by start time: closing a window is a single dict
+#   pop, and (device, channel) without any open window cost nothing.
+#   samples for an already closed window are dropped (counted as late), so
+#   are samples more than a window ahead of now (counted as future, e.g
+#   device's clock): open windows are thus bounded in number and memory is
+#   bounded by max_channels accumulators per open window.
+#   update() is called from the mqtt_loop's thread while close() is called
+#   from the main loop, hence the lock.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Class
+#
+class RollupWindow(object):
+    ''' accumulator of a (device, channel) over a window '''
+
+    __slots__ = ( 'unit', 'count', 'total', 'min', 'max' )
+
+    def __init__(self, unit, value ):
+        self.unit   = unit
+        self.count  = 1
+        self.total  = value
+        self.min    = value
+        self.max    = value
+
+
+class RollupAggregator(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _window         = 60        # seconds
+    _lateness       = 10        # seconds a window stays open after its end
+    _max_channels   = 65536     # accumulators per window
+
+
+    #
+    # object initialization
+    def __init__(self, window=60, lateness=10, max_channels=65536, *args, **kwargs ):
+        self._window        = int(window)
+        self._lateness      = float(lateness)
+        self._max_channels  = int(max_channels)
+        if( self._window <= 0 ):
+            raise ValueError("rollup window must be positive")
+        self._lock          = Lock()
+        self._open          = dict()    # { window start: { (device, channel): RollupWindow } }
+        self._watermark     = self._start( time.time() - self._lateness ) - self._window    # older windows are closed
+        self._samples       = 0
+        self._late          = 0
+        self._future        = 0
+        self._dropped       = 0
+        self._closed        = 0
+
+
+    @property
+    def window(self):
+        return self._window
+
+
+    ''' add a sample (timestamp: acquisition time), False if dropped '''
+    def update(self, device, channel, unit, value, timestamp, now=None):
+        if( now is None ):
+            now = time.time()
+        _start = self._start(timestamp)
+        with self._lock:
+            if( _start <= self._watermark ):
+                self._late += 1
+                return False
+            if( timestamp > now + self._window ):
+                self._future += 1
+                if( self._future == 1 or not self._future % 1000 ):
+                    log.warning("rollup %ds: sample of '%s' %.0fs ahead, %d such sample(s) dropped so far" % (self._window,str(device),timestamp - now,self._future))
+                return False
+            _accumulators = self._open.get(_start)
+            if( _accumulators is None ):
+                _accumulators = self._open[_start] = dict()
+            _key = ( device, channel )
+            _acc = _accumulators.get(_key)
+            if( _acc is None ):
+                if( len(_accumulators) >= self._max_channels ):
+                    self._dropped += 1
+                    return False
+                _accumulators[_key] = RollupWindow( unit, value )
+            else:
+                _acc.count += 1
+                _acc.total += value
+                if( value < _acc.min ):
+                    _acc.min = value
+                elif( value > _acc.max ):
+                    _acc.max = value
+            self._samples += 1
+        return True
+
+
+    ''' windows whose tolerance elapsed (all of them if force):
+        [ ( start, device, channel, RollupWindow ) ] '''
+    def close(self, now=None, force=False):
+        if( now is None ):
+            now = time.time()
+        _closed = list()
+        with self._lock:
+            # start of the most recent window to close
+            _limit = self._start( now - self._lateness ) - self._window
+            for _start in sorted(self._open):
+                if( not force and _start > _limit ):
+                    break
+                for ( _device, _channel ), _acc in self._open.pop(_start).items():
+                    _closed.append( ( _start, _device, _channel, _acc ) )
+            self._watermark = max( self._watermark, _limit )
+            self._closed += len(_closed)
+        return _closed
+
+
+    ''' time of next window closing '''
+    def next_close(self, now=None):
+        if( now is None ):
+            now = time.time()
+        return self._start( now - self._lateness ) + self._window + self._lateness
+
+
+    def stats(self):
+        with self._lock:
+            return { 'window': self._window, 'open': sum( len(_acc) for _acc in self._open.values() ),
+                     'samples': self._samples, 'closed': self._closed,
+                     'late': self._late, 'future': self._future, 'dropped': self._dropped }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _start(self, timestamp):
+        return int(timestamp // self._window) * self._window
+
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# JSON snapshots shared between the decoder and the web app.
+#
+# The decoder periodically dumps some of its in-memory state (e.g frame
+# counters) to a JSON file, atomically replaced; the web app (i.e uwsgi
+# workers, other processes) reads it, parsing it again only when it changed.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import json
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#
+# Function to atomically write a snapshot
+def write_snapshot(path, data):
+    _tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs( os.path.dirname(path) or '.', exist_ok=True )
+        with open(_tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(_tmp, path)
+    except Exception as ex:
+        log.error("unable to write snapshot '%s': " % str(path) + str(ex))
+        return False
+    return True
+
+
+
+# #############################################################################
+#
+# Class
+#
+class SnapshotReader(object):
+
+    #
+    # object initialization
+    def __init__(self, path, *args, **kwargs ):
+        self._path  = path
+        self._lock  = Lock()
+        self._mtime = None
+        self._data  = None
+
+
+    ''' latest snapshot or None if not available '''
+    def read(self):
+        try:
+            _mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if( _mtime != self._mtime ):
+                try:
+                    with open(self._path) as f:
+                        self._data = json.load(f)
+                    self._mtime = _mtime
+                except Exception as ex:
+                    log.error("unable to read snapshot '%s': " % str(self._path) + str(ex))
+            return self._data
+
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Gateway / network-server timestamps extraction
+#
+# LoRaWAN frames are timestamped by the network server (e.g 'datetime' field
+# of lorawan-server): this is the acquisition time of measurements. It gets
+# normalized to an UTC epoch (float seconds) and sent along every measurement.
+#
+# Notes:
+#   accepted formats are ISO-8601 (e.g 2020-11-23T14:05:12.52Z, +01:00 offset,
+#   no offset means UTC) and epoch in seconds or milliseconds (number or str).
+#   ISO-8601 strings go through datetime.fromisoformat (C implementation):
+#   faster than any per-second cache in front of it.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+from datetime import datetime, timezone
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_EPOCH_MS_THRESHOLD = 1e11      # epoch beyond this value are milliseconds
+
+
+
+# #############################################################################
+#
+# Class
+#
+class TimestampParser(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _keys           = None      # payload's keys that may hold a timestamp
+
+
+    #
+    # object initialization
+    def __init__(self, keys, *args, **kwargs ):
+        self._keys      = list(keys)
+
+
+    ''' UTC epoch of a payload or None '''
+    def extract(self, payload):
+        for _key in self._keys:
+            _value = payload.get(_key)
+            if( _value is None ):
+                continue
+            _ts = self.parse(_value)
+            if( _ts is not None ):
+                return _ts
+        return None
+
+
+    ''' UTC epoch from an ISO-8601 string or an epoch, None if invalid '''
+    def parse(self, value):
+        try:
+            if( isinstance(value, str) and len(value) >= 19 and value[4] == '-' ):
+                if( value[-1] in 'Zz' ):
+                    value = value[:-1] + '+00:00'
+                _dt = datetime.fromisoformat( value )
+                # no offset means UTC
+                return ( _dt if _dt.tzinfo is not None else _dt.replace( tzinfo=timezone.utc ) ).timestamp()
+            value = float(value)
+        except (TypeError, ValueError) as ex:
+            log.debug("invalid timestamp '%s': " % str(value) + str(ex))
+            return None
+        if( value != value or value <= 0 ):
+            return None
+        if( value > _EPOCH_MS_THRESHOLD ):
+            value /= 1000.0
+        return value
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Raw uplinks archive: compressed, time-segmented, with a sidecar index
+#
+# Every raw uplink (receive time, topic, device, envelope) is appended as a
+# JSON line to the segment file of its time slot (e.g one per hour). Lines are
+# compressed by blocks (zlib), each block gets a fixed-size entry in the
+# segment's sidecar index: offset, length, count, first / last receive time
+# and a 64 bits mask of the devices it holds.
+# Range reads ("frames of device X between T1 and T2") memory-map the index,
+# binary search the first block, skip blocks without device X and decompress
+# only the remaining ones, sliced from the memory-mapped segment.
+#
+# Notes:
+#   files: <start epoch>.blocks (data) and <start epoch>.idx (index).
+#   a block is indexed once written: a block without index entry (crash) is
+#   truncated when the segment is opened again.
+#   receive times are increasing within a segment (i.e blocks are sorted).
+#   append() is called from the mqtt_loop's thread while flush() is called
+#   from the main loop, hence the lock.
+#   once closed, uplinks appended are dropped (counted, logged once).
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import mmap
+import json
+import time
+import zlib
+import struct
+from threading import Lock
+
+# --- project related imports
+from logger.logger import log
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+_ENTRY          = struct.Struct('<QIIddQ')  # offset, length, count, first, last, devices mask
+_DATA_SUFFIX    = '.blocks'
+_INDEX_SUFFIX   = '.idx'
+
+
+
+# #############################################################################
+#
+# Class
+#
+class ArchiveWriter(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _segment        = 3600          # seconds per segment file
+    _block_size     = 64*1024       # uncompressed bytes per block
+    _retention      = 0             # days, 0 means forever
+
+
+    #
+    # object initialization
+    def __init__(self, directory, segment=3600, block_size=64*1024, retention=0, *args, **kwargs ):
+        self._dir           = directory
+        self._segment       = int(segment)
+        self._block_size    = int(block_size)
+        self._retention     = float(retention)
+        self._lock          = Lock()
+        self._start         = None      # current segment
+        self._data          = None
+        self._index         = None
+        self._block         = list()    # JSON lines of current block
+        self._blockSize     = 0
+        self._blockFirst    = None
+        self._blockLast     = None
+        self._blockMask     = 0
+        self._frames        = 0
+        self._bytes         = 0         # compressed bytes written
+        self._closed        = False
+        self._dropped       = 0         # appended once closed
+
+        os.makedirs( self._dir, exist_ok=True )
+
+
+    ''' archive a raw uplink '''
+    def append(self, topic, device, envelope, rxTime=None):
+        if( rxTime is None ):
+            rxTime = time.time()
+        _line = json.dumps( { 't': round(rxTime, 3), 'topic': topic, 'device': device, 'frame': envelope },
+                            separators=(',', ':') ).encode('utf-8') + b'\n'
+        with self._lock:
+            if( self._closed ):
+                self._dropped += 1
+                if( self._dropped == 1 ):
+                    log.warning("archive closed: uplink of '%s' not archived" % str(device))
+                return
+            _start = int(rxTime // self._segment) * self._segment
+            if( _start != self._start ):
+                self._flush()
+                self._open(_start)
+            self._block.append(_line)
+            self._blockSize += len(_line)
+            if( self._blockFirst is None ):
+                self._blockFirst = rxTime
+            self._blockLast = rxTime
+            self._blockMask |= device_mask(device)
+            self._frames += 1
+            if( self._blockSize >= self._block_size ):
+                self._flush()
+
+
+    ''' write current block (e.g periodically, at shutdown) '''
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+
+    def close(self):
+        with self._lock:
+            if( self._closed ):
+                return
+            self._flush()
+            self._close()
+            self._closed = True
+
+
+    def stats(self):
+        with self._lock:
+            return { 'frames': self._frames, 'bytes': self._bytes, 'segment': self._start,
+                     'dropped': self._dropped }
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _open(self, start):
+        self._close()
+        self._start = start
+        _data = os.path.join( self._dir, str(start) + _DATA_SUFFIX )
+        _index = os.path.join( self._dir, str(start) + _INDEX_SUFFIX )
+
+        # existing segment (restart): data beyond last indexed block dropped
+        _end = 0
+        if( os.path.exists(_index) ):
+            _size = os.path.getsize(_index) // _ENTRY.size * _ENTRY.size
+            os.truncate( _index, _size )
+            if( _size ):
+                with open(_index, 'rb') as f:
+                    f.seek( _size - _ENTRY.size )
+                    _offset, _length = _ENTRY.unpack( f.read(_ENTRY.size) )[:2]
+                _end = _offset + _length
+        if( os.path.exists(_data) and os.path.getsize(_data) != _end ):
+            log.warning("archive segment %d: %d bytes of unindexed block truncated" % (start,os.path.getsize(_data) - _end))
+            os.truncate( _data, _end )
+        self._data = open(_data, 'ab')
+        self._index = open(_index, 'ab')
+        self._purge()
+
+    def _close(self):
+        if( self._data is not None ):
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def _flush(self):
+        if( not self._block ):
+            return
+        _compressed = zlib.compress( b''.join(self._block) )
+        _offset = self._data.tell()
+        self._data.write(_compressed)
+        self._data.flush()
+        self._index.write( _ENTRY.pack( _offset, len(_compressed), len(self._block),
+                                        self._blockFirst, self._blockLast, self._blockMask ) )
+        self._index.flush()
+        self._bytes += len(_compressed)
+        self._block = list()
+        self._blockSize = 0
+        self._blockFirst = self._blockLast = None
+        self._blockMask = 0
+
+    def _purge(self):
+        # segments older than retention
+        if( not self._retention ):
+            return
+        _limit = time.time() - self._retention * 86400
+        for _start in segments(self._dir):
+            if( _start + self._segment > _limit ):
+                break
+            log.info("archive segment %d removed (retention)" % _start)
+            for _suffix in ( _DATA_SUFFIX, _INDEX_SUFFIX ):
+                try:
+                    os.remove( os.path.join(self._dir, str(_start) + _suffix) )
+                except OSError:
+                    pass
+
+
+class ArchiveReader(object):
+
+    #
+    # object initialization
+    def __init__(self, directory, *args, **kwargs ):
+        self._dir = directory
+
+
+    ''' archived uplinks (dicts t, topic, device, frame) received between
+        start and end (epoch, included), of a device or of all devices '''
+    def frames(self, device=None, start=None, end=None):
+        _mask = device_mask(device) if device is not None else 0
+        _starts = segments(self._dir)
+        for _i, _segment in enumerate(_starts):
+            # segment i holds uplinks received before segment i+1
+            if( end is not None and _segment > end ):
+                break
+            if( start is not None and _i + 1 < len(_starts) and _starts[_i + 1] <= start ):
+                continue
+            yield from self._segment_frames( _segment, device, _mask, start, end )
+
+
+    ''' archived uplinks of a single segment (see segments()), same filters '''
+    def segment_frames(self, segment, device=None, start=None, end=None):
+        _mask = device_mask(device) if device is not None else 0
+        yield from self._segment_frames( segment, device, _mask, start, end )
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _segment_frames(self, segment, device, mask, start, end):
+        _base = os.path.join( self._dir, str(segment) )
+        try:
+            _index = _map( _base + _INDEX_SUFFIX )
+            _data = _map( _base + _DATA_SUFFIX )
+        except OSError as ex:
+            log.warning("archive segment %d not readable: " % segment + str(ex))
+            return
+        try:
+            if( _index is None or _data is None ):
+                return
+            _count = len(_index) // _ENTRY.size
+
+            # first block whose last uplink is not before start
+            _low, _high = 0, _count
+            while( start is not None and _low < _high ):
+                _mid = (_low + _high) // 2
+                if( _ENTRY.unpack_from(_index, _mid * _ENTRY.size)[4] < start ):
+                    _low = _mid + 1
+                else:
+                    _high = _mid
+
+            for _block in range(_low, _count):
+                _offset, _length, _frames, _first, _last, _devices = _ENTRY.unpack_from(_index, _block * _ENTRY.size)
+                if( end is not None and _first > end ):
+                    break
+                if( mask and not _devices & mask ):
+                    continue
+                if( _offset + _length > len(_data) ):
+                    break       # block being written
+                for _line in zlib.decompress( _data[_offset:_offset + _length] ).splitlines():
+                    _frame = json.loads(_line)
+                    if( (device is not None and _frame['device'] != device) or
+                        (start is not None and _frame['t'] < start) or
+                        (end is not None and _frame['t'] > end) ):
+                        continue
+                    yield _frame
+        finally:
+            for _mapped in ( _index, _data ):
+                if( _mapped is not None ):
+                    _mapped.close()
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#
+# Function to get the bit of a device in blocks' devices mask
+def device_mask(device):
+    return 1 << ( zlib.crc32( str(device).encode('utf-8') ) & 63 )
+
+
+#
+# Function to list archive segments (sorted start epochs)
+def segments(directory):
+    try:
+        _names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted( int(_name[:-len(_INDEX_SUFFIX)]) for _name in _names
+                        if _name.endswith(_INDEX_SUFFIX) and _name[:-len(_INDEX_SUFFIX)].isdigit() )
+
+
+#
+# Function to map a file read-only (None if empty)
+def _map(path):
+    with open(path, 'rb') as f:
+        if( not os.fstat(f.fileno()).st_size ):
+            return None
+        return mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+
@@ -20,27 +20,38 @@ import sys
 import signal
 import time
 import json
-from datetime import datetime
 import threading
 
 # Logging
 import logging
 
-# URL parser
-from urllib.parse import quote_plus
-
 # --- project imports
 # logging facility
 from logger.logger import log, setLogLevel, getLogLevel
 
 # MQTT facility
 from comm.mqttConnect import CommModule
+from comm.payloadSerializer import PayloadSerializer
+
+# neOCayenneLPP decoding facility
+from lora.cayenneLPP import TYPE, str_to_int, decode_frame
+from lora.quarantine import QuarantineModule
+from lora.timestamps import TimestampParser
+from lora.latency import LatencyTracker
+from lora.frameCounter import FrameCounterIndex
+# note: optional subsystems (decode cache, deadband, liveness) get imported
+# at startup only if enabled
+from lora.snapshot import write_snapshot
+
+# main loop's periodic tasks
+from scheduler.scheduler import Scheduler
+
+# runtime configuration
+from config.runtimeConfig import RuntimeConfig, ConfigError, LIVE_FIELDS
 
 # settings
 import settings
 
-import paho.mqtt.client as paho
-
 
 # #############################################################################
 #
@@ -50,30 +61,25 @@ import paho.mqtt.client as paho
 
 _condition          = None  # conditional variable used as interruptible timer
 _shutdownEvent      = None  # signall across all threads to send stop event
-_Cursor =  2 #Correspond a l'emplacement dans la payload, on initialise a 2 car les 2 premiers octet de la payload ne sont pas des datas donc la premiere data est a l'emplacement 3 dans la payload 
-
-
-#Dictionnaire des types de data
-TYPE =[
-    {'nom':'analog_input',          'unit':'...',       'ID':1,  'size':1, 'mult':1},
-    {'nom':'analog_output',         'unit':'...',       'ID':2,  'size':1, 'mult':1},
-    {'nom':'digital_input',         'unit':'bool',      'ID':3,  'size':1, 'mult':1},
-    {'nom':'digital_output',        'unit':'bool',      'ID':4,  'size':1, 'mult':1},
-    {'nom':'luminosity',            'unit':'lux',       'ID':5,  'size':2, 'mult':1},
-    {'nom':'presence',              'unit':'bool',      'ID':6,  'size':1, 'mult':1},
-    {'nom':'frequency',             'unit':'pers/j',    'ID':7,  'size':2, 'mult':1},
-    {'nom':'temperature',           'unit':'celcuis',   'ID':8,  'size':1, 'mult':100, 'ref':20, 'pas':0.25},
-    {'nom':'humidity',              'unit':'%r.H',      'ID':9,  'size':1, 'mult':100, 'ref':0, 'pas':0.5},
-    {'nom':'CO2',                   'unit':'ppm',       'ID':10, 'size':2, 'mult':1},
-    {'nom':'air_quality',           'unit':'ppm',       'ID':11, 'size':1, 'mult':1},
-    {'nom':'GPS',                   'unit':'...',       'ID':12, 'size':9, 'mult':1},
-    {'nom':'energy',                'unit':'W/m2',      'ID':13, 'size':3, 'mult':1},
-    {'nom':'UV',                    'unit':'W/m2',      'ID':14, 'size':3, 'mult':1},
-    {'nom':'weight',                'unit':'g',         'ID':15, 'size':3, 'mult':1},
-    {'nom':'pressure',              'unit':'mBar',      'ID':16, 'size':1, 'mult':1, 'ref':990, 'pas':1},
-    {'nom':'generic_sensor_unsi',   'unit':'...',       'ID':17, 'size':4, 'mult':1},
-    {'nom':'generic_sensor_sign',   'unit':'...',       'ID':18, 'size':4, 'mult':1},
-]
+scheduler           = None  # main loop's periodic tasks
+
+config              = None  # runtime configuration (RuntimeConfig)
+
+mqtt_client         = None  # MQTT comm module
+serializer          = None  # output topics and payloads
+quarantine          = None  # malformed frames quarantine
+decodeCache         = None  # decoded frames LRU (None means disabled)
+deadband            = None  # change-only publishing (None means disabled)
+timestamps          = TimestampParser( settings.MQTT_PAYLOAD_TIMESTAMPS )
+latency             = None  # radio --> publish latency tracking
+frameCounters       = None  # per-device frame counters, losses
+liveness            = None  # silent devices detection (None means disabled)
+latestValues        = None  # latest value per (device, channel) shared with the web app
+rollups             = None  # streaming rollups, one aggregator per window (None means disabled)
+outliers            = None  # impossible readings filter (None means disabled)
+calibration         = None  # per-device gain / offset (None means disabled)
+archive             = None  # raw uplinks archive (None means disabled)
+
 
 
 # #############################################################################
@@ -98,142 +104,250 @@ def ctrlc_handler(signum, frame):
         pass
 
 
-#transforme une liste de char en liste de valeur hexa utilisable par le decoder
-def str_to_int(payload):
-    if len(payload)%2 == 1:#Si la liste na pas un nombre d'elements pair alors il y a un pb
-        print("PB payload n'a pas un nombre d'éléments pair dans str_to_hex")
-        return 0
-    else :
-        cursor = 0
-        new_payl = []
-        while cursor < len(payload) :
-            new_payl.append(int("0X"+payload[cursor]+payload[cursor+1],16)) #on regroupe les deux elements de payload 
-            cursor +=2
-        return new_payl
-
-#*** Retourne une liste avec nom, unit, size, mult, ref, pas d'un type de data ***
-def infodata (data_type):
-    #data_type : est un eniter qui correspond au type de la data d'apres la convention neOCayenne 
-
-    print ("datatype :%d" % data_type)
-    for ind in TYPE : #on parcour le dictionnaire TYPE et on regarde si data_type correspond a une ID connu 
-        global _Cursor
-        if ind['ID'] == data_type :
-
-            if 'ref' in ind :
-                info = [ind['nom'],ind['unit'],ind['size'],ind['mult'],ind['ref'],ind['pas']]
-
-            else:
-                info = [ind['nom'],ind['unit'],ind['size'],ind['mult']]
+#
+# Function sighup_handler
+def sighup_handler(signum, frame):
+    ''' reload runtime config from main loop '''
+    if( scheduler is None ):
+        log.warning("SIGHUP received while starting ... ignored")
+        return
+    scheduler.trigger('reload')
 
-            # _Cursor += ind['size'] + 1  #car on a dans la payload type, channel, data 
-            return info 
-    print("Pas bon type de data!!!")
-    return False
 
+#
+# Function to identify the end-device that sent a message
+def device_id(payload):
+    ''' appargs is our unitID, deveui is the fallback '''
+    return payload.get("appargs") or payload.get("deveui")
 
-#*** Transforme les datas de la convention neOCayenne en float
-def transfo_data (info,data):
-    #info : est la liste renvoye par infodata() qui contient nom, unit, size, mult, ref, pas d'un type de data 
-    #data : est la data un tableau qui represente la data sous forme cayenne
-    #DATA : est la data sous forme de float 
 
-    if len(info) == 4 : #Les datas sans références
-        if info[2] == 1: #La data est un binaire sur 1 octet
-            DATA = data[0]
+# #TODO
+# def Senso_campus(UID):
+#     #demande a Senso_campus les info par rappor à un uID
+#     return 0
 
-        elif info[2] == 2: #La data est un entier mis sur 2 octet
-            DATA = float(data[0]+(data[1]<<8)) #LSB + MSB*256   
 
-        elif info[2] == 3: #La data est un float mis sur 3 octet avec la partie entiere sur 2 octet et la partie float sur 1 octet 
-            DATA = data[0]+(data[1]<<8) #LSB + MSB*256 ici partie entiere
-            DATA += data[2]/256
-            DATA = round(DATA,2) #Pour tronquer a 10^-2 
+#Envoie le message avec la data et l'unit de la data dans le bon topic MQTT(Pour le test ça sera TestTopic/Lora/command)
+def PUBLISH(payload, data, timestamp=None):
+    #data : Measurement (value, unit, channel, type_id)
+    #timestamp : UTC epoch of the measurement
 
-        elif info[2] == 4: #La data est un float mis sur 4 octet 
-            DATA = data[0]+(data[1]<<8)+(data[2]<<16)+(data[3]<<24) 
+    uID = device_id(payload)
+    #TODO demander a Senso campus quelles est le site, le batiment et la salle de cet uID
+    topic = serializer.topic(uID) #donner par senso campus
+    publish_payl = serializer.serialize(uID, data, timestamp)
+    mqtt_client.send_message(topic,publish_payl)#publish
 
-    else :
-        if info[0] == "temperature":
-            # print("temp :%d"%data[0])
-            pf = data[0]>>7
 
-            if pf == 1 : #cas eniter negatif
-                data=data[0] - (data[0]>>7)
-                # print("temp :%d"%data)
-                DATA = ((-data) * info[5]*info[3])/info[3] + info[4]
+def ALERT(uID, status, last_seen=None, interval=None):
+    ''' publish a device liveness alert '''
+    alert = { 'unitID': uID, 'status': status, 'timestamp': round(time.time(), 3) }
+    if( last_seen is not None ):
+        alert['last_seen'] = round(last_seen, 3)
+    if( interval is not None ):
+        alert['interval'] = round(interval, 1)
+    mqtt_client.send_message( settings.LIVENESS_ALERT_TOPIC, json.dumps(alert, sort_keys=True) )
 
-            else : #cas entier possitif
-                DATA = (data[0] * info[5]*info[3])/info[3] + info[4]
 
-        else :
-            DATA = (data[0] * info[5]) + info[4]
+def REJECT(uID, measurement, reason, timestamp):
+    ''' publish a sample rejected by the outlier filter '''
+    rejected = { 'unitID': uID, 'channel': measurement.channel, 'value': measurement.value,
+                 'value_units': measurement.unit, 'reason': reason,
+                 'rejected': outliers.rejected(reason), 'timestamp': round(timestamp, 3) }
+    mqtt_client.send_message( settings.OUTLIER_TOPIC, json.dumps(rejected, sort_keys=True) )
 
-    return DATA
 
-#TODO faire des cas si il y a des pb !!!!
+def ROLLUP(window, start, uID, channel, acc, partial=False):
+    ''' publish a closed rollup window '''
+    _label = "%dh" % (window // 3600) if not window % 3600 else "%dm" % (window // 60) if not window % 60 else "%ds" % window
+    rollup = { 'unitID': uID, 'channel': channel, 'value_units': acc.unit,
+               'start': start, 'end': start + window, 'count': acc.count,
+               'min': serializer.round(acc.min), 'max': serializer.round(acc.max),
+               'mean': serializer.round(acc.total / acc.count) }
+    if( partial ):
+        rollup['partial'] = True
+    mqtt_client.send_message( settings.ROLLUP_TOPIC % (_label,uID), json.dumps(rollup, sort_keys=True) )
 
-#*** Retourne un tableau avec la data et l'unite de cette data
-def decoder (PAYLOAD):
-    #PAYLOAD : la payload de data sous forme d'un tableau d'hexadecimal
-    #_Cursor : variable global. emplacement dans la payload du capteur
-    #data : [data, unit]
-    #row_data : tableau contenant la data sous forme neOCayenneLPP
 
-    global _Cursor
-    data = []
-    row_data = []
-    i = 0
+def myMsgHandler(topic, payload):
+    ''' function called whenever our MQTT client receive a LoRaWAN frame.
+        Beware that it's called by mqtt_loop's thread !
+    '''
+    log.debug("MSG topic '%s' received ..." % str(topic) )
+    if 'data' not in payload :
+        return
+
+    uID = device_id(payload)
+
+    # raw uplinks history
+    if( archive is not None ):
+        archive.append( topic, uID, payload )
+
+    if( uID is None ):
+        log.warning("msg from topic '%s' without any device identifier ... dropped" % str(topic))
+        return
+
+    payl= payload["data"] #recupere seulement le champ data du message
+
+    # frame counters: lost uplinks
+    if( frameCounters is not None and payload.get('fcnt') is not None ):
+        try:
+            _lost = frameCounters.update( uID, payload['fcnt'] )
+            if( _lost ):
+                log.debug("[%s] %d frame(s) lost" % (uID,_lost))
+        except (TypeError, ValueError, OverflowError) as ex:
+            log.debug("[%s] invalid fcnt '%s': " % (uID,str(payload['fcnt'])) + str(ex))
+
+    # device is alive
+    if( liveness is not None and liveness.update( uID ) ):
+        log.info("[%s] device is back" % uID)
+        ALERT( uID, 'alive' )
+
+    # acquisition time from network server ... or reception time
+    timestamp = rxTime = timestamps.extract(payload)
+    if( timestamp is None ):
+        timestamp = time.time()
+
+    # same payload as before ? (hex strings only, e.g not a JSON list)
+    _cache = decodeCache if isinstance(payl, str) else None
+    measurements = _cache.get(payl) if _cache is not None else None
+    if( measurements is not None ):
+        error = None
+    else:
+        measurements, error = decode_frame( str_to_int(payl) )
+        if( error is None and _cache is not None ):
+            _cache.put( payl, measurements )
+
+    # calibrated sensors
+    if( calibration is not None ):
+        measurements = calibration.apply( uID, measurements )
+
+    # publish valid measurements ...
+    for data_dec in measurements:
+        log.debug("[%s] value %s %s" % (uID,str(data_dec.value),data_dec.unit))
+        # physically impossible ?
+        if( outliers is not None ):
+            _reason = outliers.check( uID, data_dec.channel, data_dec.type_id, data_dec.value )
+            if( _reason is not None ):
+                log.debug("[%s] value %s %s rejected: %s" % (uID,str(data_dec.value),data_dec.unit,_reason))
+                REJECT( uID, data_dec, _reason, timestamp )
+                continue
+        if( latestValues is not None ):
+            latestValues.update( uID, data_dec.channel, data_dec.value, data_dec.unit, timestamp )
+        if( rollups is not None ):
+            for _rollup in rollups:
+                _rollup.update( uID, data_dec.channel, data_dec.unit, data_dec.value, timestamp )
+        # value did not change enough ?
+        if( deadband is not None and
+            not deadband.should_publish( uID, data_dec.channel, data_dec.unit, data_dec.value ) ):
+            continue
+        PUBLISH(payload,data_dec,timestamp)
+
+    # radio --> publish latency
+    if( rxTime is not None and latency is not None ):
+        latency.record( topic, payload.get(settings.LATENCY_DEVICE_CLASS_KEY), time.time() - rxTime )
+
+    # ... and quarantine what remains
+    if( error is not None ):
+        log.info("[%s] malformed frame from topic '%s': %s" % (uID,str(topic),str(error)) )
+        quarantine.add( uID, topic, payl, error )
 
-    if _Cursor < len(PAYLOAD) :
-        INFO = infodata(PAYLOAD[_Cursor])
-        _Cursor += 2 #+2 car les datas sont sous la forme : type, channel, data donc on ne s'interesse pas a type et channel
-        while i < INFO[2] : # INFO[2] est la taille en octet de la data 
-            row_data.append(PAYLOAD[_Cursor]) 
-            _Cursor += 1
-            i += 1 
 
-        data.append(transfo_data(INFO,row_data))
-        data.append(INFO[1])
 
-    else :
-        print("PB _Cursor en dehors de payload dans decoder")
-        return False
-    
-    return data
+#
+# main loop's periodic tasks
+def log_stats():
+    ''' decode cache and deadband statistics '''
+    if( decodeCache is not None ):
+        log.info("decode cache stats: " + str(decodeCache.stats()))
+    if( deadband is not None ):
+        log.info("deadband stats: " + str(deadband.stats()))
+    for _rollup in rollups or ():
+        log.info("rollup stats: " + str(_rollup.stats()))
+    if( outliers is not None ):
+        log.info("outlier filter stats: " + str(outliers.stats()))
+    if( archive is not None ):
+        log.info("archive stats: " + str(archive.stats()))
+
+
+def snapshot_frames():
+    ''' frame counters snapshot for the web app '''
+    if( frameCounters is not None ):
+        write_snapshot( config.frame_counter_snapshot, frameCounters.snapshot() )
+
+
+def check_liveness():
+    ''' devices gone silent, returns time of next check '''
+    for _uID, _lastSeen, _interval in liveness.expired():
+        log.warning("[%s] device silent since %.0fs" % (_uID,time.time() - _lastSeen))
+        ALERT( _uID, 'silent', _lastSeen, _interval )
+    return liveness.next_check()
+
+
+def load_calibration(force=False):
+    ''' (re)load calibration file if it changed, current table kept if invalid '''
+    global calibration
+    if( not config.calibration_file ):
+        calibration = None
+        return
+    if( calibration is None ):
+        from lora.calibration import CalibrationTable
+        calibration = CalibrationTable()
+        force = True
+    try:
+        calibration.reload( config.calibration_file, force=force )
+    except ValueError as ex:
+        log.error(str(ex) + " ... current calibration kept")
 
 
-# #TODO
-# def Senso_campus(UID):
-#     #demande a Senso_campus les info par rappor à un uID
-#     return 0
+def publish_rollups(force=False):
+    ''' closed rollup windows (open ones too if force), returns time of next closing '''
+    for _rollup in rollups:
+        for _start, _uID, _channel, _acc in _rollup.close( force=force ):
+            ROLLUP( _rollup.window, _start, _uID, _channel, _acc, partial=force )
+    return min( _rollup.next_close() for _rollup in rollups )
 
 
-#Envoie le message avec la data et l'unit de la data dans le bon topic MQTT(Pour le test ça sera TestTopic/Lora/command)
-def PUBLISH(payload, data):
-    #data : [data, unit]
 
-    uID = payload["appargs"] 
-    #TODO demander a Senso campus quelles est le site, le batiment et la salle de cet uID
-    topic ="TestTopic/lora/"+uID+"/command" #donner par senso campus
-    publish_payl = json.dumps({'unitID': uID, 'value': data[0], 'value_units': data[1]}, sort_keys=True)
-    mqtt_client.publish(topic,publish_payl)#publish
+def reload_config():
+    ''' rebuild runtime config (SIGHUP), apply changes that may go live '''
+    global config, decodeCache
+    try:
+        _new = RuntimeConfig.from_env()
+    except ConfigError as ex:
+        log.error("config reload rejected, keeping current config: " + str(ex))
+        return
+    _changes = config.diff(_new)
+    log.info("config reloaded, changes: " + str(_changes))
+
+    # subscriptions of the live connection (dynamic ones left untouched)
+    if( 'mqtt_topics' in _changes ):
+        _removed = [ t for t in config.mqtt_topics if t not in _new.mqtt_topics ]
+        _added = [ t for t in _new.mqtt_topics if t not in config.mqtt_topics ]
+        if( _removed ):
+            mqtt_client.remove_topics( _removed )
+        if( _added ):
+            mqtt_client.add_topics( _added )
+
+    if( 'log_level' in _changes ):
+        setLogLevel( _new.log_level )
+
+    if( 'decode_cache_size' in _changes ):
+        if( not _new.decode_cache_size ):
+            decodeCache = None
+        elif( decodeCache is None ):
+            from lora.decodeCache import DecodeCache
+            decodeCache = DecodeCache( _new.decode_cache_size )
+        else:
+            decodeCache.resize( _new.decode_cache_size )
 
+    _ignored = [ _name for _name in _changes if _name not in LIVE_FIELDS and _name != 'debug' ]
+    if( _ignored ):
+        log.warning("config changes requiring a restart ignored: " + str(_ignored))
+    config = config.merge_live(_new)
 
-def myMsgHandler(topic, payload):
-    time.sleep(1)
-    log.debug("MSG topic '%s' received ..." % str(topic) )
-    if 'data' in payload :
-        payl= payload["data"] #recupere seulement le champ data du message 
-        print(payl)
-        int_payl = str_to_int(payl)
-        print(int_payl)
-        if int_payl[0] == 0x01:
-            while _Cursor < len(int_payl):
-                data_dec=decoder(int_payl)
-                print("Unit :%s"%data_dec[1])
-                print("value final:%f"%data_dec[0])
-                PUBLISH(payload,data_dec)
+    # calibration file read again, even if unchanged
+    load_calibration( force=True )
 
 
 
@@ -244,7 +358,7 @@ def myMsgHandler(topic, payload):
 def main():
 
     # Global variables
-    global _shutdownEvent, _condition, mydb, valueUnits, hints
+    global _shutdownEvent, _condition, scheduler, config, mqtt_client, serializer, quarantine, decodeCache, deadband, latency, frameCounters, liveness, latestValues, rollups, outliers, calibration, archive
 
     # create threading.event
     _shutdownEvent = threading.Event()
@@ -252,50 +366,44 @@ def main():
     # Trap CTRL+C (kill -2)
     signal.signal(signal.SIGINT, ctrlc_handler)
 
+    # Trap SIGHUP (i.e config reload)
+    signal.signal(signal.SIGHUP, sighup_handler)
+
 
     #
-    # MQTT
-    log.info("Instantiate MQTT communications module ...")
+    # runtime configuration
+    try:
+        config = RuntimeConfig.from_env()
+    except ConfigError as ex:
+        log.error("invalid configuration: " + str(ex) + " ... aborting")
+        sys.exit(1)
 
-    params = dict()
-    
-    # shutown master event
-    params['_shutdownEvent'] = _shutdownEvent
+    # defined debug mode ?
+    if( config.debug ):
+        log.info("DEBUG mode activation ...")
+    setLogLevel( config.log_level )
 
-    # credentials
-    _mqtt_user = os.getenv("MQTT_USER", settings.MQTT_USER)
-    if( _mqtt_user is None or not len(_mqtt_user) ):
-        log.error("unspecified MQTT_USER ... aborting")
-        sys.exit(1)
-    params['mqtt_user'] = _mqtt_user
+    # SIMULATION mode ?
+    if( config.sim ):
+        log.info("SIMULATION mode activated ...")
+        settings.SIM = True
 
-    _mqtt_passwd = os.getenv("MQTT_PASSWD", settings.MQTT_PASSWD)
-    if( _mqtt_passwd is None or not len(_mqtt_passwd) ):
-        log.error("unspecified MQTT_PASSWD ... aborting")
-        sys.exit(1)
-    params['mqtt_passwd'] = _mqtt_passwd
 
-    # topics to subscribe and addons
-    try:
-        _mqtt_topics = json.loads(os.getenv("MQTT_TOPICS"))
-    except Exception as ex:
-        # failed to fing env var MQTT_TOPICS ... load from settings
-        _mqtt_topics = settings.MQTT_TOPICS
-    if( _mqtt_topics is None or not len(_mqtt_topics) ):
-        log.error("unspecified or empty MQTT_TOPICS ... aborting")
-        sys.exit(1)
-    params['mqtt_topics'] = _mqtt_topics
+    #
+    # MQTT
+    log.info("Instantiate MQTT communications module ...")
+
+    params = config.comm_params()
 
-    # host'n port parameters
-    params['mqtt_server'] = os.getenv("MQTT_SERVER", settings.MQTT_SERVER)
-    params['mqtt_port'] = os.getenv("MQTT_PORT", settings.MQTT_PORT)
+    # shutown master event
+    params['_shutdownEvent'] = _shutdownEvent
 
-    # unitID
-    params['unitID'] = os.getenv("MQTT_UNITID", settings.MQTT_UNITID)
+    # our own subscription may cover binary encoded output topics
+    params['payload_encodings'] = settings.MQTT_OUTPUT_ENCODINGS
 
-    # TODO: replace with log.debug( ... )
+    # debug ?? (credentials hidden)
     if getLogLevel().lower() == "debug":
-        print(params)
+        log.debug("MQTT params: " + str(dict(params, mqtt_passwd='*****')))
 
     client = None
     try:
@@ -304,7 +412,82 @@ def main():
         
         # register own message handler
         client.handle_message = myMsgHandler
-        client.send_message = PUBLISH
+        mqtt_client = client
+
+        # pre-rendered output topics and payloads
+        serializer = PayloadSerializer( settings.MQTT_OUTPUT_TOPIC,
+                                        precision=settings.MQTT_DATA_PRECISION,
+                                        encodings=settings.MQTT_OUTPUT_ENCODINGS )
+
+        # malformed frames quarantine
+        quarantine = QuarantineModule( publish=client.send_message,
+                                       topic=settings.QUARANTINE_TOPIC,
+                                       path=settings.QUARANTINE_FILE,
+                                       batch_size=settings.QUARANTINE_BATCH_SIZE,
+                                       max_devices=settings.QUARANTINE_MAX_DEVICES,
+                                       notify=lambda: scheduler is not None and scheduler.trigger('quarantine') )
+
+        # decoded frames memoization
+        if( config.decode_cache_size ):
+            from lora.decodeCache import DecodeCache
+            decodeCache = DecodeCache( config.decode_cache_size )
+
+        # change-only publishing
+        if( settings.DEADBAND_ENABLED ):
+            from lora.deadband import DeadbandIndex
+            deadband = DeadbandIndex( deadbands=settings.DEADBANDS,
+                                      heartbeat=settings.DEADBAND_HEARTBEAT,
+                                      max_channels=settings.DEADBAND_MAX_CHANNELS )
+
+        # latency SLO tracking
+        latency = LatencyTracker( settings.LATENCY_SLO_P99, topic_depth=settings.LATENCY_TOPIC_DEPTH )
+        client.register_status( 'latency', latency.status )
+
+        # frame counters (i.e lost uplinks) index
+        frameCounters = FrameCounterIndex()
+
+        # latest values for the web app
+        if( config.latest_index_file ):
+            from lora.latestIndex import LatestValueWriter
+            latestValues = LatestValueWriter( config.latest_index_file, capacity=settings.LATEST_INDEX_CAPACITY )
+
+        # silent devices detection
+        if( settings.LIVENESS_ENABLED ):
+            from lora.liveness import LivenessTracker
+            liveness = LivenessTracker( factor=settings.LIVENESS_FACTOR,
+                                        min_timeout=settings.LIVENESS_MIN_TIMEOUT,
+                                        max_timeout=settings.LIVENESS_MAX_TIMEOUT,
+                                        first_timeout=settings.LIVENESS_FIRST_TIMEOUT,
+                                        resolution=settings.LIVENESS_RESOLUTION )
+
+        # per-device calibration
+        load_calibration()
+
+        # raw uplinks archive
+        if( config.archive_dir ):
+            from lora.uplinkArchive import ArchiveWriter
+            archive = ArchiveWriter( config.archive_dir, segment=settings.ARCHIVE_SEGMENT,
+                                     block_size=settings.ARCHIVE_BLOCK_SIZE,
+                                     retention=settings.ARCHIVE_RETENTION )
+
+        # impossible readings filter
+        if( settings.OUTLIER_FILTER_ENABLED ):
+            from lora.outlierFilter import OutlierFilter
+            outliers = OutlierFilter( TYPE, statistical=settings.OUTLIER_STATISTICAL,
+                                      threshold=settings.OUTLIER_THRESHOLD,
+                                      min_spread=settings.OUTLIER_MIN_SPREAD,
+                                      alpha=settings.OUTLIER_ALPHA,
+                                      warmup=settings.OUTLIER_WARMUP,
+                                      max_rejects=settings.OUTLIER_MAX_REJECTS,
+                                      max_channels=settings.OUTLIER_MAX_CHANNELS )
+            client.register_status( 'outliers', outliers.stats )
+
+        # streaming rollups
+        if( settings.ROLLUP_WINDOWS ):
+            from lora.rollup import RollupAggregator
+            rollups = [ RollupAggregator( _window, lateness=settings.ROLLUP_LATENESS,
+                                          max_channels=settings.ROLLUP_MAX_CHANNELS )
+                            for _window in settings.ROLLUP_WINDOWS ]
 
         # ... then start client :)
         client.start()
@@ -323,28 +506,47 @@ def main():
     # initialise _condition
     _condition = threading.Condition()
 
-    with _condition:
-
-        while( not _shutdownEvent.is_set() ):
-
-            #
-            #
-            # ADD CUSTOM PROCESSING HERE
-            #
-
-            # now sleeping till next event
-            if( _condition.wait( 2.0 ) is False):
-                #log.debug("timeout reached ...")
-                pass
-            else:
-                log.debug("interrupted ... maybe a shutdown ??")
-                time.sleep(1)
-
-    # end of main loop
-    log.info("app. is shutting down ... have a nice day!")
+    # periodic tasks
+    scheduler = Scheduler( _condition, _shutdownEvent )
+    scheduler.every( 'quarantine', settings.QUARANTINE_FLUSH_INTERVAL, quarantine.flush )
+    scheduler.every( 'stats', settings.DECODE_CACHE_STATS_INTERVAL, log_stats )
+    scheduler.every( 'latency', settings.LATENCY_WINDOW, latency.rotate )
+    scheduler.every( 'frames', settings.FRAME_COUNTER_SNAPSHOT_INTERVAL, snapshot_frames )
+    if( liveness is not None ):
+        # checked at next expiry, at least every shortest timeout (new devices)
+        scheduler.every( 'liveness', min(settings.LIVENESS_MIN_TIMEOUT, settings.LIVENESS_FIRST_TIMEOUT), check_liveness )
+    if( rollups is not None ):
+        scheduler.every( 'rollups', min(settings.ROLLUP_WINDOWS), publish_rollups )
+    scheduler.every( 'calibration', settings.CALIBRATION_CHECK_INTERVAL, load_calibration )
+    if( config.spool_dir ):
+        scheduler.every( 'spool', settings.SPOOL_FSYNC_DELAY, client.sync_spool )
+    if( archive is not None ):
+        scheduler.every( 'archive', settings.ARCHIVE_FLUSH_INTERVAL, archive.flush )
+    scheduler.on_demand( 'reload', reload_config )
+
+    # sleeping till next task or shutdown
+    scheduler.run()
+
+    # end of main loop: drain what remains ...
+    log.info("app. is shutting down ...")
     _shutdownEvent.set()
-    time.sleep(4)
-
+    # no more uplinks handled while components get flushed and closed (the
+    # comm module keeps on looping to publish in-flight messages)
+    client.stop_handling()
+    quarantine.flush()
+    snapshot_frames()
+    if( rollups is not None ):
+        # windows still open published as partial ones
+        publish_rollups( force=True )
+    if( archive is not None ):
+        archive.close()
+
+    # ... and in-flight publishes (bounded)
+    client.close()
+    client.join( settings.SHUTDOWN_TIMEOUT )
+    if( client.is_alive() ):
+        log.warning("comm module still running after %ds ... leaving anyway" % settings.SHUTDOWN_TIMEOUT)
+    log.info("... have a nice day!")
 
 
 # Execution or import
@@ -353,19 +555,6 @@ if __name__ == "__main__":
     #
     print("\n###\nneOCampus legacy dataCOllector app.\n###")
 
-    # defined debug mode ?
-    if( os.getenv("DEBUG")=='1' or os.getenv("DEBUG") is True ):
-        log.info("DEBUG mode activation ...")
-        setLogLevel( logging.DEBUG )
-        # print all environment variables
-        print(os.environ)
-
-    # SIMULATION mode ?
-    if( os.getenv("SIM")=='1' or os.getenv("SIM") is True ):
-        log.info("SIMULATION mode activated ...")
-        settings.SIM = True
-        time.sleep(1)
-
     #sys.exit(0)
 
     # Start main app.
@@ -47,6 +47,12 @@ from logger.logger import log, setLogLevel, getLogLevel
 # MQTT facility
 from comm.mqttConnect import CommModule
 
+# batched writes to MongoDB
+from database.mongoBatchWriter import MongoBatchWriter
+
+# main loop's periodic tasks
+from scheduler.scheduler import Scheduler
+
 # settings
 import settings
 
@@ -60,6 +66,7 @@ import settings
 
 # MongoDB related attributes
 mydb        = None
+writer      = None  # batched writes of measures (and failedData)
 valueUnits  = None  # { 'ppm':3, 'lux':4, 'w/m2':5, 'co2':2, ... }
 hints       = None  # { 'u4/campusfab/temperature/auto_92F8/79': [ <idSensor>, <id_piece> ], ... }
 
@@ -105,6 +112,19 @@ def connect_db( user, password, server, port, database ):
     return db
 
 
+#
+# failedData document (legacy shape) of a measure the writer gave up
+def failed_measure( collection, document ):
+    _data = document.get('data') or dict()
+    _payload = _data.get('payload')
+    # uri is <topic>/<subID>
+    _topic = _data.get('uri') or document.get('uri') or ''
+    _suffix = "/" + str(( _payload or dict() ).get('subID'))
+    if( _topic.endswith(_suffix) ):
+        _topic = _topic[:-len(_suffix)]
+    return { 'topic': _topic, 'date': document.get('datemesure'), 'payload': _payload }
+
+
 #
 # Decorator to MshHandler function
 def _myMsgHandler( func ):
@@ -113,6 +133,7 @@ def _myMsgHandler( func ):
     '''
     def _wrapper( *args, **kwargs ):
         kwargs['db'] = mydb
+        kwargs['writer'] = writer
         kwargs['valueUnits'] = valueUnits
         kwargs['hints'] = hints
 
@@ -147,6 +168,7 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
     # ... this way to be sure they are defined ;)
     try:
         mydb = kwargs['db']
+        writer = kwargs['writer']
         valueUnitsIDS = kwargs['valueUnits']
         sensorsIDlist = kwargs['hints']
     except Exception as ex:
@@ -161,11 +183,6 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
     # split tokens from topic
     items = topic.split("/")
 
-    # future id of message
-    # TBC: do we *REALLY* need to do this ??
-    # deprecation warning !
-    idm = mydb.measure.count()
-
     # SIMULATION mode ?
     if( settings.SIM ):
         log.debug("[SIM] read-only mode active: no mod applied")
@@ -182,31 +199,31 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
             if( _idvalUnit is None ):
                 raise Exception("unknown 'value_units':%s from known sensor '%s' ?!?!" % (str(payload.get("value_units")),sensorID))
 
-            # insert
+            # insert (idMesure set by writer)
             # Note: strange uri ?!?!
-            mydb.measure.insert_one( { "building" : items[0] ,"room" : items[1] ,"device" : items[2],
+            writer.insert( { "building" : items[0] ,"room" : items[1] ,"device" : items[2],
                                     "subId" : payload.get("subID"), "uri" : _uri,
-                                    "datemesure": _dataTime, "idMesure" : idm,
+                                    "datemesure": _dataTime,
                                     "idcapteur" : sensorsIDlist[sensorID][0], "idpiece" : sensorsIDlist[sensorID][1],
                                     "mesurevaleur" : [ { "idlibv" : _idvalUnit, "valeur" : float(payload.get("value")) } ],
                                     "data" : { "payload" : payload, "date" : _dataTime.isoformat() , "uri" : _uri }
                                  } )
-            log.debug("[%s] known sensor inserted :)" % sensorID )
+            log.debug("[%s] known sensor buffered :)" % sensorID )
 
         else:
             # UNKNOWN SENSOR
-            mydb.measure.insert_one( { "building" : items[0] ,"room" : items[1] ,"device" : items[2],
+            writer.insert( { "building" : items[0] ,"room" : items[1] ,"device" : items[2],
                                     "subId" : payload.get("subID"), "uri" : _uri,
-                                    "datemesure": _dataTime, "idMesure" : idm,
+                                    "datemesure": _dataTime,
                                     "data" : { "payload" : payload, "date" : _dataTime.isoformat() , "uri" : _uri }
                                  } )
 
-            log.debug("[%s] UNKNOWN sensor inserted" % sensorID )
+            log.debug("[%s] UNKNOWN sensor buffered" % sensorID )
 
     except Exception as ex:
         log.warning("exception detected while inserting measure: " + str(ex) )
         log.info("[exception][%s] add measure to failedData collection for further processing" % sensorID )
-        mydb.failedData.insert_one({'topic': topic , 'date': _dataTime, 'payload': payload})
+        writer.insert_failed({'topic': topic , 'date': _dataTime, 'payload': payload})
 
 
 
@@ -217,7 +234,7 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
 def main():
 
     # Global variables
-    global _shutdownEvent, _condition, mydb, valueUnits, hints
+    global _shutdownEvent, _condition, mydb, writer, valueUnits, hints
 
     # create threading.event
     _shutdownEvent = threading.Event()
@@ -290,9 +307,26 @@ def main():
     print("valueUnits : " + str(valueUnits) )
     print("hints : " + str(hints) )
 
-    log.info("MongoDB connection is UP featuring:\n\t{0:,d} measures :)\n\t{1:,d} unmanaged measures :(".format(mydb.measure.count(),mydb.failedData.count()) )
+    log.info("MongoDB connection is UP featuring:\n\t{0:,d} measures :)\n\t{1:,d} unmanaged measures :(".format(mydb.measure.estimated_document_count(),mydb.failedData.estimated_document_count()) )
     time.sleep(2)
 
+    # initialise _condition
+    _condition = threading.Condition()
+
+    # periodic tasks (started by main loop)
+    scheduler = Scheduler( _condition, _shutdownEvent )
+
+    # batched writes: idMesure from ranges reserved in 'counters' collection
+    # (flush asap once a batch is full)
+    writer = MongoBatchWriter( mydb, batch_size=settings.MONGO_BATCH_SIZE,
+                                flush_interval=settings.MONGO_FLUSH_INTERVAL,
+                                id_block=settings.MONGO_ID_BLOCK,
+                                max_buffer=settings.MONGO_MAX_BUFFER,
+                                max_retries=settings.MONGO_MAX_RETRIES,
+                                retry_delay=settings.MONGO_RETRY_DELAY,
+                                notify=lambda: scheduler.trigger('mongo'),
+                                to_failed=failed_measure )
+
 
     #
     # MQTT
@@ -359,30 +393,26 @@ def main():
     #
     # main loop
 
-    # initialise _condition
-    _condition = threading.Condition()
-
-    with _condition:
+    # measures written to MongoDB by batches
+    scheduler.every( 'mongo', settings.MONGO_FLUSH_INTERVAL, writer.flush )
 
-        while( not _shutdownEvent.is_set() ):
-
-            #
-            #
-            # ADD CUSTOM PROCESSING HERE
-            #
+    #
+    #
+    # ADD CUSTOM PROCESSING HERE (i.e scheduler.every(...))
+    #
 
-            # now sleeping till next event
-            if( _condition.wait( 2.0 ) is False):
-                #log.debug("timeout reached ...")
-                pass
-            else:
-                log.debug("interrupted ... maybe a shutdown ??")
-                time.sleep(1)
+    # sleeping till next task or shutdown
+    scheduler.run()
 
     # end of main loop
-    log.info("app. is shutting down ... have a nice day!")
+    log.info("app. is shutting down ...")
     _shutdownEvent.set()
-    time.sleep(4)
+    client.close()
+    client.join( settings.SHUTDOWN_TIMEOUT )
+    # buffered measures (pending retries included)
+    writer.close()
+    log.info("MongoDB writer: " + str(writer.stats()))
+    log.info("... have a nice day!")
 
 
 
@@ -14,6 +14,10 @@
 #   - either live_collector add a uniq timestamp and send it along the payload and
 #       topic to both msgHandlers at mongoDB and influxDB
 #
+# Each database gets its own queue and worker thread (database/sinkWorker.py):
+#   the mqtt_loop's thread only timestamps and enqueues messages, a slow or
+#   failing database doesn't delay the other one.
+#
 # F.Thiebolt    apr.20  initial release
 #
 
@@ -44,10 +48,14 @@ from logger.logger import log, setLogLevel, getLogLevel
 # Database facility
 from database.influxModule import InfluxModule
 from database.mongoModule import MongoModule
+from database.sinkWorker import SinkWorker
 
 # MQTT facility
 from comm.mqttConnect import CommModule
 
+# main loop's periodic tasks
+from scheduler.scheduler import Scheduler
+
 # settings
 import settings
 
@@ -64,6 +72,7 @@ ARGS                = None
 
 mongoClient         = None  # mongoDB client
 influxClient        = None  # influcDB client
+sinks               = None  # [ SinkWorker ] one per database client
 
 _condition          = None  # conditional variable used as interruptible timer
 _shutdownEvent      = None  # signall across all threads to send stop event
@@ -98,7 +107,7 @@ def _myMsgHandler( func ):
     ''' Handle MQTT messages with additional stuff
     '''
     def _wrapper( *args, **kwargs ):
-        kwargs['targetDB'] = [ mongoClient, influxClient ]
+        kwargs['targetDB'] = sinks
 
         # call to function
         func( *args, **kwargs )
@@ -122,26 +131,15 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
     # force 'no duplicate check' ... because we just generated the timestamp
     kwargs['forceNoDuplicateCheck'] = True
 
-    # call msgHandler from all targets
-    try:
-        res = False
-        for _db in kwargs.get('targetDB'):
-            if( _db is None ): continue
-            try:
-                # call DB specific msgHandler
-                if( _db.msgHandler( topic, payload, *args, **kwargs ) is True ):
-                    res = True
-            except Exception as ex:
-                log.error("hum hum, something went wrong while calling myMsgHandler: " + str(ex) )
-                time.sleep(1.2)
-                continue
-        if( res ):
-            _measureTime = kwargs['timestamp'].replace(microsecond=0,tzinfo=None).isoformat()+'Z'
-            print(f"{_measureTime}  Topic: {topic:>32}  Payload: {payload}" )
-    except Exception as ex:
-        log.error("hum hum, something went wrong: " + str(ex) )
-        time.sleep(1.2)
-        
+    # hand over to all targets' workers (same timestamp, own copy of kwargs)
+    for _sink in kwargs.pop('targetDB'):
+        if( _sink is None ): continue
+        _sink.put( topic, payload, dict(kwargs) )
+
+    if( getLogLevel().lower() == "debug" ):
+        _measureTime = kwargs['timestamp'].replace(microsecond=0,tzinfo=None).isoformat()+'Z'
+        log.debug(f"{_measureTime}  Topic: {topic:>32}  Payload: {payload}" )
+
     return
 
 
@@ -153,7 +151,7 @@ def myMsgHandler( topic, payload, *args, **kwargs ):
 def main():
 
     # Global variables
-    global ARGS, _shutdownEvent, _condition, mongoClient, influxClient
+    global ARGS, _shutdownEvent, _condition, mongoClient, influxClient, sinks
 
     # create threading.event
     _shutdownEvent = threading.Event()
@@ -314,6 +312,21 @@ def main():
         sys.exit(1)
 
 
+    #
+    # databases' workers: own queue and thread per database
+    sinks = list()
+    for _name, _db in ( ('mongodb', mongoClient), ('influxdb', influxClient) ):
+        if( _db is None ): continue
+        _worker = SinkWorker( _name, _db, _shutdownEvent,
+                              max_queue=settings.SINK_MAX_QUEUE,
+                              batch_size=settings.SINK_BATCH_SIZE,
+                              batch_delay=settings.SINK_BATCH_DELAY,
+                              max_retries=settings.SINK_MAX_RETRIES,
+                              retry_delay=settings.SINK_RETRY_DELAY )
+        _worker.start()
+        sinks.append( _worker )
+
+
     #
     # MQTT
     log.info("Instantiate MQTT communications module ...")
@@ -375,6 +388,10 @@ def main():
         # register own message handler
         client.handle_message = myMsgHandler
 
+        # databases' lag, batch size and errors in status report
+        for _worker in sinks:
+            client.register_status( 'sink_' + _worker.name, _worker.stats )
+
         # ... then start client :)
         client.start()
 
@@ -393,34 +410,42 @@ def main():
     # initialise _condition
     _condition = threading.Condition()
 
-    with _condition:
-
-        while( not _shutdownEvent.is_set() ):
-
-            #
-            #
-            # ADD CUSTOM PROCESSING HERE
-            #
-
-            # now sleeping till next event
-            if( _condition.wait( 2.0 ) is False):
-                #log.debug("timeout reached ...")
-                pass
-            else:
-                log.debug("interrupted ... maybe a shutdown ??")
-                time.sleep(1)
+    # periodic tasks
+    scheduler = Scheduler( _condition, _shutdownEvent )
+
+    # processing still on way ?
+    def _watchdog():
+        if( client.is_alive() is not True ):
+            scheduler.stop()
+        for _worker in sinks:
+            if( _worker.is_alive() is not True ):
+                log.error("[%s] sink worker died ?!?! ... stopping" % _worker.name)
+                scheduler.stop()
+    scheduler.every( 'watchdog', 2.0, _watchdog )
+
+    # databases' workers stats
+    def _sinks_stats():
+        for _worker in sinks:
+            log.info("[%s] sink: " % _worker.name + str(_worker.stats()))
+    scheduler.every( 'sinks', settings.SINK_STATS_INTERVAL, _sinks_stats )
 
-            # processing still on way ?
-            if( client.is_alive() is not True ):
-                break
-
-            log.debug("\t[PROCESSING STILL ON WAY] ...")
+    #
+    #
+    # ADD CUSTOM PROCESSING HERE (i.e scheduler.every(...))
+    #
 
+    # sleeping till next task or shutdown
+    scheduler.run()
 
     # end of main loop
-    log.info("app. is shutting down ... have a nice day!")
+    log.info("app. is shutting down ...")
     _shutdownEvent.set()
-    time.sleep(4)
+    client.close()
+    client.join( settings.SHUTDOWN_TIMEOUT )
+    # queued messages
+    for _worker in sinks:
+        _worker.close( settings.SHUTDOWN_TIMEOUT )
+    log.info("... have a nice day!")
 
     # delete objects
     del client
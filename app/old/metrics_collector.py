@@ -43,6 +43,9 @@ from database.influxModule import InfluxModule
 # MQTT facility
 from comm.mqttConnect import CommModule
 
+# main loop's periodic tasks
+from scheduler.scheduler import Scheduler
+
 # settings
 import settings
 
@@ -240,37 +243,29 @@ def main():
     # initialise _condition
     _condition = threading.Condition()
 
-    with _condition:
-
-        while( not _shutdownEvent.is_set() ):
-
-            #
-            #
-            # ADD CUSTOM PROCESSING HERE
-            #
-
-            # now sleeping till next event
-            if( _condition.wait( 2.0 ) is False):
-                #log.debug("timeout reached ...")
-                pass
-            else:
-                log.debug("interrupted ... maybe a shutdown ??")
-                time.sleep(1)
+    # periodic tasks
+    scheduler = Scheduler( _condition, _shutdownEvent )
 
-            # processing still on way ?
-            if( client.is_alive() is not True ):
-                break
+    # processing still on way ?
+    def _watchdog():
+        if( client.is_alive() is not True ):
+            scheduler.stop()
+    scheduler.every( 'watchdog', 2.0, _watchdog )
 
-            # ask for periodic status of task
-            
-
-            #log.debug("\t[PROCESSING STILL ON WAY] ...")
+    #
+    #
+    # ADD CUSTOM PROCESSING HERE (i.e scheduler.every(...))
+    #
 
+    # sleeping till next task or shutdown
+    scheduler.run()
 
     # end of main loop
-    log.info("app. is shutting down ... have a nice day!")
+    log.info("app. is shutting down ...")
     _shutdownEvent.set()
-    time.sleep(4)
+    client.close()
+    client.join( settings.SHUTDOWN_TIMEOUT )
+    log.info("... have a nice day!")
 
     # delete objects
     del client
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# loradecoder reprocessing app.
+#
+# Decodes again the raw uplinks of the archive (see lora/uplinkArchive.py),
+# e.g after a decoding fix, with a chosen version of the TYPE table and writes
+# the measurements to a sink (JSON lines file).
+#
+# Notes:
+#   history is split in partitions (archive segment, device if any selected)
+#   decoded by a pool of processes.
+#   the checkpoint file records completed partitions: an interrupted run
+#   started again with the same parameters resumes where it stopped.
+#   measurements of a partition are written (and synced) before the partition
+#   gets checkpointed: a partition interrupted in between is decoded again
+#   (i.e duplicates in the sink, never holes).
+#   sink order is the partitions' completion order.
+#   TYPE table and calibration file are checked before any worker starts; a
+#   partition whose decoding fails (e.g worker crash) is reported and left
+#   out of the checkpoint: run again to retry.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import sys
+import time
+import json
+import signal
+import argparse
+from datetime import datetime, timezone
+from numbers import Real
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Logging
+import logging
+
+# --- project imports
+# logging facility
+from logger.logger import log, setLogLevel
+
+# neOCayenneLPP decoding facility
+from lora.cayenneLPP import TYPE_VERSION, TYPE_VERSIONS, info_table, str_to_int, decode_frame
+from lora.calibration import CalibrationTable
+from lora.timestamps import TimestampParser
+from lora.uplinkArchive import ArchiveReader, segments
+from lora.snapshot import write_snapshot
+
+# settings
+import settings
+
+
+# #############################################################################
+#
+# Global variables
+# (scope: this file)
+#
+
+ARGS                = None  # command line arguments
+_interrupted        = False # CTRL+C: stop once running partitions are done
+
+# worker processes' state (see _init_worker())
+_types              = None
+_calibration        = None
+_timestamps         = None
+
+
+
+# #############################################################################
+#
+# Class
+#
+class JsonLinesSink(object):
+    ''' measurements appended to a JSON lines file '''
+
+    #
+    # object initialization
+    def __init__(self, path, *args, **kwargs ):
+        self._file = open(path, 'a')
+
+
+    def write(self, records):
+        for _record in records:
+            self._file.write( json.dumps(_record, sort_keys=True) + '\n' )
+
+
+    ''' records written so far are on disk '''
+    def sync(self):
+        self._file.flush()
+        os.fsync( self._file.fileno() )
+
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#
+# Function ctrlc_handler
+def ctrlc_handler(signum, frame):
+    global _interrupted
+    print("<CTRL + C> action detected ... waiting for running partitions")
+    _interrupted = True
+
+
+#
+# Function to load a TYPE table: version number or JSON file (TYPE-like list)
+def load_types(spec):
+    if( str(spec).isdigit() ):
+        _types = TYPE_VERSIONS.get(int(spec))
+        if( _types is None ):
+            raise ValueError("unknown TYPE version %s (known: %s)" % (spec,str(sorted(TYPE_VERSIONS))))
+        return _types
+    with open(spec) as f:
+        _types = json.load(f)
+    if( not isinstance(_types, list) or not all( isinstance(_t, dict) for _t in _types ) ):
+        raise ValueError("'%s' is not a TYPE table (list of types)" % spec)
+    check_types(_types)
+    return _types
+
+
+#
+# Function to check fields of a TYPE table needed by decoding (see info_table())
+def check_types(types):
+    _ids = set()
+    for _index, _t in enumerate(types):
+        _name = "type #%d (ID %s)" % (_index, str(_t.get('ID')))
+        for _field in ( 'ID', 'nom', 'unit', 'size', 'mult' ):
+            if( _field not in _t ):
+                raise ValueError("%s: missing '%s'" % (_name,_field))
+        if( not _is_int(_t['ID']) or not 0 <= _t['ID'] <= 255 ):
+            raise ValueError("%s: 'ID' must be an integer in [0, 255]" % _name)
+        if( _t['ID'] in _ids ):
+            raise ValueError("%s: duplicate 'ID'" % _name)
+        _ids.add(_t['ID'])
+        for _field in ( 'nom', 'unit' ):
+            if( not isinstance(_t[_field], str) ):
+                raise ValueError("%s: '%s' must be a string" % (_name,_field))
+        if( not _is_int(_t['size']) or _t['size'] < 1 ):
+            raise ValueError("%s: 'size' must be a positive integer" % _name)
+        if( not _is_number(_t['mult']) or _t['mult'] == 0 ):
+            raise ValueError("%s: 'mult' must be a non-zero number" % _name)
+        if( ('ref' in _t) != ('pas' in _t) ):
+            raise ValueError("%s: 'ref' and 'pas' go together" % _name)
+        if( 'ref' in _t and not (_is_number(_t['ref']) and _is_number(_t['pas'])) ):
+            raise ValueError("%s: 'ref' and 'pas' must be numbers" % _name)
+    return types
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_number(value):
+    return isinstance(value, Real) and not isinstance(value, bool) and value == value
+
+
+#
+# Function to get an epoch from command line (epoch or ISO-8601, UTC if naive)
+def epoch(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        _dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s': epoch or ISO-8601 date expected" % value)
+    if( _dt.tzinfo is None ):
+        _dt = _dt.replace(tzinfo=timezone.utc)
+    return _dt.timestamp()
+
+
+#
+# Function to split history in partitions: [ ( key, segment, start, end, device ) ]
+def partitions(archive_dir, start=None, end=None, devices=None):
+    _res = list()
+    _starts = segments(archive_dir)
+    for _i, _segment in enumerate(_starts):
+        # segment i holds uplinks received before segment i+1
+        _next = _starts[_i + 1] if _i + 1 < len(_starts) else None
+        if( (end is not None and _segment > end) or (start is not None and _next is not None and _next <= start) ):
+            continue
+        for _device in (devices or [ None ]):
+            _key = str(_segment) if _device is None else "%d/%s" % (_segment,_device)
+            _res.append( ( _key, _segment, start, end, _device ) )
+    return _res
+
+
+#
+# worker process initialization
+def _init_worker(types_spec, calibration_file):
+    global _types, _calibration, _timestamps
+    # CTRL+C handled by main process only
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _types = info_table( load_types(types_spec) )
+    _calibration = CalibrationTable( calibration_file )
+    if( calibration_file ):
+        _calibration.reload()
+    _timestamps = TimestampParser( settings.MQTT_PAYLOAD_TIMESTAMPS )
+
+
+#
+# worker process: decode a partition, returns ( key, records, stats )
+def _reprocess(archive_dir, partition, types_version):
+    _key, _segment, _start, _end, _device = partition
+    _records = list()
+    _stats = { 'frames': 0, 'measurements': 0, 'errors': 0 }
+    for _uplink in ArchiveReader(archive_dir).segment_frames( _segment, _device, _start, _end ):
+        _frame = _uplink['frame']
+        _uID = _uplink['device']
+        if( _uID is None or not isinstance(_frame, dict) or 'data' not in _frame ):
+            continue
+        _stats['frames'] += 1
+        _measurements, _error = decode_frame( str_to_int(_frame['data']), _types )
+        if( _error is not None ):
+            _stats['errors'] += 1
+        _timestamp = _timestamps.extract(_frame) or _uplink['t']
+        for _m in _calibration.apply( _uID, _measurements ):
+            _records.append( { 'unitID': _uID, 'channel': _m.channel, 'value': _m.value,
+                               'value_units': _m.unit, 'timestamp': round(_timestamp, 3),
+                               'topic': _uplink['topic'], 'type_version': types_version } )
+        _stats['measurements'] += len(_measurements)
+    return _key, _records, _stats
+
+
+
+# #############################################################################
+#
+# MAIN
+#
+def main():
+
+    # Trap CTRL+C (kill -2)
+    signal.signal(signal.SIGINT, ctrlc_handler)
+
+    # workers would fail (i.e broken pool) on an invalid table or calibration
+    try:
+        check_types( load_types( ARGS.types ) )
+    except (OSError, ValueError) as ex:
+        log.error("invalid TYPE table: " + str(ex))
+        sys.exit(1)
+    try:
+        CalibrationTable( ARGS.calibration ).reload()
+    except ValueError as ex:
+        log.error(str(ex))
+        sys.exit(1)
+
+    _partitions = partitions( ARGS.archive, ARGS.start, ARGS.end, ARGS.device )
+
+    # resume ?
+    _params = { 'archive': os.path.abspath(ARGS.archive), 'start': ARGS.start, 'end': ARGS.end,
+                'devices': ARGS.device, 'types': ARGS.types, 'calibration': ARGS.calibration }
+    _done = set()
+    if( os.path.exists(ARGS.checkpoint) ):
+        with open(ARGS.checkpoint) as f:
+            _checkpoint = json.load(f)
+        if( _checkpoint.get('params') != _params ):
+            log.error("checkpoint '%s' was made with other parameters: %s ... aborting" % (ARGS.checkpoint,str(_checkpoint.get('params'))))
+            sys.exit(1)
+        _done = set( _checkpoint.get('done', ()) )
+    _todo = [ _p for _p in _partitions if _p[0] not in _done ]
+    log.info("%d partitions, %d already done, %d workers, TYPE table '%s'" % (len(_partitions),len(_done),ARGS.workers,str(ARGS.types)))
+
+    _sink = JsonLinesSink( ARGS.output )
+    _totals = { 'frames': 0, 'measurements': 0, 'errors': 0 }
+    _failed = dict()    # { partition key: reason }
+    _broken = False     # a worker died: no more partitions submitted
+    _startTime = time.time()
+    _types_version = int(ARGS.types) if str(ARGS.types).isdigit() else str(ARGS.types)
+
+    with ProcessPoolExecutor( max_workers=ARGS.workers, initializer=_init_worker,
+                              initargs=( ARGS.types, ARGS.calibration ) ) as pool:
+        _running = dict()   # { future: partition key }
+        while( _todo or _running ):
+            # bounded number of partitions in flight (memory)
+            while( _todo and not _interrupted and not _broken and len(_running) < 2 * ARGS.workers ):
+                _partition = _todo.pop(0)
+                _running[ pool.submit( _reprocess, ARGS.archive, _partition, _types_version ) ] = _partition[0]
+            if( not _running ):
+                break
+            _completed = wait( _running, timeout=1.0, return_when=FIRST_COMPLETED )[0]
+            for _future in _completed:
+                _partitionKey = _running.pop(_future)
+                try:
+                    _key, _records, _stats = _future.result()
+                except Exception as ex:
+                    _broken = _broken or isinstance(ex, BrokenProcessPool)
+                    _failed[_partitionKey] = "%s: %s" % (type(ex).__name__,str(ex))
+                    log.error("partition %s failed: %s" % (_partitionKey,_failed[_partitionKey]))
+                    continue
+
+                # sink first, checkpoint then
+                _sink.write(_records)
+                _sink.sync()
+                _done.add(_key)
+                write_snapshot( ARGS.checkpoint, { 'params': _params, 'done': sorted(_done) } )
+
+                for _name in _totals:
+                    _totals[_name] += _stats[_name]
+                log.info("[%d/%d] partition %s: %d frames, %d measurements, %d errors (%.0f frames/s)" % (
+                            len(_done), len(_partitions), _key, _stats['frames'], _stats['measurements'],
+                            _stats['errors'], _totals['frames'] / max(time.time() - _startTime, 1e-3)))
+
+    _sink.close()
+    if( _failed or _broken ):
+        log.error("%d partition(s) failed: %s" % (len(_failed),", ".join(sorted(_failed))))
+        if( _todo ):
+            log.error("worker pool broken: %d partition(s) not started" % len(_todo))
+        log.error("%d partitions left, run again to retry" % (len(_partitions) - len(_done)))
+        sys.exit(3)
+    if( _interrupted and len(_done) < len(_partitions) ):
+        log.warning("interrupted: %d partitions left, run again to resume" % (len(_partitions) - len(_done)))
+        sys.exit(2)
+    log.info("reprocessing done: " + str(_totals))
+
+
+# Execution or import
+if __name__ == "__main__":
+
+    #
+    print("\n###\nneOCampus loradecoder reprocessing app.\n###")
+
+    # Parse arguments
+    parser = argparse.ArgumentParser( allow_abbrev=False,
+                         description="decodes again archived raw uplinks with a chosen TYPE table version" )
+    parser.add_argument( '-o', '--output', required=True,
+                        help="JSON lines file measurements get appended to." )
+    parser.add_argument( '--archive', default=settings.ARCHIVE_DIR,
+                        help="raw uplinks archive directory (default: %(default)s)." )
+    parser.add_argument( '--from', dest='start', type=epoch, default=None,
+                        help="start of history (epoch or ISO-8601 date, UTC)." )
+    parser.add_argument( '--to', dest='end', type=epoch, default=None,
+                        help="end of history (epoch or ISO-8601 date, UTC)." )
+    parser.add_argument( '--device', action='append', default=None,
+                        help="device (unitID) to reprocess, may be repeated (default: all)." )
+    parser.add_argument( '--types', default=str(TYPE_VERSION),
+                        help="TYPE table: version number or JSON file (default: %(default)s i.e current one)." )
+    parser.add_argument( '--calibration', default=settings.CALIBRATION_FILE,
+                        help="per-device calibration JSON file (default: %(default)s)." )
+    parser.add_argument( '--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of decoding processes (default: %(default)s)." )
+    parser.add_argument( '--checkpoint', default=None,
+                        help="progress file used to resume (default: <output>.checkpoint)." )
+    # debug mode
+    parser.add_argument( '-d', '--debug', action="store_true",
+                        help="Enable debug mode (default is False)." )
+
+    ARGS = parser.parse_args()
+    if( ARGS.checkpoint is None ):
+        ARGS.checkpoint = ARGS.output + '.checkpoint'
+    if( not ARGS.archive ):
+        parser.error("unspecified archive directory")
+
+    # defined debug mode ?
+    if( ARGS.debug is True or os.getenv("DEBUG")=='1' ):
+        log.info("DEBUG mode activation ...")
+        setLogLevel( logging.DEBUG )
+
+    # Start main app.
+    main()
+
+
+# The END - Jim Morrison 1943 - 1971
+#sys.exit(0)
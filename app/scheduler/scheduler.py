@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Main loop periodic tasks scheduler
+#
+# Periodic tasks (e.g batches flush, snapshots, liveness checks) are kept in a
+# heap ordered by due time: the main loop sleeps on its condition variable till
+# the next due task exactly (or till notified, e.g shutdown) instead of polling.
+#
+# Notes:
+#   tasks run in the main loop's thread, one after the other: they ought to be
+#   short. A task may return the epoch of its next run, otherwise it runs again
+#   <interval> seconds after its previous due time (missed runs are skipped).
+#   trigger() (e.g from a signal handler) gets a task to run at next wake-up,
+#   the heap is left untouched.
+#   the condition is only held while going to sleep, not while tasks run:
+#   trigger() from other threads (e.g mqtt_loop's) never waits for a task.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+import heapq
+from collections import deque
+
+# --- project related imports
+from logger.logger import log, getLogLevel
+
+
+
+# #############################################################################
+#
+# Class
+#
+class Scheduler(object):
+
+    # class attributes ( __class__.<attr_name> )
+
+    # objects attributes
+    _condition      = None      # main loop's condition variable
+    _shutdownEvent  = None
+
+
+    #
+    # object initialization
+    def __init__(self, condition, shutdownEvent, *args, **kwargs ):
+        self._condition     = condition
+        self._shutdownEvent = shutdownEvent
+        self._heap          = list()    # [ ( due, seq, name, interval, func ) ]
+        self._seq           = 0
+        self._tasks         = dict()    # { name: func }
+        self._triggered     = deque()   # names of tasks to run asap
+
+
+    ''' run func every interval seconds (first run after delay, default interval) '''
+    def every(self, name, interval, func, delay=None):
+        _due = time.time() + (interval if delay is None else delay)
+        self._tasks[name] = func
+        self._push( _due, name, float(interval), func )
+
+
+    ''' run func only when triggered '''
+    def on_demand(self, name, func):
+        self._tasks[name] = func
+
+
+    ''' run task <name> asap (thread and signal handler safe) '''
+    def trigger(self, name):
+        self._triggered.append(name)
+        with self._condition:
+            self._condition.notify()
+
+
+    ''' main loop: runs due tasks, then sleeps till next one or notification '''
+    def run(self):
+        while( not self._shutdownEvent.is_set() ):
+            self._run_triggered()
+            _next = self.run_pending()
+            with self._condition:
+                # triggered (or stopped) while tasks were running ?
+                if( self._triggered or self._shutdownEvent.is_set() ):
+                    continue
+                _timeout = None if _next is None else max(0.0, _next - time.time())
+                if( self._condition.wait( _timeout ) is True ):
+                    log.debug("interrupted ... maybe a shutdown ??")
+
+
+    ''' runs tasks due by now, returns due time of next task (None if no task) '''
+    def run_pending(self, now=None):
+        if( now is None ):
+            now = time.time()
+        while( self._heap and self._heap[0][0] <= now ):
+            _due, _seq, _name, _interval, _func = heapq.heappop(self._heap)
+            _next = None
+            try:
+                _next = _func()
+            except Exception as ex:
+                log.error("task '%s' failed: " % _name + str(ex), exc_info=(getLogLevel().lower()=="debug") )
+            now = time.time()
+            if( not isinstance(_next, (int, float)) or isinstance(_next, bool) ):
+                _next = _due + _interval
+                if( _next <= now ):
+                    # late: skip missed runs
+                    _next = now + _interval
+            self._push( _next, _name, _interval, _func )
+        return self._heap[0][0] if self._heap else None
+
+
+    ''' ask main loop to stop '''
+    def stop(self):
+        self._shutdownEvent.set()
+        with self._condition:
+            self._condition.notify()
+
+
+    # -------------------------------------------------------------------------
+    # Low-level functions
+    #
+
+    def _run_triggered(self):
+        while( self._triggered ):
+            _name = self._triggered.popleft()
+            _func = self._tasks.get(_name)
+            if( _func is None ):
+                log.warning("unknown task '%s' triggered" % str(_name))
+                continue
+            try:
+                _func()
+            except Exception as ex:
+                log.error("task '%s' failed: " % _name + str(ex), exc_info=(getLogLevel().lower()=="debug") )
+
+    def _push(self, due, name, interval, func):
+        self._seq += 1
+        heapq.heappush( self._heap, ( due, self._seq, name, interval, func ) )
+
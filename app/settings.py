@@ -37,6 +37,13 @@ LOG_LEVEL = logging.INFO
 #LOG_LEVEL = logging.DEBUG
 
 
+#
+# Runtime configuration overrides: JSON file with same keys as env. vars (e.g
+# MQTT_TOPICS, LOG_LEVEL, DECODE_CACHE_SIZE), read at startup and on SIGHUP
+# (None to disable, CONFIG_FILE env. var takes precedence)
+CONFIG_FILE = None
+
+
 #
 # MQTT settings
 MQTT_SERVER     = "neocampus.univ-tlse3.fr"
@@ -45,6 +52,13 @@ MQTT_PORT       = 1883
 MQTT_KEEP_ALIVE         = 60    # set accordingly to the mosquitto server setup
 MQTT_RECONNECT_DELAY    = 7     # minimum delay before retrying to connect (max. is 120 ---paho-mq  defaults)
 
+# shutdown: max. time (seconds) to drain in-flight messages and stop threads
+SHUTDOWN_TIMEOUT        = 5
+
+# readiness: file created once connected and subscribed, removed otherwise
+# (e.g container health check), None to disable
+READY_FILE              = "/tmp/loradecoder/ready"
+
 MQTT_USER       = ''
 MQTT_PASSWD     = ''
 
@@ -57,10 +71,168 @@ MQTT_TOPICS     = [ "TestTopic/lora/#" ]    # legacy stuff
 # or if destID=="all". unitID="None" means that there won't be any filter to the incoming messages.
 MQTT_UNITID     = None  # we're a reader, hence we accept all messages
 
+# disk spool of outgoing messages: while the broker is unreachable (or too many
+# messages are in-flight), messages get appended to this directory (None to
+# disable, mount a volume to survive container re-creation) then replayed, in
+# order, once connected again
+MQTT_SPOOL_DIR          = "/tmp/loradecoder/spool"
+MQTT_MAX_PENDING        = 1000              # in-flight messages before spooling
+SPOOL_SEGMENT_SIZE      = 4*1024*1024       # bytes per segment file
+SPOOL_MAX_SIZE          = 256*1024*1024     # bytes, oldest segments dropped beyond
+SPOOL_FSYNC_COUNT       = 100               # fsync every <xx> messages ...
+SPOOL_FSYNC_DELAY       = 1.0               # ... and every <xx> seconds (main loop's task)
+SPOOL_REPLAY_RATE       = 500               # messages per second
+
+# subscriptions control: messages { "dest": <unitID|all>, "order": "subscribe" |
+# "unsubscribe" | "topics", "topics": [ ... ] }, answers sent to <topic>/ack
+MQTT_CONTROL_TOPIC  = "TestTopic/lora/control"
+
 # data precision
 # floating point data will get rounded up to <xx> digits
 MQTT_DATA_PRECISION     = 2
 
 # possible timestamp keys in payload
-MQTT_PAYLOAD_TIMESTAMPS = [ 'datatime', 'timestamp', 'time' ]
+# ('datetime' is the one of lorawan-server frames)
+MQTT_PAYLOAD_TIMESTAMPS = [ 'datatime', 'datetime', 'timestamp', 'time' ]
 
+
+#
+# Decoder settings
+
+# output topic of decoded measurements (%s is the device's unitID)
+MQTT_OUTPUT_TOPIC       = "TestTopic/lora/%s/command"
+
+# binary encoding of decoded measurements per output topic prefix, JSON otherwise
+# { <topic prefix>: 'json' | 'cbor' | 'msgpack' } (cbor requires cbor2, msgpack requires msgpack)
+# messages received on these prefixes (e.g our own MQTT_TOPICS subscription,
+# STREAM_TOPICS) get decoded with the same encoding
+MQTT_OUTPUT_ENCODINGS   = dict()
+#MQTT_OUTPUT_ENCODINGS   = { "TestTopic/lora/": 'cbor' }
+
+# malformed frames quarantine
+# frames that fail to decode are sent by batches to this topic and/or appended
+# to this JSON-lines file (None to disable)
+QUARANTINE_TOPIC            = "TestTopic/lora/quarantine"
+QUARANTINE_FILE             = None
+QUARANTINE_BATCH_SIZE       = 50    # flush as soon as this number of frames is reached ...
+QUARANTINE_FLUSH_INTERVAL   = 30    # ... or every <xx> seconds
+QUARANTINE_MAX_DEVICES      = 10000 # devices with error counters (least recent evicted)
+
+# decoded frames memoization (LRU keyed by raw payload)
+# memory budget in bytes, 0 to disable
+DECODE_CACHE_SIZE           = 4*1024*1024
+DECODE_CACHE_STATS_INTERVAL = 300   # log cache (and deadband) stats every <xx> seconds
+
+# change-only publishing: a sample is published only if it differs from the last
+# published one by more than the deadband of its unit, or after heartbeat seconds
+# (disabled by default: collectors then store fewer samples)
+DEADBAND_ENABLED        = False
+DEADBAND_HEARTBEAT      = 900   # max. silence (seconds) of a channel
+DEADBAND_MAX_CHANNELS   = 100000
+DEADBANDS               = {     # { unit: { 'abs': <absolute>, 'rel': <ratio of last value> } }
+    'celcuis':  { 'abs': 0.5 },
+    '%r.H':     { 'abs': 1.0 },
+    'ppm':      { 'abs': 20, 'rel': 0.02 },
+    'lux':      { 'abs': 5, 'rel': 0.05 },
+    'mBar':     { 'abs': 1 },
+    'W/m2':     { 'rel': 0.02 },
+}
+
+# radio --> publish latency SLO
+LATENCY_SLO_P99             = 5.0       # seconds
+LATENCY_WINDOW              = 300       # p99 is checked at the end of each window (seconds)
+LATENCY_TOPIC_DEPTH         = 2         # latencies per input topic prefix of <xx> levels ...
+LATENCY_DEVICE_CLASS_KEY    = 'app'     # ... and per device class (frame's key)
+
+# per-device frame counters (i.e lost uplinks) snapshot read by the web app
+FRAME_COUNTER_SNAPSHOT          = "/tmp/loradecoder/frames.json"
+FRAME_COUNTER_SNAPSHOT_INTERVAL = 10    # seconds
+
+# latest value of each (device, channel) shared with the web app through a
+# memory-mapped file (None to disable)
+LATEST_INDEX_FILE       = "/dev/shm/loradecoder/latest"
+LATEST_INDEX_CAPACITY   = 65536     # max. number of (device, channel), 80 bytes each
+
+# web app. batch decoding (POST /decode)
+DECODE_API_MAX_BODY     = 16*1024*1024  # max. JSON array body (JSON lines bodies are streamed)
+DECODE_API_BATCH_SIZE   = 256           # frames decoded (and streamed back) at once
+
+# web app. live stream (GET /stream): decoded measurements topics (JSON encoded)
+STREAM_TOPICS           = [ "TestTopic/lora/+/command" ]
+STREAM_MAX_CLIENTS      = 12        # per uwsgi worker: each holds a thread, keep below
+                                    # application.ini's threads (16) for other requests
+STREAM_BUFFER           = 1000      # messages per client, slower clients get evicted
+STREAM_KEEPALIVE        = 15        # seconds
+
+# silent devices detection: a device is considered silent when it did not send
+# anything for <factor> x its usual reporting interval (bounded); alerts (and
+# back to life notifications) are sent to this topic
+LIVENESS_ENABLED        = True
+LIVENESS_ALERT_TOPIC    = "TestTopic/lora/alerts"
+LIVENESS_FACTOR         = 3.0
+LIVENESS_MIN_TIMEOUT    = 300       # seconds
+LIVENESS_MAX_TIMEOUT    = 86400     # seconds
+LIVENESS_FIRST_TIMEOUT  = 3600      # till an interval has been observed (seconds)
+LIVENESS_RESOLUTION     = 1.0       # silence detection granularity (seconds)
+
+# streaming rollups: min / max / mean / count per (device, channel) over tumbling
+# windows (seconds, empty list to disable) published to this topic tree (%s are
+# the window (e.g 1m, 1h) and the device's unitID); a window gets closed once
+# ROLLUP_LATENESS seconds elapsed after its end, later samples are ignored
+ROLLUP_WINDOWS          = [ 60, 3600 ]
+ROLLUP_TOPIC            = "TestTopic/lora/rollup/%s/%s"
+ROLLUP_LATENESS         = 10        # seconds
+ROLLUP_MAX_CHANNELS     = 65536     # max. number of (device, channel) per window
+
+# raw uplinks archive: every received frame appended to compressed, time
+# segmented files of this directory (None to disable, mount a volume to keep
+# it across container re-creation), read back by time range and device
+ARCHIVE_DIR             = "/tmp/loradecoder/archive"
+ARCHIVE_SEGMENT         = 3600          # seconds per segment file
+ARCHIVE_BLOCK_SIZE      = 64*1024       # uncompressed bytes per compressed block
+ARCHIVE_FLUSH_INTERVAL  = 30            # current block written at least every <xx> seconds
+ARCHIVE_RETENTION       = 30            # days, 0 to keep everything
+ARCHIVE_API_MAX_FRAMES  = 10000         # web app. max. frames per request
+
+# per-device linear calibration: JSON file (None to disable)
+#   { "<unitID>": { "<channel>": { "gain": 1.02, "offset": -0.3 } } }
+# reloaded whenever it changes (checked every <xx> seconds) and on SIGHUP
+CALIBRATION_FILE            = None
+CALIBRATION_CHECK_INTERVAL  = 60
+
+# physically impossible readings: values out of their type's range (see TYPE in
+# lora/cayenneLPP.py) are not published but sent to this topic.
+# Optional statistical test: values further than OUTLIER_THRESHOLD standard
+# deviations from their channel's rolling mean (standard deviation floored to
+# OUTLIER_MIN_SPREAD x type's range, real steps aren't rejected) get rejected too
+OUTLIER_FILTER_ENABLED  = False
+OUTLIER_TOPIC           = "TestTopic/lora/rejected"
+OUTLIER_STATISTICAL     = False     # range check only
+OUTLIER_THRESHOLD       = 6.0       # standard deviations
+OUTLIER_MIN_SPREAD      = 0.01      # standard deviation floor, fraction of type's range
+OUTLIER_ALPHA           = 0.05      # rolling statistics smoothing factor
+OUTLIER_WARMUP          = 10        # samples of a channel before the statistical test applies
+OUTLIER_MAX_REJECTS     = 5         # consecutive outliers accepted as a new level
+OUTLIER_MAX_CHANNELS    = 65536
+
+# legacy dataCOllector (old/legacy_collector.py): measures written to MongoDB by
+# batches (insert_many) of MONGO_BATCH_SIZE or every MONGO_FLUSH_INTERVAL seconds,
+# 'idMesure' taken from ranges of MONGO_ID_BLOCK ids reserved at once; a failed
+# batch is written again (delay doubled each time), then sent to 'failedData'
+MONGO_BATCH_SIZE        = 500
+MONGO_FLUSH_INTERVAL    = 5         # seconds
+MONGO_ID_BLOCK          = 1000
+MONGO_MAX_BUFFER        = 100000    # documents waiting, oldest dropped beyond
+MONGO_MAX_RETRIES       = 5
+MONGO_RETRY_DELAY       = 1.0       # seconds
+
+# live dataCOllector (old/live_collector.py): each database gets its own queue
+# (SINK_MAX_QUEUE messages, oldest dropped beyond) and worker thread writing by
+# batches of SINK_BATCH_SIZE messages or whatever is queued after SINK_BATCH_DELAY
+# seconds; a failed batch is written again SINK_MAX_RETRIES times at most
+SINK_MAX_QUEUE          = 10000
+SINK_BATCH_SIZE         = 100
+SINK_BATCH_DELAY        = 1.0       # seconds
+SINK_MAX_RETRIES        = 3
+SINK_RETRY_DELAY        = 1.0       # seconds, doubled after each failure
+SINK_STATS_INTERVAL     = 300       # seconds between sinks' stats logs
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# loradecoder benchmarks
+#
+# Run from the app directory:
+#   python3 tests/bench_decoder.py
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import sys
+import time
+import json
+import importlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+# app. directory holds project's modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lora.cayenneLPP import TYPE, str_to_int, transfo_data, decode_frame, decode_batch, MeasurementBatch
+from comm.payloadSerializer import PayloadSerializer
+from lora.timestamps import TimestampParser
+from lora.outlierFilter import OutlierFilter
+
+
+
+# #############################################################################
+#
+# Global variables
+# (scope: this file)
+#
+
+# same frame as in test_decoder.py
+#data :0x39 Lum = 421.00  0x44 Temp *C = 23.67  0x44 Hum. % = 31.93  0xFF Temp test: -10.80   0xFF Humi test: 5.00  0xFF CO2 test: 6000.00   0xFF Presence test: 1.00    Energy test: 60.80
+FRAME = "011E0539A50108440E09443F08FF8509FF0A0AFF701706FFFF0DFF3C00CC"
+
+UNITID = "auto_92F8"
+TOPIC_FORMAT = "TestTopic/lora/%s/command"
+
+# consumer side of output encodings
+_DECODERS = { 'json': ('json', 'loads'), 'cbor': ('cbor2', 'loads'), 'msgpack': ('msgpack', 'unpackb') }
+
+ROUNDS = 20000
+
+# app. directory (i.e where processes start)
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+#
+# legacy decoding (i.e [value, unit] lists), kept as a reference
+def _legacy_infodata(data_type):
+    for ind in TYPE :
+        if ind['ID'] == data_type :
+            if 'ref' in ind :
+                return [ind['nom'],ind['unit'],ind['size'],ind['mult'],ind['ref'],ind['pas']]
+            return [ind['nom'],ind['unit'],ind['size'],ind['mult']]
+    return False
+
+def _legacy_decode(payload):
+    frame = [ int(payload[i:i+2],16) for i in range(0,len(payload),2) ]
+    cursor = 2
+    measurements = []
+    while cursor < len(frame):
+        info = _legacy_infodata(frame[cursor])
+        cursor += 2
+        row_data = []
+        for i in range(info[2]):
+            row_data.append(frame[cursor])
+            cursor += 1
+        measurements.append( [transfo_data(info,row_data), info[1]] )
+    return measurements
+
+
+#
+# timing helper: returns microseconds per call
+def _timeit(func, *args, rounds=ROUNDS):
+    _start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - _start) * 1e6 / rounds
+
+
+#
+# memory allocated by <rounds> calls: ( retained, transient peak ) bytes per call
+def _allocated(func, *args, rounds=1000):
+    _keep = []
+    tracemalloc.start()
+    for _ in range(rounds):
+        _keep.append( func(*args) )
+    _retained = tracemalloc.get_traced_memory()[0] / rounds
+    tracemalloc.stop()
+
+    # transient allocations of a single call
+    tracemalloc.start()
+    _before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    func(*args)
+    _peak = tracemalloc.get_traced_memory()[1] - _before
+    tracemalloc.stop()
+    return _retained, _peak
+
+
+#
+# per-frame allocations: legacy lists vs Measurement records vs batch container
+def bench_allocations():
+    print("\n--- per-frame decoding (%d measurements/frame)" % len(decode_frame(str_to_int(FRAME))[0]))
+
+    _decode = lambda raw: decode_frame(str_to_int(raw))[0]
+    for _name, _func in [ ("legacy [value, unit] lists", _legacy_decode), ("Measurement records", _decode) ]:
+        print("%-26s : %6.2f us  %5d bytes/frame retained  %5d bytes peak" % (
+                (_name, _timeit(_func, FRAME)) + _allocated(_func, FRAME)) )
+
+    # whole batch kept in arrays (records are temporary)
+    _measurements = _decode(FRAME)
+    _rounds = 1000
+    tracemalloc.start()
+    _before = tracemalloc.get_traced_memory()[0]
+    _batch = MeasurementBatch()
+    for frame in range(_rounds):
+        _batch.extend(_measurements, frame)
+    _after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-26s :            %5d bytes/frame retained" % ("MeasurementBatch", (_after - _before) / _rounds))
+
+
+
+#
+# batch decoding: frame by frame vs compiled layouts
+def bench_batch(frames=2000):
+    print("\n--- batch decoding (%d frames, same layout)" % frames)
+    _frames = [ str_to_int(FRAME) ] * frames
+    print("decode_frame                : %6.2f us/frame" % (
+            _timeit(lambda l: [ decode_frame(f) for f in l ], _frames, rounds=50) / frames) )
+    print("decode_batch                : %6.2f us/frame" % (
+            _timeit(lambda l: list(decode_batch(l)), _frames, rounds=50) / frames) )
+
+
+
+#
+# output topic + payload of all measurements of a frame
+def bench_serialization():
+    print("\n--- per-frame serialization")
+    _measurements = decode_frame(str_to_int(FRAME))[0]
+
+    def _legacy(measurements):
+        for data in measurements:
+            topic = "TestTopic/lora/"+UNITID+"/command"
+            json.dumps({'unitID': UNITID, 'value': data.value, 'value_units': data.unit}, sort_keys=True)
+
+    _serializer = PayloadSerializer( TOPIC_FORMAT, precision=2 )
+    def _templates(measurements):
+        for data in measurements:
+            _serializer.topic(UNITID)
+            _serializer.serialize(UNITID, data)
+
+    print("json.dumps(sort_keys=True)  : %6.2f us" % _timeit(_legacy, _measurements))
+    print("PayloadSerializer           : %6.2f us" % _timeit(_templates, _measurements))
+
+
+
+#
+# network server timestamps
+def bench_timestamps():
+    print("\n--- timestamp parsing")
+    _value = "2020-11-23T14:05:12.523456Z"
+    _parser = TimestampParser( [ 'datetime' ] )
+    print("datetime.fromisoformat      : %6.2f us" % _timeit(
+            lambda v: datetime.fromisoformat(v.replace('Z','+00:00')).timestamp(), _value) )
+    print("TimestampParser.parse      : %6.2f us" % _timeit(_parser.parse, _value))
+
+
+#
+# outlier filter: per-sample cost (channels warming up, then fully checked)
+def bench_outliers(channels=1000):
+    print("\n--- outlier filter (per sample, %d channels)" % channels)
+    _samples = [ ( "dev%d" % (_i % channels), 1, 8, 20.0 + (_i % 7) * 0.25 ) for _i in range(10 * channels) ]
+
+    def _check_all(_filter):
+        for _sample in _samples:
+            _filter.check( *_sample )
+
+    _filter = OutlierFilter( TYPE )                     # default: range check only
+    _check_all(_filter)
+    print("range only                  : %6.2f us" % (_timeit(_check_all, _filter, rounds=20) / len(_samples)))
+    _filter = OutlierFilter( TYPE, statistical=True, warmup=3 )
+    _check_all(_filter)
+    print("range + rolling statistics  : %6.2f us" % (_timeit(_check_all, _filter, rounds=20) / len(_samples)))
+    print("rejected                    : " + str(_filter.stats()))
+
+
+#
+# output encodings: encode / decode cost and wire size of a measurement
+def bench_encodings():
+    print("\n--- output encodings (per measurement)")
+    _measurement = decode_frame(str_to_int(FRAME))[0][1]
+
+    for _name in [ 'json', 'cbor', 'msgpack' ]:
+        try:
+            _serializer = PayloadSerializer( TOPIC_FORMAT, precision=2,
+                                             encodings={ TOPIC_FORMAT.split('%')[0]: _name } )
+        except ValueError as ex:
+            print("%-8s: skipped (%s)" % (_name,str(ex)))
+            continue
+        _module, _func = _DECODERS[_name]
+        _decode = getattr( importlib.import_module(_module), _func )
+
+        _payload = _serializer.serialize(UNITID, _measurement)
+        print("%-8s: encode %5.2f us  decode %5.2f us  %3d bytes" % (_name,
+                _timeit(_serializer.serialize, UNITID, _measurement),
+                _timeit(_decode, _payload), len(_payload)) )
+
+
+#
+# process startup: fresh interpreter importing app. modules (i.e before connecting)
+def bench_startup(runs=5):
+    print("\n--- startup (fresh interpreter, median of %d runs)" % runs)
+
+    def _spawn(code, *options):
+        _start = time.perf_counter()
+        _res = subprocess.run( [ sys.executable ] + list(options) + [ '-c', code ],
+                               cwd=APP_DIR, capture_output=True, text=True )
+        return time.perf_counter() - _start, _res
+
+    _baseline = sorted( _spawn('pass')[0] for _ in range(runs) )[runs // 2]
+    print("%-24s : %7.1f ms" % ("interpreter", _baseline * 1e3))
+
+    for _module in [ 'loradecoder', 'application' ]:
+        _duration, _res = _spawn('import ' + _module)
+        if( _res.returncode != 0 ):
+            print("%-24s : skipped (%s)" % (_module, _res.stderr.strip().splitlines()[-1]))
+            continue
+        _duration = sorted( [_duration] + [ _spawn('import ' + _module)[0] for _ in range(runs - 1) ] )[runs // 2]
+        print("%-24s : %7.1f ms (+ %.1f ms)" % (_module, _duration * 1e3, (_duration - _baseline) * 1e3))
+
+        # heaviest imports (cumulative microseconds)
+        _res = _spawn('import ' + _module, '-X', 'importtime')[1]
+        _imports = []
+        for _line in _res.stderr.splitlines()[1:]:
+            _fields = _line.split('|')
+            if( len(_fields) == 3 ):
+                _imports.append( ( int(_fields[1]), _fields[2].strip() ) )
+        for _us, _name in sorted(_imports, reverse=True)[:5]:
+            print("    %-20s %7.1f ms" % (_name, _us / 1e3))
+
+
+
+# #############################################################################
+#
+# MAIN
+#
+def main():
+
+    bench_allocations()
+    bench_batch()
+    bench_serialization()
+    bench_encodings()
+    bench_timestamps()
+    bench_outliers()
+    bench_startup()
+
+
+
+if __name__ == "__main__":
+    main()
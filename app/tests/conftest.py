@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pytest configuration
+#
+# Run from the app directory:
+#   python3 -m pytest -q tests
+#
+# Notes:
+#   legacy scripts of this directory (broker connection / publishing tests,
+#   benchmarks) are run by hand, they're not collected.
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import sys
+
+# app. directory holds project's modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+collect_ignore = [ 'test.py', 'test2.py', 'testSettings.py', 'test_connect.py',
+                   'test_publish.py', 'test_decoder.py', 'mqttConnect.py', 'bench_decoder.py' ]
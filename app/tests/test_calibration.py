@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-device calibration tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import json
+
+import pytest
+
+# --- project related imports
+from lora.calibration import CalibrationTable
+from lora.cayenneLPP import Measurement
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+CALIBRATION = { "dev0": { "1": { "gain": 2.0, "offset": -1.0 }, "3": { "offset": 0.5 } } }
+TEMPERATURE = ( 'celsius', 1, 103 )
+HUMIDITY    = ( '%r.H.', 2, 104 )
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _write(path, content, mtime_ns=None):
+    with open(path, 'w') as f:
+        f.write( content if isinstance(content, str) else json.dumps(content) )
+    if( mtime_ns is not None ):
+        os.utime( path, ns=( mtime_ns, mtime_ns ) )
+    return str(path)
+
+
+def test_parse():
+    assert CalibrationTable.parse( CALIBRATION ) == { 'dev0': { 1: ( 2.0, -1.0 ), 3: ( 1.0, 0.5 ) } }
+    for _content in [ [], { "dev0": [] }, { "dev0": { "x": {} } }, { "dev0": { "1": 2.0 } },
+                      { "dev0": { "1": { "gain": "two" } } } ]:
+        with pytest.raises(ValueError):
+            CalibrationTable.parse( _content )
+
+
+def test_invalid_file_rejected_as_whole(tmp_path):
+    # first device valid, second one not: nothing loaded
+    _path = _write( tmp_path / 'calibration.json', dict(CALIBRATION, dev1={ "1": { "gain": None } }) )
+    _table = CalibrationTable( _path )
+    with pytest.raises(ValueError):
+        _table.reload()
+    assert len(_table) == 0 and _table.get('dev0', 1) is None
+
+
+def test_invalid_reload_keeps_current_table(tmp_path):
+    _path = _write( tmp_path / 'calibration.json', CALIBRATION, mtime_ns=10**18 )
+    _table = CalibrationTable( _path )
+    assert _table.reload() is True
+    for _content in [ "{ not json", { "dev0": { "1": { "gain": "two" } } } ]:
+        _write( _path, _content, mtime_ns=2 * 10**18 )
+        with pytest.raises(ValueError):
+            _table.reload()
+        assert _table.get('dev0', 1) == ( 2.0, -1.0 )
+    os.remove(_path)
+    with pytest.raises(ValueError):
+        _table.reload()
+    assert _table.get('dev0', 1) == ( 2.0, -1.0 )
+
+
+def test_reload_on_mtime_change(tmp_path):
+    _path = _write( tmp_path / 'calibration.json', CALIBRATION, mtime_ns=10**18 )
+    _table = CalibrationTable( _path )
+    assert _table.reload() is True
+    assert _table.reload() is False
+
+    # same mtime: not read again (unless forced)
+    _write( _path, { "dev1": {} }, mtime_ns=10**18 )
+    assert _table.reload() is False and _table.get('dev0', 1) == ( 2.0, -1.0 )
+    assert _table.reload( force=True ) is True and _table.get('dev0', 1) is None
+
+    _write( _path, { "dev0": { "1": { "gain": 3.0 } } }, mtime_ns=2 * 10**18 )
+    assert _table.reload() is True and _table.get('dev0', 1) == ( 3.0, 0.0 )
+
+    # no more file configured: table emptied
+    assert _table.reload( path='' ) is True and len(_table) == 0
+
+
+def test_apply(tmp_path):
+    _table = CalibrationTable( _write( tmp_path / 'calibration.json', CALIBRATION ) )
+    _table.reload()
+    _measurements = ( Measurement( 20.0, TEMPERATURE ), Measurement( 40.0, HUMIDITY ) )
+
+    # uncalibrated device: same measurements
+    assert _table.apply( 'dev1', _measurements ) is _measurements
+
+    _calibrated = _table.apply( 'dev0', _measurements )
+    assert _calibrated == ( Measurement( 39.0, TEMPERATURE ), Measurement( 40.0, HUMIDITY ) )
+    # uncalibrated channel untouched, originals (e.g decode cache) unchanged
+    assert _calibrated[1] is _measurements[1]
+    assert _measurements[0].value == 20.0
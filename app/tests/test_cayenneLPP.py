@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# neOCayenneLPP decoding tests
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import sys
+import copy
+import random
+from types import MappingProxyType
+
+import pytest
+
+from lora.cayenneLPP import TYPE, DecodeError, Measurement, str_to_int, decode_frame, decode_batch, info_table
+from lora.quarantine import QuarantineModule
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+# same frame as in test_decoder.py (8 measurements)
+FRAME = "011E0539A50108440E09443F08FF8509FF0A0AFF701706FFFF0DFF3C00CC"
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+def test_valid_frame():
+    _measurements, _error = decode_frame( str_to_int(FRAME) )
+    assert _error is None
+    assert len(_measurements) == 8
+    assert ( _measurements[0].value, _measurements[0].unit, _measurements[0].channel ) == ( 421.0, 'lux', 57 )
+
+
+def test_measurement_records_are_compact():
+    _first = decode_frame( str_to_int(FRAME) )[0]
+    _second = decode_frame( str_to_int(FRAME) )[0]
+    # one shared key per (unit, channel, type)
+    assert all( _a.key is _b.key for _a, _b in zip(_first, _second) )
+    assert sys.getsizeof(_first[0]) < sys.getsizeof( [ _first[0].value, _first[0].unit ] )
+    assert _first[0] == Measurement( 421.0, ( 'lux', 57, 5 ) )
+    assert ( _first[0].unit, _first[0].channel, _first[0].type_id ) == ( 'lux', 57, 5 )
+
+
+def test_measurement_records_are_immutable():
+    # records are shared (decode cache): no in-place update
+    _m = decode_frame( str_to_int(FRAME) )[0][0]
+    for _name, _value in [ ( 'value', 0.0 ), ( 'key', ( 'lux', 0, 5 ) ), ( 'unit', 'x' ), ( 'other', 1 ) ]:
+        with pytest.raises(AttributeError):
+            setattr(_m, _name, _value)
+    with pytest.raises(AttributeError):
+        del _m.value
+    assert _m == Measurement( 421.0, ( 'lux', 57, 5 ) )
+
+
+def test_bad_hex():
+    for _payload in [ "01F", "zz", None ]:
+        _measurements, _error = decode_frame( str_to_int(_payload) )
+        assert _measurements == ()
+        assert _error.reason == DecodeError.BAD_HEX
+
+
+def test_too_short_and_bad_version():
+    assert decode_frame( bytes([1]) )[1].reason == DecodeError.TOO_SHORT
+    assert decode_frame( bytes([2, 0, 5, 1, 0, 0]) )[1].reason == DecodeError.BAD_VERSION
+
+
+def test_truncated_frame_keeps_previous_measurements():
+    # luminosity complete, then temperature without its data byte
+    _measurements, _error = decode_frame( bytes([1, 0, 5, 1, 0xA5, 0x01, 8, 2]) )
+    assert [ _m.value for _m in _measurements ] == [ 421.0 ]
+    assert _error.reason == DecodeError.TRUNCATED
+    assert ( _error.offset, _error.type_id ) == ( 6, 8 )
+
+    # type without channel
+    _measurements, _error = decode_frame( bytes([1, 0, 5, 1, 0xA5, 0x01, 8]) )
+    assert len(_measurements) == 1
+    assert ( _error.reason, _error.offset ) == ( DecodeError.TRUNCATED, 6 )
+
+
+def test_unknown_type():
+    _measurements, _error = decode_frame( bytes([1, 0, 5, 1, 0xA5, 0x01, 0x63, 1, 0]) )
+    assert len(_measurements) == 1
+    assert ( _error.reason, _error.offset, _error.type_id ) == ( DecodeError.UNKNOWN_TYPE, 6, 0x63 )
+
+
+def test_trailing_bytes():
+    # a single byte after the last measurement: not even a type + channel
+    _measurements, _error = decode_frame( str_to_int(FRAME + "05") )
+    assert len(_measurements) == 8
+    assert _error.reason == DecodeError.TRUNCATED
+    assert _error.offset == len(FRAME) // 2
+
+
+def test_unsupported_type():
+    # GPS on 9 bytes
+    _measurements, _error = decode_frame( bytes([1, 0, 12, 1] + [0] * 9) )
+    assert _measurements == ()
+    assert ( _error.reason, _error.type_id ) == ( DecodeError.UNSUPPORTED, 12 )
+
+
+def test_quarantine_batches_notify_instead_of_flushing():
+    _published = []
+    _notified = []
+    _quarantine = QuarantineModule( publish=lambda topic, payload: _published.append(payload),
+                                    topic='q', batch_size=2, notify=lambda: _notified.append(1) )
+    _error = decode_frame( bytes([1]) )[1]
+    for _ in range(3):
+        _quarantine.add( 'dev', 'topic', '01', _error )
+    # batch full: main loop notified once, nothing written by add()
+    assert _notified == [ 1 ]
+    assert _published == []
+    assert _quarantine.flush() == 3
+    assert len(_published) == 1
+
+
+def test_quarantine_counters_bounded():
+    _quarantine = QuarantineModule( max_devices=2 )
+    _error = decode_frame( bytes([1]) )[1]
+    for _device in [ 'a', 'b', 'a', 'c' ]:
+        _quarantine.add( _device, 'topic', '01', _error )
+    # 'b' is the least recently failing device
+    assert set(_quarantine.counters()) == { 'a', 'c' }
+    assert _quarantine.counters()['a'] == { DecodeError.TOO_SHORT: 2 }
+    assert _quarantine.evicted() == 1
+
+
+def test_info_table_leaves_types_untouched():
+    # read-only TYPE dicts: any write raises TypeError
+    _types = [ MappingProxyType(dict(_ind)) for _ind in TYPE ]
+    _copy = copy.deepcopy(TYPE)
+    _info = info_table(_types)
+    assert TYPE == _copy
+    assert _info[8][:2] == ( 'temperature', 'celcuis' )
+
+
+def test_compiled_layouts_match_decode_frame():
+    # random layouts, each one sent many times with random values (compiled
+    # plans), some frames corrupted (decode_frame fallback)
+    _rng = random.Random(41)
+    _types = [ _ind['ID'] for _ind in TYPE ]
+    _sizes = { _ind['ID']: _ind['size'] for _ind in TYPE }
+    _frames = list()
+    for _ in range(200):
+        _layout = [ ( _rng.choice(_types), _rng.randrange(256) ) for _ in range(_rng.randint(1, 6)) ]
+        for _ in range(_rng.randint(1, 10)):
+            _frame = [ 1, _rng.randrange(256) ]
+            for _type, _channel in _layout:
+                _frame += [ _type, _channel ] + [ _rng.randrange(256) for _ in range(_sizes[_type]) ]
+            _corruption = _rng.random()
+            if( _corruption < 0.05 ):
+                _frame = _frame[:_rng.randrange(len(_frame))]
+            elif( _corruption < 0.1 ):
+                _frame[_rng.randrange(len(_frame))] = _rng.randrange(256)
+            _frames.append( bytes(_frame) )
+    _rng.shuffle(_frames)
+
+    _plans = dict()
+    for _frame, ( _measurements, _error ) in zip(_frames, decode_batch(_frames, _plans)):
+        _expected, _expectedError = decode_frame(_frame)
+        assert _measurements == _expected, _frame.hex()
+        assert [ type(_m.value) for _m in _measurements ] == [ type(_m.value) for _m in _expected ]
+        if( _expectedError is None ):
+            assert _error is None
+        else:
+            assert ( _error.reason, _error.offset ) == ( _expectedError.reason, _expectedError.offset )
+    # compiled plans were actually used
+    assert _plans
+
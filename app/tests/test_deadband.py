@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Change-only publishing tests
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import settings
+from lora.deadband import DeadbandIndex
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+def test_disabled_by_default():
+    assert settings.DEADBAND_ENABLED is False
+
+
+def test_deadband_and_heartbeat():
+    _index = DeadbandIndex( deadbands={ 'celsius': { 'abs': 0.5 } }, heartbeat=900 )
+    assert _index.should_publish( 'dev', 1, 'celsius', 20.0, now=0 ) is True
+    assert _index.should_publish( 'dev', 1, 'celsius', 20.2, now=10 ) is False
+    assert _index.should_publish( 'dev', 1, 'celsius', 20.6, now=20 ) is True
+    # unchanged but heartbeat elapsed since last publish
+    assert _index.should_publish( 'dev', 1, 'celsius', 20.6, now=919 ) is False
+    assert _index.should_publish( 'dev', 1, 'celsius', 20.6, now=920 ) is True
+
+
+def test_monotonic_clock():
+    _index = DeadbandIndex( heartbeat=900 )
+    assert _index.should_publish( 'dev', 1, 'lux', 10.0 ) is True
+    assert _index._times[0] < 1e9       # not an epoch
+
+
+def test_bounded_index():
+    _index = DeadbandIndex( heartbeat=100, max_channels=2 )
+    assert _index.should_publish( 'a', 1, 'lux', 1.0, now=0 )
+    assert _index.should_publish( 'b', 1, 'lux', 1.0, now=50 )
+    # full, nothing silent for long enough: published, not tracked
+    assert _index.should_publish( 'c', 1, 'lux', 1.0, now=60 )
+    assert _index.stats()['untracked'] == 1
+    assert _index.stats()['channels'] == 2
+
+    # 'a' silent for more than heartbeat: its slot is reused
+    assert _index.should_publish( 'c', 1, 'lux', 1.0, now=120 )
+    assert _index.stats()['channels'] == 2
+    assert _index.should_publish( 'c', 1, 'lux', 1.0, now=130 ) is False
+    assert _index.should_publish( 'b', 1, 'lux', 1.0, now=130 ) is False
+    assert len(_index._values) == 2
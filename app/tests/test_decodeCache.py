@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Decoded frames memoization tests
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import pytest
+
+from lora.cayenneLPP import DecodeError, str_to_int, decode_frame
+from lora.decodeCache import DecodeCache
+from lora.quarantine import QuarantineModule
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+FRAME = "011E0539A50108440E09443F08FF8509FF0A0AFF701706FFFF0DFF3C00CC"
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+def test_hit_after_put():
+    _cache = DecodeCache( 1024*1024 )
+    _measurements = decode_frame( str_to_int(FRAME) )[0]
+    assert _cache.get(FRAME) is None
+    _cache.put( FRAME, _measurements )
+    assert _cache.get(FRAME) is _measurements
+
+
+@pytest.mark.parametrize( 'raw', [ [ 1, 30, 5 ], { 'data': FRAME }, 42 ] )
+def test_unhashable_or_non_string_payload(raw):
+    _cache = DecodeCache( 1024*1024 )
+    assert _cache.get(raw) is None
+    _cache.put( raw, () )
+    assert _cache.get(raw) is None
+    # not a hex string: structured error (i.e quarantined), not a TypeError
+    assert decode_frame( str_to_int(raw) )[1].reason == DecodeError.BAD_HEX
+
+
+@pytest.mark.parametrize( 'raw', [ [ 1, 30, 5 ], { 'data': FRAME } ] )
+def test_handler_quarantines_non_string_payload(raw, monkeypatch):
+    pytest.importorskip('paho')
+    import loradecoder
+    _quarantine = QuarantineModule()
+    monkeypatch.setattr( loradecoder, 'quarantine', _quarantine )
+    monkeypatch.setattr( loradecoder, 'decodeCache', DecodeCache( 1024*1024 ) )
+    loradecoder.myMsgHandler( 'TestTopic/lora/test', { 'appargs': 'dev', 'data': raw } )
+    assert _quarantine.counters() == { 'dev': { DecodeError.BAD_HEX: 1 } }
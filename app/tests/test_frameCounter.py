@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-device frame counters index tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import pytest
+
+# --- project related imports
+from lora.frameCounter import FrameCounterIndex
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def test_gaps_duplicates_and_rollover():
+    _index = FrameCounterIndex()
+    assert _index.update( 'dev', 10, now=1.0 ) == 0
+    assert _index.update( 'dev', 13, now=2.0 ) == 2
+    assert _index.update( 'dev', 13, now=3.0 ) == 0
+    _index.update( 'dev', 0xFFFE, now=4.0 )
+    assert _index.update( 'dev', 1, now=5.0 ) == 2
+    _entry = _index.get('dev')
+    assert ( _entry['frames'], _entry['duplicates'], _entry['resets'] ) == ( 5, 1, 0 )
+
+
+@pytest.mark.parametrize( 'fcnt', [ -1, 2 ** 64, 'abc' ] )
+def test_bad_fcnt_leaves_index_consistent(fcnt):
+    _index = FrameCounterIndex()
+    _index.update( 'known', 5, now=1.0 )
+    for _device in ( 'new', 'known' ):
+        with pytest.raises( ValueError ):
+            _index.update( _device, fcnt, now=2.0 )
+    assert len(_index) == 1
+    assert _index.get('new') is None
+    assert _index.get('known')['fcnt'] == 5 and _index.get('known')['frames'] == 1
+
+    # rows still aligned
+    _index.update( 'new', 7, now=3.0 )
+    assert _index.snapshot() == { 'known': _index.get('known'), 'new': _index.get('new') }
+    assert _index.get('new')['fcnt'] == 7
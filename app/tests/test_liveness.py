@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Timer wheel and silent devices detection tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import random
+
+# --- project related imports
+from lora.liveness import TimerWheel, LivenessTracker
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def test_empty_wheel_has_no_deadline():
+    _wheel = TimerWheel( slots=8, levels=3, now=0 )
+    assert _wheel.next_deadline() is None
+    _wheel.schedule( 'a', 5 )
+    _wheel.cancel( 'a' )
+    assert _wheel.next_deadline() is None
+
+
+def test_expiry_at_deadline():
+    _wheel = TimerWheel( slots=8, levels=3, now=0 )
+    _wheel.schedule( 'a', 5 )
+    assert _wheel.next_deadline() == 5
+    assert _wheel.advance( 4 ) == []
+    assert _wheel.advance( 5 ) == [ 'a' ]
+    assert len(_wheel) == 0
+
+
+def test_cascade_across_levels():
+    # levels: 1s, 8s and 64s slots, range 512s
+    _wheel = TimerWheel( slots=8, levels=3, now=0 )
+    _deadlines = { 'l0': 7, 'l1': 50, 'l2': 300, 'far': 2000 }
+    for _key, _deadline in _deadlines.items():
+        _wheel.schedule( _key, _deadline )
+
+    _expired = dict()
+    _now = 0
+    _wakeups = 0
+    while( len(_wheel) ):
+        _next = _wheel.next_deadline()
+        assert _next > _now
+        _now = _next
+        _wakeups += 1
+        for _key in _wheel.advance( _now ):
+            _expired[_key] = _now
+    assert _expired == _deadlines
+    # only non-empty slots' times, not every tick
+    assert _wakeups < 30
+
+
+def test_next_deadline_never_late():
+    random.seed(1)
+    _wheel = TimerWheel( slots=8, levels=3, now=0 )
+    _deadlines = { _i: random.randint(1, 1500) for _i in range(200) }
+    for _key, _deadline in _deadlines.items():
+        _wheel.schedule( _key, _deadline )
+
+    _now = 0
+    while( len(_wheel) ):
+        _now = _wheel.next_deadline()
+        for _key in _wheel.advance( _now ):
+            assert _deadlines.pop(_key) == _now
+    assert not _deadlines
+
+
+def test_rearm_on_uplink():
+    _tracker = LivenessTracker( factor=2.0, min_timeout=10, max_timeout=1000, first_timeout=100 )
+    _tracker._wheel = TimerWheel( now=0 )
+    _tracker.update( 'dev', now=0 )
+    assert _tracker.next_check( now=0 ) == 10   # new devices may expire sooner
+    _tracker.update( 'dev', now=20 )            # interval 20s --> 40s timeout
+    assert _tracker.expired( now=59 ) == []
+    _tracker.update( 'dev', now=50 )            # EWMA 22s --> 44s timeout
+    assert _tracker.expired( now=90 ) == []
+    assert _tracker.expired( now=94 ) == [ ( 'dev', 50, 22.0 ) ]
+    assert _tracker.next_check( now=94 ) is None
+    assert _tracker.stats() == { 'devices': 1, 'silent': 1, 'scheduled': 0 }
+
+    # back again
+    assert _tracker.update( 'dev', now=200 ) is True
+    assert _tracker.stats()['silent'] == 0
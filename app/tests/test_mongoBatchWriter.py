@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Buffered MongoDB writer tests
+#
+# Notes:
+#   run with pytest from the app directory
+#   in-memory collections stand for pymongo ones (insert_many, update_one,
+#   find_one, find_one_and_update): failures get injected per call
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import pytest
+
+# --- project related imports
+from database.mongoBatchWriter import MongoBatchWriter
+
+
+
+# #############################################################################
+#
+# Class
+#
+class BulkWriteError(Exception):
+    ''' pymongo.errors.BulkWriteError stand-in '''
+
+    def __init__(self, errors):
+        super().__init__("batch op errors occurred")
+        self.details = { 'writeErrors': errors }
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.documents  = list()
+        self.batches    = list()    # sizes of insert_many() calls
+        self.failures   = list()    # next insert_many() calls: exception or { index: error code }
+
+    def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        self.batches.append( len(documents) )
+        _failure = self.failures.pop(0) if self.failures else None
+        if( isinstance(_failure, Exception) ):
+            raise _failure
+        _failure = _failure or dict()
+        self.documents.extend( _d for _i, _d in enumerate(documents) if _i not in _failure )
+        if( _failure ):
+            raise BulkWriteError( [ { 'index': _i, 'code': _code } for _i, _code in sorted(_failure.items()) ] )
+
+    def find_one(self, sort=None):
+        _field, _order = sort[0]
+        _documents = sorted( ( _d for _d in self.documents if _field in _d ), key=lambda _d: _d[_field] )
+        return ( _documents[-1] if _order < 0 else _documents[0] ) if _documents else None
+
+    def find_one_and_update(self, key, update):
+        # returns document before update (pymongo default)
+        for _document in self.documents:
+            if( _document['_id'] == key['_id'] ):
+                _before = dict(_document)
+                for _field, _inc in update['$inc'].items():
+                    _document[_field] += _inc
+                return _before
+        return None
+
+    def update_one(self, key, update, upsert=False):
+        for _document in self.documents:
+            if( _document['_id'] == key['_id'] ):
+                break
+        else:
+            assert upsert
+            _document = dict(key, seq=0)
+            self.documents.append(_document)
+        for _field, _value in update['$max'].items():
+            _document[_field] = max( _document[_field], _value )
+
+
+class FakeDatabase(dict):
+
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _writer(db, **kwargs):
+    _params = dict( batch_size=3, id_block=4, max_retries=3, retry_delay=1.0 )
+    _params.update(kwargs)
+    return MongoBatchWriter( db, **_params )
+
+
+def test_batching():
+    _db = FakeDatabase()
+    _notified = list()
+    _writer_ = _writer( _db, notify=lambda: _notified.append(True) )
+    for _i in range(7):
+        _writer_.insert( { 'value': _i } )
+    # batch full: main loop notified once
+    assert _notified == [ True ]
+    assert _writer_.pending() == 7
+
+    _writer_.flush( now=0 )
+    assert _db['measure'].batches == [ 3, 3, 1 ]
+    assert [ _d['value'] for _d in _db['measure'].documents ] == list(range(7))
+    assert _writer_.stats()['inserted'] == 7 and _writer_.pending() == 0
+
+
+def test_no_database_access_on_insert():
+    _db = FakeDatabase()
+    _writer_ = _writer( _db )
+    _document = { 'value': 1 }
+    _writer_.insert( _document )
+    # ids are assigned by flush() (main loop), not by insert() (mqtt_loop)
+    assert 'idMesure' not in _document and len(_db) == 0
+
+
+def test_partial_failure_split():
+    _db = FakeDatabase()
+    _writer_ = _writer( _db )
+    # second document failed, third one already written by a previous attempt
+    _db['measure'].failures.append( { 1: 121, 2: 11000 } )
+    for _i in range(3):
+        _writer_.insert( { 'value': _i } )
+    _writer_.flush( now=0 )
+    _stats = _writer_.stats()
+    assert ( _stats['inserted'], _stats['duplicates'], _stats['errors'], _stats['pending'] ) == ( 2, 1, 1, 1 )
+
+    # failed document only is written again
+    _writer_.flush( now=1 )
+    assert _db['measure'].batches == [ 3, 1 ]
+    assert sorted( _d['value'] for _d in _db['measure'].documents ) == [ 0, 1 ]
+    assert _writer_.pending() == 0
+
+
+def test_retry_backoff():
+    _db = FakeDatabase()
+    _writer_ = _writer( _db, max_retries=4 )
+    _db['measure'].failures.extend( [ RuntimeError("server down") ] * 2 )
+    _writer_.insert( { 'value': 1 } )
+
+    # 1s, then 2s after each failure
+    assert _writer_.flush( now=100 ) == 101
+    assert _writer_.flush( now=100.5 ) == 101
+    assert _db['measure'].batches == [ 1 ]
+    assert _writer_.flush( now=101 ) == 103
+    assert _writer_.flush( now=103 ) > 103
+    assert _db['measure'].batches == [ 1, 1, 1 ]
+    _stats = _writer_.stats()
+    assert ( _stats['inserted'], _stats['retried'], _stats['pending'] ) == ( 1, 2, 0 )
+
+
+def test_given_up_batch_sent_to_failed_collection():
+    _db = FakeDatabase()
+    _writer_ = _writer( _db, max_retries=2 )
+    _db['measure'].failures.extend( [ RuntimeError("validation") ] * 2 )
+    _writer_.insert( { 'value': 1, 'datemesure': 'today' } )
+    _writer_.flush( now=0 )
+    _writer_.flush( now=1 )
+    # written to the failed documents' collection by next flush
+    _writer_.flush( now=2 )
+    assert _db['measure'].documents == []
+    _failed = _db['failedData'].documents
+    assert len(_failed) == 1
+    assert ( _failed[0]['collection'], _failed[0]['date'], _failed[0]['document']['value'] ) == ( 'measure', 'today', 1 )
+    assert _writer_.stats()['failed'] == 1
+
+
+def test_failed_documents_shape():
+    # e.g legacy failedData { topic, date, payload }
+    _db = FakeDatabase()
+    _to_failed = lambda collection, document: { 'topic': document['data']['uri'], 'date': document['datemesure'],
+                                                'payload': document['data']['payload'] }
+    _writer_ = _writer( _db, max_retries=1, to_failed=_to_failed )
+    _db['measure'].failures.append( RuntimeError("validation") )
+    _writer_.insert( { 'datemesure': 'today', 'data': { 'uri': 'u4/room/dev/1', 'payload': { 'value': 1 } } } )
+    _writer_.flush( now=0 )
+    _writer_.flush( now=0 )
+    assert _db['failedData'].documents == [ { 'topic': 'u4/room/dev/1', 'date': 'today', 'payload': { 'value': 1 } } ]
+
+
+def test_close_doesnt_wait_for_retries():
+    _db = FakeDatabase()
+    _writer_ = _writer( _db, max_retries=5 )
+    _db['measure'].failures.extend( [ RuntimeError("server down") ] * 2 )
+    for _i in range(2):
+        _writer_.insert( { 'value': _i } )
+    _writer_.flush( now=0 )
+    # pending retry attempted once more right away, then sent to failed documents
+    assert _writer_.close() == 0
+    assert _db['measure'].batches == [ 2, 2 ] and _db['measure'].documents == []
+    assert sorted( _d['document']['value'] for _d in _db['failedData'].documents ) == [ 0, 1 ]
+
+    # failed documents collection unavailable as well: lost documents counted
+    _writer_ = _writer( _db )
+    _db['measure'].failures.extend( [ RuntimeError("server down") ] * 2 )
+    _db['failedData'].failures.extend( [ RuntimeError("server down") ] * 2 )
+    _writer_.insert( { 'value': 3 } )
+    assert _writer_.close() == 1
+    assert _writer_.stats()['dropped'] == 1
+
+
+def test_id_ranges_continuity():
+    _db = FakeDatabase()
+    _db['measure'].documents.append( { 'idMesure': 41 } )
+    _writer_ = _writer( _db )
+    for _i in range(10):
+        _writer_.insert( { 'value': _i } )
+    _writer_.flush( now=0 )
+    # after existing documents, sequential across blocks of 4 ids
+    assert [ _d['idMesure'] for _d in _db['measure'].documents[1:] ] == list(range(42, 52))
+    assert _db['counters'].documents == [ { '_id': 'measure.idMesure', 'seq': 54 } ]
+
+    # restart: ids after the last reserved block, never reused
+    _writer_ = _writer( _db )
+    _writer_.insert( { 'value': 10 } )
+    _writer_.flush( now=1 )
+    assert _db['measure'].documents[-1]['idMesure'] == 54
+
+
+def test_ids_kept_while_counters_unavailable():
+    _db = FakeDatabase()
+    _db['counters'].find_one_and_update = lambda *args, **kwargs: (_ for _ in ()).throw( RuntimeError("down") )
+    _writer_ = _writer( _db )
+    _writer_.insert( { 'value': 1 } )
+    _writer_.flush( now=0 )
+    assert _db['measure'].batches == [] and _writer_.pending() == 1
+
+    del _db['counters'].find_one_and_update
+    _writer_.flush( now=1 )
+    assert [ _d['idMesure'] for _d in _db['measure'].documents ] == [ 0 ]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Physically impossible readings filter tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import pytest
+
+# --- project related imports
+import settings
+from lora.cayenneLPP import TYPE
+from lora.outlierFilter import OutlierFilter
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+TEMPERATURE     = 8
+HUMIDITY        = 9
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def test_disabled_by_default():
+    assert settings.OUTLIER_FILTER_ENABLED is False
+    assert settings.OUTLIER_STATISTICAL is False
+
+
+@pytest.mark.parametrize( 'statistical', [ False, True ] )
+def test_hard_range_check(statistical):
+    _filter = OutlierFilter( TYPE, statistical=statistical )
+    assert _filter.check( 'dev', 1, TEMPERATURE, 85.5 ) == OutlierFilter.OUT_OF_RANGE
+    assert _filter.check( 'dev', 1, TEMPERATURE, -40.25 ) == OutlierFilter.OUT_OF_RANGE
+    assert _filter.check( 'dev', 1, HUMIDITY, 100.5 ) == OutlierFilter.OUT_OF_RANGE
+    assert _filter.check( 'dev', 1, TEMPERATURE, 21.0 ) is None
+    # types without range limits aren't checked
+    assert _filter.check( 'dev', 2, 1, 1e9 ) is None
+    assert _filter.rejected( OutlierFilter.OUT_OF_RANGE ) == 3
+
+
+def test_range_only_keeps_no_state():
+    _filter = OutlierFilter( TYPE )
+    for _ in range(30):
+        assert _filter.check( 'dev', 1, TEMPERATURE, 20.0 ) is None
+    assert _filter.check( 'dev', 1, TEMPERATURE, 60.0 ) is None
+    assert _filter.stats()['channels'] == 0
+
+
+@pytest.mark.parametrize( 'type_id, level, step', [ ( TEMPERATURE, 20.0, 1.75 ), ( HUMIDITY, 40.0, 4.0 ) ] )
+def test_real_steps_accepted(type_id, level, step):
+    _filter = OutlierFilter( TYPE, statistical=True )
+    for _ in range(30):
+        assert _filter.check( 'dev', 1, type_id, level ) is None
+    for _ in range(10):
+        assert _filter.check( 'dev', 1, type_id, level + step ) is None
+    assert _filter.rejected( OutlierFilter.OUTLIER ) == 0
+
+
+def test_spike_rejected_then_new_level():
+    _filter = OutlierFilter( TYPE, statistical=True, max_rejects=3 )
+    for _ in range(30):
+        _filter.check( 'dev', 1, TEMPERATURE, 20.0 )
+    # within range but 20 degrees off a steady signal
+    assert _filter.check( 'dev', 1, TEMPERATURE, 40.0 ) == OutlierFilter.OUTLIER
+    assert _filter.check( 'dev', 1, TEMPERATURE, 20.25 ) is None
+    # sensor moved: accepted after max_rejects
+    assert [ _filter.check( 'dev', 1, TEMPERATURE, 40.0 ) for _ in range(4) ] == [ OutlierFilter.OUTLIER ] * 3 + [ None ]
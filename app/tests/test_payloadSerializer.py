@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Output payloads serialization tests
+#
+# Notes:
+#   run with pytest from the app directory
+#   binary encodings stand-in: pickle (cbor2 and msgpack are optional)
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# --- project related imports
+from comm import payloadSerializer
+from comm.payloadSerializer import PayloadSerializer, payload_decoders
+from lora.cayenneLPP import Measurement
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+TOPIC       = "TestTopic/lora/%s/command"
+
+
+
+# #############################################################################
+#
+# Functions
+#
+@pytest.fixture
+def binary(monkeypatch):
+    monkeypatch.setitem( payloadSerializer.ENCODINGS, 'cbor', ( 'pickle', 'dumps', 'loads' ) )
+
+
+def test_json_payloads():
+    _serializer = PayloadSerializer( TOPIC, precision=2 )
+    for _value, _timestamp in [ ( 21.456, None ), ( 3, 1600000000.12345 ), ( float('nan'), 1.0 ) ]:
+        _expected = { 'unitID': 'dev0', 'value': _serializer.round(_value), 'value_units': 'celsius' }
+        if( _timestamp is not None ):
+            _expected['timestamp'] = round(_timestamp, 3)
+        assert _serializer.serialize( 'dev0', Measurement( _value, ( 'celsius', 1, 8 ) ), _timestamp ) == \
+                    json.dumps( _expected, sort_keys=True )
+
+
+def test_binary_topics_decoded(binary):
+    _serializer = PayloadSerializer( TOPIC, precision=2, encodings={ "TestTopic/lora/": 'cbor', "TestTopic/lora/json": 'json' } )
+    _payload = _serializer.serialize( 'dev0', Measurement( 21.456, ( 'celsius', 1, 8 ) ), 1.0 )
+    assert isinstance(_payload, bytes)
+    assert isinstance( _serializer.serialize( 'json0', Measurement( 1, ( 'celsius', 1, 8 ) ) ), str )
+
+    _decoders = payload_decoders( { "TestTopic/lora/": 'cbor', "TestTopic/lora/json": 'json' } )
+    assert [ _prefix for _prefix, _decode in _decoders ] == [ "TestTopic/lora/" ]
+    assert _decoders[0][1](_payload) == { 'unitID': 'dev0', 'value': 21.46, 'value_units': 'celsius', 'timestamp': 1.0 }
+
+    with pytest.raises(ValueError):
+        payload_decoders( { "TestTopic/": 'xml' } )
+
+
+def test_own_subscription_to_binary_topics(binary):
+    # decoder subscribed to its own (binary encoded) output: no JSON errors
+    pytest.importorskip('paho')
+    from comm.mqttConnect import CommModule
+
+    _encodings = { "TestTopic/lora/": 'cbor' }
+    _client = CommModule( 'user', 'passwd', [ "TestTopic/lora/#" ], dest_filter=False, payload_encodings=_encodings )
+    _received = list()
+    _client.handle_message = lambda topic, payload: _received.append( ( topic, payload ) )
+
+    _serializer = PayloadSerializer( TOPIC, encodings=_encodings )
+    _payload = _serializer.serialize( 'dev0', Measurement( 3, ( 'lux', 1, 5 ) ) )
+    _client._on_message( None, None, SimpleNamespace( topic=_serializer.topic('dev0'), payload=_payload ) )
+    _client._on_message( None, None, SimpleNamespace( topic="Other/lora", payload=b'{"data": "0100"}' ) )
+    assert _received == [ ( "TestTopic/lora/dev0/command", { 'unitID': 'dev0', 'value': 3, 'value_units': 'lux' } ),
+                          ( "Other/lora", { 'data': "0100" } ) ]
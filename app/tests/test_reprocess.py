@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Archive reprocessing tests
+#
+# Notes:
+#   run with pytest from the app directory
+#   workers are forked: partition decoding stand-ins of this module are
+#   available to them
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import copy
+import json
+import argparse
+
+import pytest
+
+# --- project related imports
+import reprocess
+from lora.cayenneLPP import TYPE
+from lora.uplinkArchive import ArchiveWriter
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+FRAME       = "011E0539A50108440E09443F08FF8509FF0A0AFF701706FFFF0DFF3C00CC"
+START       = 1600002000    # first segment (hour aligned)
+SEGMENTS    = 4             # one hour each
+
+_reprocess  = reprocess._reprocess
+
+
+
+# #############################################################################
+#
+# Functions
+#
+
+# partition decoding stand-ins (run in workers)
+def _failing(archive_dir, partition, types_version):
+    if( partition[1] == START + 3600 ):
+        raise KeyError('unit')
+    return _reprocess(archive_dir, partition, types_version)
+
+def _crashing(archive_dir, partition, types_version):
+    os._exit(1)
+
+
+def _archive(directory):
+    _writer = ArchiveWriter( directory, segment=3600 )
+    for _segment in range(SEGMENTS):
+        for _i in range(3):
+            _writer.append( 'TestTopic/lora/dev', 'dev', { 'data': FRAME }, rxTime=START + _segment * 3600 + _i )
+    _writer.close()
+
+
+def _args(tmp_path, types='1', calibration=None):
+    return argparse.Namespace( archive=str(tmp_path / 'archive'), output=str(tmp_path / 'out.jsonl'),
+                               checkpoint=str(tmp_path / 'out.jsonl.checkpoint'), start=None, end=None,
+                               device=None, types=types, calibration=calibration, workers=2 )
+
+
+def _bad_tables():
+    _tables = list()
+    for _field in ( 'ID', 'nom', 'unit', 'size', 'mult' ):
+        _tables.append( [ { _k: _v for _k, _v in TYPE[0].items() if _k != _field } ] )
+    _tables.append( [ dict(TYPE[7], unit=None) ] )
+    _tables.append( [ dict(TYPE[7], size=0) ] )
+    _tables.append( [ dict(TYPE[7], mult=0) ] )
+    _tables.append( [ dict(TYPE[7], ID=256) ] )
+    _tables.append( [ TYPE[0], dict(TYPE[1], ID=TYPE[0]['ID']) ] )
+    _tables.append( [ { _k: _v for _k, _v in TYPE[7].items() if _k != 'pas' } ] )
+    _tables.append( [ dict(TYPE[7], ref='20') ] )
+    return _tables
+
+
+def test_current_table_is_valid():
+    assert reprocess.check_types(TYPE) is TYPE
+
+
+@pytest.mark.parametrize( 'types', _bad_tables() )
+def test_invalid_table_rejected_before_pool(types, tmp_path, monkeypatch):
+    _path = tmp_path / 'types.json'
+    _path.write_text( json.dumps(types) )
+    with pytest.raises( ValueError ):
+        reprocess.load_types( str(_path) )
+
+    _archive( str(tmp_path / 'archive') )
+    monkeypatch.setattr( reprocess, 'ARGS', _args(tmp_path, types=str(_path)) )
+    with pytest.raises( SystemExit ) as ex:
+        reprocess.main()
+    assert ex.value.code == 1
+    assert not os.path.exists( tmp_path / 'out.jsonl' )
+
+
+def test_failed_partition_reported_then_retried(tmp_path, monkeypatch):
+    _archive( str(tmp_path / 'archive') )
+    _types = copy.deepcopy(TYPE)
+    monkeypatch.setattr( reprocess, 'ARGS', _args(tmp_path) )
+    monkeypatch.setattr( reprocess, '_reprocess', _failing )
+    with pytest.raises( SystemExit ) as ex:
+        reprocess.main()
+    assert ex.value.code == 3
+    with open( tmp_path / 'out.jsonl.checkpoint' ) as f:
+        assert json.load(f)['done'] == sorted( str(START + _s * 3600) for _s in ( 0, 2, 3 ) )
+
+    # run again: failed partition only
+    monkeypatch.setattr( reprocess, '_reprocess', _reprocess )
+    reprocess.main()
+    with open( tmp_path / 'out.jsonl' ) as f:
+        _records = [ json.loads(_line) for _line in f ]
+    assert len(_records) == SEGMENTS * 3 * 8
+    assert TYPE == _types
+
+
+def test_broken_pool_reported(tmp_path, monkeypatch):
+    _archive( str(tmp_path / 'archive') )
+    monkeypatch.setattr( reprocess, 'ARGS', _args(tmp_path) )
+    monkeypatch.setattr( reprocess, '_reprocess', _crashing )
+    with pytest.raises( SystemExit ) as ex:
+        reprocess.main()
+    assert ex.value.code == 3
+    assert not os.path.exists( tmp_path / 'out.jsonl.checkpoint' )
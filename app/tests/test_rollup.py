@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Streaming rollups tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+
+# --- project related imports
+from lora.rollup import RollupAggregator
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+NOW = 1600000040.0      # 20s into a 60s window
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _aggregator():
+    _rollup = RollupAggregator( 60, lateness=10 )
+    _rollup._watermark = _rollup._start( NOW - 10 ) - 60
+    return _rollup
+
+
+def test_window_closes_after_lateness():
+    _rollup = _aggregator()
+    _start = _rollup._start( NOW )
+    for _value in ( 20.0, 22.0, 21.0 ):
+        assert _rollup.update( 'dev', 1, 'celsius', _value, NOW, now=NOW )
+
+    # still open during lateness tolerance
+    assert _rollup.close( now=_start + 60 + 9 ) == []
+    assert _rollup.update( 'dev', 1, 'celsius', 23.0, _start + 59, now=_start + 65 )
+    assert _rollup.next_close( now=NOW ) == _start + 60 + 10
+
+    _closed = _rollup.close( now=_start + 60 + 10 )
+    assert [ ( _s, _d, _c ) for _s, _d, _c, _acc in _closed ] == [ ( _start, 'dev', 1 ) ]
+    _acc = _closed[0][3]
+    assert ( _acc.count, _acc.min, _acc.max, _acc.total / _acc.count ) == ( 4, 20.0, 23.0, 21.5 )
+    assert _rollup.stats()['open'] == 0
+
+
+def test_late_samples_dropped():
+    _rollup = _aggregator()
+    _start = _rollup._start( NOW )
+    _rollup.close( now=_start + 60 + 10 )
+    assert _rollup.update( 'dev', 1, 'celsius', 20.0, _start + 30, now=_start + 71 ) is False
+    assert _rollup.stats()['late'] == 1
+    # next window still open
+    assert _rollup.update( 'dev', 1, 'celsius', 20.0, _start + 61, now=_start + 71 ) is True
+
+
+def test_future_samples_dropped():
+    _rollup = _aggregator()
+    assert _rollup.update( 'dev', 1, 'celsius', 20.0, NOW + 60, now=NOW ) is True
+    for _ahead in ( 61, 3600, 10 * 365 * 86400 ):
+        assert _rollup.update( 'dev', 1, 'celsius', 20.0, NOW + _ahead, now=NOW ) is False
+    _stats = _rollup.stats()
+    assert ( _stats['future'], _stats['samples'], _stats['open'] ) == ( 3, 1, 1 )
+    # open windows bounded: at most current and next ones
+    assert len(_rollup._open) <= 2
+
+
+def test_default_clock():
+    _rollup = RollupAggregator( 60, lateness=10 )
+    assert _rollup.update( 'dev', 1, 'celsius', 20.0, time.time() )
+    assert _rollup.update( 'dev', 1, 'celsius', 20.0, time.time() + 3600 ) is False
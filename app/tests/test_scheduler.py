@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Main loop scheduler tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+import threading
+
+# --- project related imports
+from scheduler.scheduler import Scheduler
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _start(scheduler):
+    _thread = threading.Thread( target=scheduler.run, daemon=True )
+    _thread.start()
+    return _thread
+
+
+def test_trigger_does_not_wait_for_running_task():
+    _scheduler = Scheduler( threading.Condition(), threading.Event() )
+    _running = threading.Event()
+    _release = threading.Event()
+    _flushed = threading.Event()
+
+    def _slow():
+        # e.g a batch written to a slow database
+        _running.set()
+        _release.wait( 5 )
+
+    _scheduler.every( 'slow', 3600, _slow, delay=0 )
+    _scheduler.on_demand( 'flush', _flushed.set )
+    _thread = _start(_scheduler)
+    assert _running.wait( 5 )
+
+    _start_time = time.perf_counter()
+    _scheduler.trigger( 'flush' )
+    assert time.perf_counter() - _start_time < 0.5
+
+    # triggered task runs as soon as the running one is over
+    _release.set()
+    assert _flushed.wait( 5 )
+    _scheduler.stop()
+    _thread.join( 5 )
+    assert not _thread.is_alive()
+
+
+def test_task_next_due_time():
+    _scheduler = Scheduler( threading.Condition(), threading.Event() )
+    _runs = list()
+    _next = time.time() + 1000
+    _scheduler.every( 'task', 10, lambda: _runs.append(True) or _next, delay=0 )
+    assert _scheduler.run_pending() == _next
+    assert _runs == [ True ]
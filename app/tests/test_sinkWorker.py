@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Per-sink bounded queue and batching worker tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import threading
+
+# --- project related imports
+from database.sinkWorker import SinkWorker
+
+
+
+# #############################################################################
+#
+# Class
+#
+class MessageSink(object):
+    ''' per-message sink: payloads listed in <failing> always fail, first
+        <flaky> calls fail '''
+
+    def __init__(self, failing=(), flaky=0):
+        self.written    = list()
+        self.calls      = 0
+        self._failing   = set(failing)
+        self._flaky     = flaky
+
+    def msgHandler(self, topic, payload, **kwargs):
+        self.calls += 1
+        if( payload in self._failing or self.calls <= self._flaky ):
+            raise RuntimeError("write failed")
+        self.written.append( ( topic, payload, kwargs ) )
+
+
+class BatchSink(MessageSink):
+    ''' batch sink: batches sizes recorded '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches    = list()
+
+    def msgBatchHandler(self, messages):
+        self.batches.append( len(messages) )
+        for _topic, _payload, _kwargs in messages:
+            self.msgHandler( _topic, _payload, **_kwargs )
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _worker(sink, **kwargs):
+    _params = dict( batch_size=10, batch_delay=0.05, max_retries=3, retry_delay=0.01 )
+    _params.update(kwargs)
+    return SinkWorker( 'test', sink, threading.Event(), **_params )
+
+
+def test_batching():
+    _sink = BatchSink()
+    _worker_ = _worker( _sink, batch_delay=10 )
+    for _i in range(25):
+        _worker_.put( 'topic', _i, { 'timestamp': 1 } )
+    _worker_.start()
+    # close: queued messages written, last batch not waiting for batch_delay
+    _worker_.close( 5 )
+    assert not _worker_.is_alive()
+    assert _sink.batches == [ 10, 10, 5 ]
+    assert [ _m[1] for _m in _sink.written ] == list(range(25))
+    _stats = _worker_.stats()
+    assert ( _stats['written'], _stats['batches'], _stats['max_batch_size'], _stats['queued'] ) == ( 25, 3, 10, 0 )
+
+
+def test_queue_overflow_drops_oldest():
+    _sink = MessageSink()
+    _worker_ = _worker( _sink, max_queue=5 )
+    for _i in range(8):
+        _worker_.put( 'topic', _i, {} )
+    _stats = _worker_.stats()
+    assert ( _stats['queued'], _stats['dropped'] ) == ( 5, 3 )
+    _worker_.start()
+    _worker_.close( 5 )
+    assert [ _m[1] for _m in _sink.written ] == [ 3, 4, 5, 6, 7 ]
+
+
+def test_retry_then_written():
+    _sink = MessageSink( flaky=2 )
+    _worker_ = _worker( _sink )
+    _worker_.put( 'topic', 'payload', {} )
+    _worker_.start()
+    _worker_.close( 5 )
+    _stats = _worker_.stats()
+    assert ( _stats['written'], _stats['errors'], _stats['dropped'] ) == ( 1, 2, 0 )
+    assert _sink.calls == 3
+
+
+def test_failing_message_only_dropped():
+    # 1 bad + 9 good messages, per-message sink
+    _sink = MessageSink( failing=[ 0 ] )
+    _worker_ = _worker( _sink )
+    for _i in range(10):
+        _worker_.put( 'topic', _i, {} )
+    _worker_.start()
+    _worker_.close( 5 )
+    assert [ _m[1] for _m in _sink.written ] == list(range(1, 10))
+    _stats = _worker_.stats()
+    assert ( _stats['written'], _stats['dropped'], _stats['errors'] ) == ( 9, 1, 3 )
+
+
+def test_failing_batch_dropped_as_a_whole():
+    _sink = BatchSink( failing=[ 0 ] )
+    _worker_ = _worker( _sink )
+    for _i in range(10):
+        _worker_.put( 'topic', _i, {} )
+    _worker_.start()
+    _worker_.close( 5 )
+    assert _sink.batches == [ 10, 10, 10 ]
+    _stats = _worker_.stats()
+    assert ( _stats['written'], _stats['dropped'] ) == ( 0, 10 )
+
+
+def test_close_drains_queue():
+    _sink = MessageSink()
+    _worker_ = _worker( _sink, batch_size=1000, batch_delay=60 )
+    _worker_.start()
+    for _i in range(100):
+        _worker_.put( 'topic', _i, {} )
+    _worker_.close( 5 )
+    assert not _worker_.is_alive()
+    assert len(_sink.written) == 100 and _worker_.stats()['queued'] == 0
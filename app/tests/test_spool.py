@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Disk spool of outgoing MQTT messages tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import sys
+import signal
+import subprocess
+
+# --- project related imports
+from comm.spool import Spool
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# appends then gets killed: no close(), no fsync (fsync_count never reached)
+WRITER = """
+import os, signal, sys
+from comm.spool import Spool
+_spool = Spool( sys.argv[1], fsync_count=10 ** 6 )
+for _i in range(50):
+    _spool.append( 'TestTopic/lora/dev%d' % _i, '{"value": %d}' % _i )
+os.kill( os.getpid(), signal.SIGKILL )
+"""
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _replay(spool):
+    _records = list()
+    while( spool.readable() ):
+        for _position, _topic, _payload in spool.read(16):
+            _records.append( ( _topic, _payload ) )
+            spool.commit(_position)
+    return _records
+
+
+def test_replay_after_crash(tmp_path):
+    _res = subprocess.run( [ sys.executable, '-c', WRITER, str(tmp_path) ], cwd=APP_DIR )
+    assert _res.returncode == -signal.SIGKILL
+
+    _spool = Spool( str(tmp_path) )
+    assert _spool.backlog()
+    assert _replay(_spool) == [ ( 'TestTopic/lora/dev%d' % _i, b'{"value": %d}' % _i ) for _i in range(50) ]
+    assert not _spool.backlog()
+    _spool.close()
+
+    # committed cursor persisted: nothing to replay again
+    _spool = Spool( str(tmp_path) )
+    assert not _spool.backlog() and _replay(_spool) == []
+    _spool.close()
+
+
+def test_torn_record_truncated(tmp_path):
+    _spool = Spool( str(tmp_path) )
+    _spool.append( 'topic/a', 'first' )
+    _spool.append( 'topic/b', 'second' )
+    _path = _spool._path( _spool._end[0] )
+    _size = os.path.getsize(_path)
+    _spool.close()
+
+    # crash in the middle of a record
+    with open(_path, 'r+b') as f:
+        f.truncate( _size - 3 )
+
+    _spool = Spool( str(tmp_path) )
+    assert _replay(_spool) == [ ( 'topic/a', b'first' ) ]
+    # new records appended after the valid ones
+    _spool.append( 'topic/c', 'third' )
+    assert _replay(_spool) == [ ( 'topic/c', b'third' ) ]
+    _spool.close()
+
+
+def test_sync(tmp_path):
+    _spool = Spool( str(tmp_path), fsync_count=10 ** 6 )
+    _spool.append( 'topic/a', 'first' )
+    assert _spool._unsynced == 1
+    _spool.sync()
+    assert _spool._unsynced == 0
+    _spool.close()
+    # closed spool: periodic task is harmless
+    _spool.sync()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Decoder startup duration test
+#
+# The decoder used to wait for fixed sleeps at startup (supervisord's
+# 'sleep 5' wrapper, 1s more in SIM mode): it's now driven by readiness only.
+# A stub comm module (no broker) gets connected and subscribed after a short
+# handshake, startup ought to take about that long.
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import time
+import threading
+
+import pytest
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+OLD_SLEEPS      = 5 + 1     # seconds of fixed sleeps before readiness
+HANDSHAKE       = 0.05      # stub broker connection + subscriptions (seconds)
+
+_GLOBALS        = [ '_shutdownEvent', '_condition', 'scheduler', 'config', 'mqtt_client', 'serializer',
+                    'quarantine', 'decodeCache', 'deadband', 'latency', 'frameCounters', 'liveness',
+                    'latestValues', 'rollups', 'outliers', 'calibration', 'archive' ]
+
+
+
+# #############################################################################
+#
+# Class
+#
+class StubComm(threading.Thread):
+    ''' CommModule stand-in: ready once its handshake is over, stops main loop
+        as soon as it's running '''
+
+    def __init__(self, decoder, **params):
+        super().__init__( daemon=True )
+        self._decoder   = decoder
+        self._ready     = threading.Event()
+        self.readyAt    = None
+        self.loopAt     = None
+
+    def run(self):
+        # connection and subscriptions acknowledged
+        time.sleep( HANDSHAKE )
+        self.readyAt = time.perf_counter()
+        self._ready.set()
+
+        # main loop reached ?
+        while( self._decoder.scheduler is None and time.perf_counter() - self.readyAt < OLD_SLEEPS ):
+            time.sleep( 0.005 )
+        self.loopAt = time.perf_counter()
+        if( self._decoder.scheduler is not None ):
+            self._decoder.scheduler.stop()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def register_status(self, name, handler):
+        pass
+
+    def send_message(self, topic, payload):
+        return True
+
+    def stop_handling(self):
+        pass
+
+    def close(self):
+        pass
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def test_startup_driven_by_readiness(tmp_path, monkeypatch):
+    pytest.importorskip('paho')
+    import loradecoder
+
+    # decoder's state restored afterwards
+    for _name in _GLOBALS:
+        monkeypatch.setattr( loradecoder, _name, None )
+    monkeypatch.setattr( loradecoder.signal, 'signal', lambda *args: None )
+
+    _env = { 'MQTT_SERVER': 'localhost', 'MQTT_USER': 'user', 'MQTT_PASSWD': 'passwd',
+             'MQTT_TOPICS': '["TestTopic/lora/#"]', 'CONFIG_FILE': str(tmp_path / 'none.json'),
+             'READY_FILE': str(tmp_path / 'ready'), 'FRAME_COUNTER_SNAPSHOT': str(tmp_path / 'frames.json'),
+             'LATEST_INDEX_FILE': '', 'ARCHIVE_DIR': '', 'CALIBRATION_FILE': '', 'MQTT_SPOOL_DIR': '' }
+    for _key, _value in _env.items():
+        monkeypatch.setenv( _key, _value )
+
+    _clients = list()
+    def _comm(**params):
+        _clients.append( StubComm( loradecoder, **params ) )
+        return _clients[-1]
+    monkeypatch.setattr( loradecoder, 'CommModule', _comm )
+
+    _start = time.perf_counter()
+    loradecoder.main()
+    _client = _clients[0]
+
+    assert _client.readyAt is not None and _client.loopAt is not None
+    assert _client.readyAt - _start < HANDSHAKE + 1.0
+    assert _client.loopAt - _start < OLD_SLEEPS / 4
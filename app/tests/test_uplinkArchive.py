@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Raw uplinks archive tests
+#
+# Notes:
+#   run with pytest from the app directory
+#
+
+
+
+# #############################################################################
+#
+# Import zone
+#
+import os
+import time
+import zlib
+
+# --- project related imports
+from lora.uplinkArchive import ArchiveWriter, ArchiveReader, segments, device_mask
+
+
+
+# #############################################################################
+#
+# Global variables
+#
+
+START       = 1600002000    # first segment (100s segments)
+DEVICES     = [ 'dev%d' % _i for _i in range(4) ]
+
+
+
+# #############################################################################
+#
+# Functions
+#
+def _archive(directory, **kwargs):
+    ''' 3 segments, one uplink per second from each device in turn '''
+    _params = dict( segment=100, block_size=512 )
+    _params.update(kwargs)
+    _writer = ArchiveWriter( directory, **_params )
+    _uplinks = list()
+    for _i in range(300):
+        _uplink = ( 'TestTopic/lora/' + DEVICES[_i % 4], DEVICES[_i % 4], { 'data': "%04X" % _i }, START + _i )
+        _writer.append( *_uplink )
+        _uplinks.append( _uplink )
+    return _writer, _uplinks
+
+
+def _expected(uplinks, device=None, start=None, end=None):
+    return [ { 't': _t, 'topic': _topic, 'device': _device, 'frame': _frame }
+                for _topic, _device, _frame, _t in uplinks
+                    if( (device is None or _device == device) and
+                        (start is None or _t >= start) and (end is None or _t <= end) ) ]
+
+
+def test_range_reads_across_segments(tmp_path):
+    _writer, _uplinks = _archive( str(tmp_path) )
+    _writer.close()
+    assert segments( str(tmp_path) ) == [ START, START + 100, START + 200 ]
+
+    _reader = ArchiveReader( str(tmp_path) )
+    assert list(_reader.frames()) == _expected(_uplinks)
+    for _device, _start, _end in [ ( 'dev1', None, None ), ( None, START + 50, START + 150 ),
+                                   ( 'dev2', START + 95, START + 205 ), ( 'dev3', START + 300, None ),
+                                   ( 'unknown', None, None ) ]:
+        assert list(_reader.frames( _device, _start, _end )) == _expected(_uplinks, _device, _start, _end)
+    assert list(_reader.segment_frames( START + 100, 'dev0' )) == _expected(_uplinks, 'dev0', START + 100, START + 199)
+
+
+def test_blocks_skipped(tmp_path, monkeypatch):
+    # one device per block: others' blocks never decompressed
+    _writer = ArchiveWriter( str(tmp_path), segment=1000, block_size=1 )
+    for _i in range(40):
+        _writer.append( 'topic', DEVICES[_i % 2], { 'data': '00' }, START + _i )
+    _writer.close()
+    assert device_mask('dev0') != device_mask('dev1')
+
+    _decompressed = list()
+    _decompress = zlib.decompress
+    monkeypatch.setattr( zlib, 'decompress', lambda data: _decompressed.append(1) or _decompress(data) )
+    _reader = ArchiveReader( str(tmp_path) )
+    assert len(list(_reader.frames( 'dev0' ))) == 20
+    assert len(_decompressed) == 20
+
+    # binary search: blocks before start not read
+    del _decompressed[:]
+    assert [ _f['t'] for _f in _reader.frames( start=START + 30 ) ] == list(range(START + 30, START + 40))
+    assert len(_decompressed) == 10
+
+
+def test_unindexed_block_truncated(tmp_path):
+    _writer, _uplinks = _archive( str(tmp_path) )
+    _writer.close()
+
+    # crash: block written without index entry, torn index entry
+    _base = os.path.join( str(tmp_path), str(START + 200) )
+    with open(_base + '.blocks', 'ab') as f:
+        f.write( zlib.compress(b'{"t":0}\n') )
+    with open(_base + '.idx', 'ab') as f:
+        f.write( b'\x01\x02\x03' )
+
+    _writer = ArchiveWriter( str(tmp_path), segment=100, block_size=512 )
+    _writer.append( 'topic', 'dev0', { 'data': 'FF' }, START + 300 - 0.5 )
+    _writer.close()
+    _frames = list( ArchiveReader( str(tmp_path) ).frames( start=START + 200 ) )
+    assert _frames == _expected(_uplinks, start=START + 200) + [ { 't': START + 299.5, 'topic': 'topic',
+                                                                   'device': 'dev0', 'frame': { 'data': 'FF' } } ]
+
+
+def test_retention_purge(tmp_path):
+    _now = time.time()
+    _writer = ArchiveWriter( str(tmp_path), segment=3600, retention=1 )
+    _writer.append( 'topic', 'dev0', {}, _now - 3 * 86400 )
+    _writer.append( 'topic', 'dev0', {}, _now - 2 * 3600 )
+    # segments older than retention removed on segment opening
+    _writer.append( 'topic', 'dev0', {}, _now )
+    _writer.close()
+    assert [ _f['t'] for _f in ArchiveReader( str(tmp_path) ).frames() ] == [ round(_now - 2 * 3600, 3), round(_now, 3) ]
+
+
+def test_append_once_closed(tmp_path):
+    _writer = ArchiveWriter( str(tmp_path), segment=100, block_size=64 )
+    _writer.append( 'topic', 'dev0', { 'data': '00' }, START )
+    _writer.close()
+    # e.g uplinks handled during shutdown: dropped, no error
+    for _i in range(10):
+        _writer.append( 'topic', 'dev0', { 'data': '0000000000' }, START + _i )
+    _writer.flush()
+    _writer.close()
+    assert _writer.stats()['dropped'] == 10
+    assert len(list( ArchiveReader( str(tmp_path) ).frames() )) == 1